@@ -0,0 +1,639 @@
+# bench.py
+"""性能基准。结果以 JSON 打印到 stdout，方便不同版本之间对比。
+
+用法：
+  python bench.py lookup [--sizes 10000,100000,300000] [--queries 300]
+  python bench.py readload [--modes thread,async] [--concurrency 200] [--requests 5000]
+  python bench.py prepared [--rows 100000] [--queries 5000]
+  python bench.py roundtrips [--modes no_reset,reset_session] [--requests 2000] [--concurrency 20]
+  python bench.py bomindex [--items 100000] [--queries 2000] [--mysql]
+  python bench.py wire [--rows 200000]
+  python bench.py keyset [--rows 1000000] [--pages 200] [--page-size 1000]
+  python bench.py metrics [--requests 200000]
+
+需要连本地/测试 MySQL（与 main.py 同一套 DB_* 环境变量），
+只会创建/删除 bench_ 开头的临时表，不碰业务表。
+"""
+import argparse, asyncio, json, random, statistics, time
+import migrations
+
+def _pct(samples: list[float], p: float) -> float:
+    s = sorted(samples)
+    return s[min(len(s) - 1, int(round(p / 100.0 * (len(s) - 1))))]
+
+def _summary(samples: list[float]) -> dict:
+    """samples 为秒，输出微秒"""
+    return {
+        "n": len(samples),
+        "mean_us": round(statistics.fmean(samples) * 1e6, 1),
+        "p50_us": round(_pct(samples, 50) * 1e6, 1),
+        "p95_us": round(_pct(samples, 95) * 1e6, 1),
+        "p99_us": round(_pct(samples, 99) * 1e6, 1),
+    }
+
+def _rand_tid(rnd: random.Random) -> str:
+    # 设备上报的 TID 大小写不固定，混着来
+    h = "%024x" % rnd.getrandbits(96)
+    return h.upper() if rnd.random() < 0.5 else h
+
+# ---------- lookup：UPPER(tid)=UPPER(%s) vs tid_key=%s ----------
+def bench_lookup(args) -> dict:
+    rnd = random.Random(args.seed)
+    sizes = sorted(int(x) for x in args.sizes.split(","))
+    conn = migrations.connect()
+    cur = conn.cursor()
+    results = []
+    try:
+        cur.execute("DROP TABLE IF EXISTS bench_rfid_tags")
+        cur.execute("""
+            CREATE TABLE bench_rfid_tags (
+                tid VARCHAR(64) NOT NULL,
+                label_number VARCHAR(64) NULL,
+                item VARCHAR(64) NULL,
+                tid_key VARCHAR(128) AS (UPPER(tid)) STORED,
+                label_key VARCHAR(128) AS (UPPER(label_number)) STORED,
+                UNIQUE KEY uk_tid_key (tid_key),
+                KEY ix_label_key (label_key)
+            )
+        """)
+        tids: list[str] = []
+        for size in sizes:
+            batch = []
+            while len(tids) < size:
+                t = _rand_tid(rnd)
+                tids.append(t)
+                batch.append((t, "L%09d" % len(tids), "BATT-%04d" % rnd.randrange(5000)))
+                if len(batch) >= 5000 or len(tids) == size:
+                    cur.executemany("INSERT INTO bench_rfid_tags (tid, label_number, item) VALUES (%s,%s,%s)", batch)
+                    batch = []
+            cur.execute("ANALYZE TABLE bench_rfid_tags")
+            cur.fetchall()
+
+            probes = [rnd.choice(tids).swapcase() for _ in range(args.queries)]
+            for mode, sql, conv in (
+                ("upper_scan", "SELECT tid, item FROM bench_rfid_tags WHERE UPPER(tid)=UPPER(%s) LIMIT 1", str),
+                ("key_index", "SELECT tid, item FROM bench_rfid_tags WHERE tid_key=%s LIMIT 1", str.upper),
+            ):
+                samples = []
+                for t in probes:
+                    t0 = time.perf_counter()
+                    cur.execute(sql, (conv(t),))
+                    cur.fetchall()
+                    samples.append(time.perf_counter() - t0)
+                results.append({"rows": size, "mode": mode, **_summary(samples)})
+    finally:
+        if not args.keep:
+            cur.execute("DROP TABLE IF EXISTS bench_rfid_tags")
+        cur.close()
+        conn.close()
+    return {"bench": "lookup", "results": results}
+
+# ---------- readload：GET /tags/by-tid 并发压测，线程模式 vs DB_ASYNC 原生异步 ----------
+async def _drive_by_tid(app, api_key: str, tids: list[str], total: int, concurrency: int, seed: int) -> dict:
+    import httpx
+    rnd = random.Random(seed)
+    samples, errors, left = [], 0, [total]
+    async def _worker(client):
+        nonlocal errors
+        while left[0] > 0:
+            left[0] -= 1
+            t0 = time.perf_counter()
+            r = await client.get("/tags/by-tid", params={"tid": rnd.choice(tids)}, headers={"x-api-key": api_key})
+            samples.append(time.perf_counter() - t0)
+            if r.status_code != 200:
+                errors += 1
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=30) as client:
+        t0 = time.perf_counter()
+        await asyncio.gather(*(_worker(client) for _ in range(concurrency)))
+        wall = time.perf_counter() - t0
+    return {"rps": round(len(samples) / wall, 1), "errors": errors, **_summary(samples)}
+
+def bench_readload(args) -> dict:
+    """进程内直接驱动 ASGI app（不经 uvicorn/网络），比较两种 DB 访问模式"""
+    import db, main
+    conn = migrations.connect()
+    cur = conn.cursor()
+    try:
+        cur.execute("SELECT tid FROM rfid_tags_current LIMIT %s", (args.sample,))
+        tids = [row[0] for row in cur.fetchall()]
+    finally:
+        cur.close()
+        conn.close()
+    if not tids:
+        raise SystemExit("rfid_tags_current is empty; seed some tags first")
+
+    results = []
+    for mode in args.modes.split(","):
+        db.ASYNC = (mode == "async")
+        async def _run():
+            try:
+                return await _drive_by_tid(main.app, main.API_KEY, tids, args.requests, args.concurrency, args.seed)
+            finally:
+                await db.close_async_pool()
+        results.append({"mode": mode, "concurrency": args.concurrency, **asyncio.run(_run())})
+    return {"bench": "readload", "results": results}
+
+# ---------- prepared：同一条 by-tid 查询，文本协议 vs 按连接缓存的预处理语句 ----------
+def bench_prepared(args) -> dict:
+    """单连接串行执行，只比每条语句的往返 + 解析开销（不经线程池/HTTP）"""
+    import db, tags_repo
+    rnd = random.Random(args.seed)
+    db.PREPARED = True
+    # 与 /tags/by-tid 同一条 SQL，只换表名
+    sql = tags_repo.BY_TID.replace("rfid_tags_current", "bench_rfid_tags_full")
+
+    def _work(conn):
+        cur = conn.cursor()
+        try:
+            cur.execute("DROP TABLE IF EXISTS bench_rfid_tags_full")
+            cur.execute("""
+                CREATE TABLE bench_rfid_tags_full (
+                    tid VARCHAR(64) NOT NULL, epc VARCHAR(64) NULL, label_number VARCHAR(64) NULL,
+                    muf_no VARCHAR(64) NULL, fg_no VARCHAR(64) NULL, item VARCHAR(64) NULL,
+                    qty INT NULL, ctn_qty INT NULL, batch_no VARCHAR(64) NULL,
+                    rack_location VARCHAR(64) NULL, area VARCHAR(32) NULL, remark VARCHAR(255) NULL,
+                    updated_at DATETIME NULL, updated_by VARCHAR(64) NULL, audit_at DATETIME NULL,
+                    tid_key VARCHAR(128) AS (UPPER(tid)) STORED,
+                    epc_key VARCHAR(128) AS (UPPER(epc)) STORED,
+                    UNIQUE KEY uk_tid_key (tid_key),
+                    KEY ix_epc_key (epc_key)
+                )
+            """)
+            tids, batch = [], []
+            while len(tids) < args.rows:
+                t = _rand_tid(rnd)
+                tids.append(t)
+                batch.append((t, "L%09d" % len(tids), "BATT-%04d" % rnd.randrange(5000), rnd.randrange(1, 100),
+                               "R%03d" % rnd.randrange(500), rnd.choice(["W/H", "KITING", "LINE"])))
+                if len(batch) >= 5000 or len(tids) == args.rows:
+                    cur.executemany("""
+                        INSERT INTO bench_rfid_tags_full (tid, label_number, item, qty, rack_location, area, updated_at, updated_by)
+                        VALUES (%s,%s,%s,%s,%s,%s,NOW(),'bench')
+                    """, batch)
+                    batch = []
+
+            probes = [rnd.choice(tids).upper() for _ in range(args.queries)]
+            text = conn.cursor(dictionary=True)
+            def _text(k):
+                text.execute(sql, (k,))
+                return text.fetchall()
+            def _prepared(k):
+                return db.fetch_one(conn, sql, (k,))
+
+            # 每条查询实际发给服务端的命令数（= 往返次数）：预处理游标每次 EXECUTE 前还会发一次 COM_STMT_RESET
+            com = ("Com_select", "Com_stmt_prepare", "Com_stmt_execute", "Com_stmt_reset", "Com_stmt_close")
+            def _com():
+                cur.execute("SHOW SESSION STATUS WHERE Variable_name IN (%s)" % ",".join(f"'{c}'" for c in com))
+                return {k: int(v) for k, v in cur.fetchall()}
+
+            results = []
+            for mode, fn in (("text", _text), ("prepared", _prepared)):
+                for k in probes[:100]:  # 预热（含首次 PREPARE）
+                    fn(k)
+                samples = []
+                before = _com()
+                for k in probes:
+                    t0 = time.perf_counter()
+                    fn(k)
+                    samples.append(time.perf_counter() - t0)
+                after = _com()
+                sent = {c: after[c] - before[c] for c in com if after[c] != before[c]}
+                results.append({"rows": args.rows, "mode": mode, **_summary(samples),
+                                "round_trips_per_query": round(sum(sent.values()) / len(probes), 2), "commands": sent})
+            text.close()
+            return results
+        finally:
+            if not args.keep:
+                cur.execute("DROP TABLE IF EXISTS bench_rfid_tags_full")
+            cur.close()
+
+    results = db.run(_work)
+    saved = {k: round(results[0][k] - results[1][k], 1) for k in ("mean_us", "p50_us", "p95_us", "p99_us")}
+    return {"bench": "prepared", "results": results, "saved_per_query": saved}
+
+# ---------- roundtrips：每个请求实际发给服务端几条命令（归还时不重置会话 vs mysql.connector 默认的重置） ----------
+def bench_roundtrips(args) -> dict:
+    """进程内驱动 GET /tags/by-tid（关掉行缓存，每个请求都查库），在客户端数每条发出的命令（一条一个往返），按命令类型分开。
+    reset_session 模式即连接池默认行为：归还时 ping + COM_RESET_CONNECTION + 重跑 SET NAMES / autocommit / init_command"""
+    import db, main
+    from mysql.connector import connection, pooling
+    from mysql.connector.constants import ServerCmd
+    # 计数挂在纯 Python 实现上；C 扩展发的命令和往返次数相同
+    pooling.CMySQLConnection = None
+    names = {v: "COM_" + k for k, v in vars(ServerCmd).items() if k.isupper() and isinstance(v, int)}
+    sent = []
+    send_cmd = connection.MySQLConnection._send_cmd
+    def _counted(self, command, *a, **kw):
+        sent.append(names.get(command, command))
+        return send_cmd(self, command, *a, **kw)
+    connection.MySQLConnection._send_cmd = _counted
+
+    conn = migrations.connect()
+    cur = conn.cursor()
+    try:
+        cur.execute("SELECT tid FROM rfid_tags_current LIMIT %s", (args.sample,))
+        tids = [row[0] for row in cur.fetchall()]
+    finally:
+        cur.close()
+        conn.close()
+    if not tids:
+        raise SystemExit("rfid_tags_current is empty; seed some tags first")
+
+    main.TAG_CACHE.maxsize = 0
+    pool = db.get_pool()  # 建池（握手 + 初始化语句）不算在请求里
+    results = []
+    for mode in args.modes.split(","):
+        pool._reset_session = (mode == "reset_session")
+        sent.clear()
+        r = asyncio.run(_drive_by_tid(main.app, main.API_KEY, tids, args.requests, args.concurrency, args.seed))
+        commands = {}
+        for c in sent:
+            commands[c] = commands.get(c, 0) + 1
+        results.append({"mode": mode, "round_trips_per_request": round(len(sent) / args.requests, 2),
+                        "commands": commands, **r})
+    return {"bench": "roundtrips", "results": results}
+
+# ---------- bomindex：/bom/items 内存子串索引 vs 线性扫描（vs MySQL LIKE） ----------
+def _rand_item(rnd: random.Random) -> str:
+    # 形如 LI-18650-2600MAH-A、CR2032-3V、NIMH-AA-2000-B
+    chem = rnd.choice(["LI", "LIPO", "LFP", "NIMH", "CR", "ALK", "PB"])
+    size = rnd.choice(["18650", "21700", "2032", "AA", "AAA", "9V", "12V", "%04d" % rnd.randrange(10000)])
+    cap = "%d%s" % (rnd.randrange(100, 9999), rnd.choice(["MAH", "AH", "WH", ""]))
+    tail = rnd.choice(["", "-A", "-B", "-X%d" % rnd.randrange(100), "-REV%d" % rnd.randrange(10)])
+    return f"{chem}-{size}-{cap}{tail}"
+
+def bench_bomindex(args) -> dict:
+    from bom_index import ItemIndex
+    rnd = random.Random(args.seed)
+    items = set()
+    while len(items) < args.items:
+        items.add(_rand_item(rnd))
+    items = sorted(items)  # MySQL 排序规则下纯 ASCII 大写 + 数字 + '-' 与此一致；--mysql 时以库为准
+    limit = 20
+    # 查询：从随机物料号里截 1~8 个字符（模拟逐字输入），外加 10% 查不到的
+    queries = []
+    for _ in range(args.queries):
+        it = rnd.choice(items)
+        n = rnd.randint(1, min(8, len(it)))
+        i = rnd.randrange(len(it) - n + 1)
+        queries.append(it[i:i + n] if rnd.random() < 0.9 else "Q%05dZ" % rnd.randrange(100000))
+
+    t0 = time.perf_counter()
+    index = ItemIndex(items)
+    build_ms = round((time.perf_counter() - t0) * 1000, 1)
+
+    def _scan(q):
+        out = []
+        for it in items:
+            if q in it:
+                out.append(it)
+                if len(out) >= limit:
+                    break
+        return out
+
+    results, answers = [], {}
+    for mode, fn in (("index", lambda q: index.search(q, limit)), ("linear_scan", _scan)):
+        samples = []
+        for q in queries:
+            t0 = time.perf_counter()
+            answers.setdefault(mode, []).append(fn(q))
+            samples.append(time.perf_counter() - t0)
+        results.append({"items": len(items), "mode": mode, **_summary(samples)})
+    mismatches = sum(a != b for a, b in zip(answers["index"], answers["linear_scan"]))
+
+    if args.mysql:
+        import tags_repo
+        sql = tags_repo.BOM_SUGGEST.replace("FROM bom", "FROM bench_bom")
+        conn = migrations.connect()
+        cur = conn.cursor()
+        try:
+            cur.execute("DROP TABLE IF EXISTS bench_bom")
+            cur.execute("CREATE TABLE bench_bom (item VARCHAR(64) NULL, item_cat VARCHAR(16) NULL)")
+            shuffled = items[:]
+            rnd.shuffle(shuffled)
+            for i in range(0, len(shuffled), 5000):
+                cur.executemany("INSERT INTO bench_bom (item, item_cat) VALUES (%s,'BATT')",
+                                [(it.lower() if rnd.random() < 0.3 else it,) for it in shuffled[i:i + 5000]])
+            # 以库的排序规则为准重建索引再比对
+            cur.execute(tags_repo.BOM_ITEMS_SORTED.replace("FROM bom", "FROM bench_bom"))
+            index = ItemIndex([row[0] for row in cur.fetchall()])
+            samples, sql_answers = [], []
+            for q in queries[:args.mysql_queries]:
+                t0 = time.perf_counter()
+                cur.execute(sql, ("%" + q + "%", limit))
+                sql_answers.append([row[0] for row in cur.fetchall()])
+                samples.append(time.perf_counter() - t0)
+            results.append({"items": len(items), "mode": "mysql_like", **_summary(samples)})
+            mismatches += sum(index.search(q, limit) != a for q, a in zip(queries, sql_answers))
+        finally:
+            if not args.keep:
+                cur.execute("DROP TABLE IF EXISTS bench_bom")
+            cur.close()
+            conn.close()
+
+    return {"bench": "bomindex", "build_ms": build_ms, "limit": limit, "mismatches": mismatches, "results": results}
+
+# ---------- wire：/tags/updated-since 的 JSON vs 按列字典编码 vs MessagePack ----------
+def _rand_tag_row(rnd: random.Random, i: int, items: list[str], racks: list[str], users: list[str]) -> dict:
+    area = rnd.choice(["W/H", "W/H", "KITING", "LINE", None])
+    return {
+        "tid": _rand_tid(rnd).upper(), "epc": None, "label_number": "L%09d" % i,
+        "muf_no": rnd.choice([None, "MUF%06d" % rnd.randrange(20000)]), "fg_no": None,
+        "item": rnd.choice(items), "qty": rnd.randrange(1, 500), "ctn_qty": rnd.choice([None, 10, 20, 50]),
+        "batch_no": "B%05d" % rnd.randrange(3000), "rack_location": rnd.choice(racks) if area else None,
+        "area": area, "remark": None,
+        "updated_at": "2026-%02d-%02d %02d:%02d:%02d" % (rnd.randint(1, 12), rnd.randint(1, 28), rnd.randrange(24),
+                                                         rnd.randrange(60), rnd.randrange(60)),
+        "updated_by": rnd.choice(users), "audit_at": None,
+    }
+
+def bench_wire(args) -> dict:
+    """不连库：合成 rows 行，比较各编码的字节数（含 gzip 后）、服务端编码耗时、客户端解析成 list[dict] 的耗时"""
+    import gzip, wire, tags_repo
+    rnd = random.Random(args.seed)
+    items = ["%s-%04d" % (rnd.choice(["LI", "NIMH", "CR", "LFP"]), rnd.randrange(10000)) for _ in range(2000)]
+    racks = ["R%02d-%02d-%d" % (a, b, c) for a in range(20) for b in range(20) for c in range(4)]
+    users = ["user%02d" % k for k in range(40)]
+    rows = [_rand_tag_row(rnd, i, items, racks, users) for i in range(args.rows)]
+
+    # (名称, 编码, 解析, 还原成 list[dict])；客户端只按列使用时可以不做最后一步
+    same = lambda x: x
+    codecs = [
+        ("json", lambda: wire.dumps(rows), json.loads, same),
+        ("columnar_json", lambda: wire.dumps(wire.encode_columnar(rows, tags_repo.TAG_COLUMNS)),
+         json.loads, wire.decode_columnar),
+    ]
+    try:
+        import msgpack  # noqa: F401
+        codecs += [
+            ("msgpack_rows", lambda: wire.packb(rows), wire.unpackb, same),
+            ("columnar_msgpack", lambda: wire.packb(wire.encode_columnar(rows, tags_repo.TAG_COLUMNS)),
+             wire.unpackb, wire.decode_columnar),
+        ]
+    except ImportError:
+        pass
+
+    results = []
+    for name, enc, parse, to_rows in codecs:
+        t0 = time.perf_counter()
+        body = enc()
+        t1 = time.perf_counter()
+        obj = parse(body)
+        t2 = time.perf_counter()
+        decoded = to_rows(obj)
+        t3 = time.perf_counter()
+        assert decoded == rows, name
+        results.append({
+            "codec": name, "bytes": len(body), "gzip_bytes": len(gzip.compress(body, 6)),
+            "encode_ms": round((t1 - t0) * 1000, 1), "parse_ms": round((t2 - t1) * 1000, 1),
+            "parse_to_rows_ms": round((t3 - t1) * 1000, 1),
+        })
+    base = results[0]
+    for r in results:
+        r["size_vs_json"] = round(r["bytes"] / base["bytes"], 3)
+        r["gzip_vs_json"] = round(r["gzip_bytes"] / base["gzip_bytes"], 3)
+    return {"bench": "wire", "rows": args.rows, "results": results}
+
+# ---------- keyset：/tags/updated-since 谓词写法 + (updated_at, tid) 索引，EXPLAIN 核对执行计划 ----------
+# 改写前的谓词（参数相同：ts, ts, last_tid, limit）
+_UPDATED_SINCE_OR = """
+    SELECT {cols}
+    FROM {table}
+    WHERE (updated_at > %s)
+       OR (updated_at = %s AND tid > %s)
+    ORDER BY updated_at ASC, tid ASC
+    LIMIT %s
+"""
+
+def _find_plan(node, out: dict) -> dict:
+    """从 EXPLAIN FORMAT=JSON 里取第一张表的访问方式 / 索引，以及是否 filesort"""
+    if isinstance(node, dict):
+        if node.get("using_filesort"):
+            out["filesort"] = True
+        t = node.get("table")
+        if isinstance(t, dict) and "access_type" not in out:
+            out.update(access_type=t.get("access_type"), key=t.get("key"),
+                       rows_examined=t.get("rows_examined_per_scan"))
+        for v in node.values():
+            _find_plan(v, out)
+    elif isinstance(node, list):
+        for v in node:
+            _find_plan(v, out)
+    return out
+
+def _keyset_table(cur, table: str, rows: int, rnd: random.Random):
+    """重建 table 并灌 rows 行（不带 (updated_at, tid) 索引）；tests/test_keyset_plan.py 也用"""
+    cur.execute(f"DROP TABLE IF EXISTS {table}")
+    cur.execute(f"""
+        CREATE TABLE {table} (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            tid VARCHAR(64) NOT NULL, epc VARCHAR(64) NULL, label_number VARCHAR(64) NULL,
+            muf_no VARCHAR(64) NULL, fg_no VARCHAR(64) NULL, item VARCHAR(64) NULL,
+            qty INT NULL, ctn_qty INT NULL, batch_no VARCHAR(64) NULL,
+            rack_location VARCHAR(64) NULL, area VARCHAR(32) NULL, remark VARCHAR(255) NULL,
+            updated_at DATETIME NULL, updated_by VARCHAR(64) NULL, audit_at DATETIME NULL
+        )
+    """)
+    # 30 天内的写入；约 1/5 成批落在同一秒（整托盘注册 / 移库），考验 tid 决胜
+    t, batch = 1767225600, []  # 2026-01-01 00:00:00 UTC
+    for i in range(rows):
+        if rnd.random() > 0.8 or not batch:
+            t += rnd.randrange(0, 6)
+        batch.append((_rand_tid(rnd).upper(), "L%09d" % i, "BATT-%04d" % rnd.randrange(5000),
+                      rnd.randrange(1, 100), time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(t))))
+        if len(batch) >= 5000 or i == rows - 1:
+            cur.executemany(f"""
+                INSERT INTO {table} (tid, label_number, item, qty, updated_at, updated_by)
+                VALUES (%s,%s,%s,%s,%s,'bench')
+            """, batch)
+            batch = []
+
+def keyset_plan(cur, sql: str, params: tuple) -> dict:
+    """EXPLAIN FORMAT=JSON -> {access_type, key, rows_examined, filesort}"""
+    cur.execute("EXPLAIN FORMAT=JSON " + sql, params)
+    return _find_plan(json.loads(cur.fetchone()[0]), {"filesort": False})
+
+def bench_keyset(args) -> dict:
+    """建 rows 行的 bench_rfid_tags_sync，按游标翻页（模拟设备全量同步 + 随机游标），
+    比较：无索引 + 旧谓词 / 有索引 + 旧谓词 / 有索引 + 新谓词；新写法的计划必须是索引范围扫描且不 filesort"""
+    import tags_repo
+    rnd = random.Random(args.seed)
+    table = "bench_rfid_tags_sync"
+    new_sql = tags_repo.UPDATED_SINCE.replace("rfid_tags_current", table)
+    old_sql = _UPDATED_SINCE_OR.format(cols=tags_repo.TAG_COLS, table=table)
+    conn = migrations.connect()
+    cur = conn.cursor()
+    try:
+        _keyset_table(cur, table, args.rows, rnd)
+        cur.execute(f"SELECT MIN(updated_at), MAX(updated_at) FROM {table}")
+        lo, hi = cur.fetchone()
+        span = int((hi - lo).total_seconds())
+
+        def _cursors():
+            # 一半从头顺序翻页（全量同步），一半随机起点（增量同步）
+            out, c = [], (lo.strftime("%Y-%m-%d %H:%M:%S"), "")
+            for _ in range(args.pages // 2):
+                out.append(c)
+                cur.execute(new_sql, (c[0], c[0], c[1], args.page_size))
+                rows = cur.fetchall()
+                if not rows:
+                    break
+                c = (rows[-1][12].strftime("%Y-%m-%d %H:%M:%S"), rows[-1][0])
+            while len(out) < args.pages:
+                ts = lo.timestamp() + rnd.randrange(span)
+                out.append((time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(ts)), ""))
+            return out
+
+        def _run(mode, sql, cursors):
+            plan = keyset_plan(cur, sql, (cursors[-1][0], cursors[-1][0], cursors[-1][1], args.page_size))
+            samples, pages = [], []
+            for ts, last in cursors:
+                t0 = time.perf_counter()
+                cur.execute(sql, (ts, ts, last, args.page_size))
+                pages.append(cur.fetchall())
+                samples.append(time.perf_counter() - t0)
+            return {"mode": mode, "plan": plan, **_summary(samples)}, pages
+
+        results = []
+        cursors = None
+        r0 = None
+        if not args.skip_noindex:
+            cursors = _cursors()
+            r0, base = _run("or_predicate_no_index", old_sql, cursors)
+            results.append(r0)
+        cur.execute(f"CREATE INDEX ix_updated_at_tid ON {table} (updated_at, tid)")
+        cur.execute(f"ANALYZE TABLE {table}")
+        cur.fetchall()
+        cursors = cursors or _cursors()
+        r1, old_pages = _run("or_predicate_indexed", old_sql, cursors)
+        r2, new_pages = _run("range_predicate_indexed", new_sql, cursors)
+        results += [r1, r2]
+        plan = r2["plan"]
+        plan_ok = plan.get("access_type") == "range" and plan.get("key") == "ix_updated_at_tid" and not plan["filesort"]
+        same = old_pages == new_pages and (r0 is None or base == new_pages)
+    finally:
+        if not args.keep:
+            cur.execute(f"DROP TABLE IF EXISTS {table}")
+        cur.close()
+        conn.close()
+    return {"bench": "keyset", "rows": args.rows, "page_size": args.page_size,
+            "plan_ok": plan_ok, "same_results": same, "results": results}
+
+# ---------- metrics：/metrics 埋点本身的开销（不连库） ----------
+def bench_metrics(args) -> dict:
+    """同一个最小 ASGI 应用，套 / 不套 MetricsMiddleware 各跑 N 个请求，差值即每请求埋点开销；
+    另测直方图 observe()、SQL 计时（statement() + time()）单次耗时。各跑 5 轮取最好的一轮"""
+    import metrics
+
+    class _Route:
+        name = "by_tid"
+
+    async def _app(scope, receive, send):
+        scope["route"] = _Route
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+        await send({"type": "http.response.body", "body": b"{}"})
+
+    async def _noop(message):
+        pass
+
+    async def _drive(app, n):
+        scope = {"type": "http", "method": "GET", "path": "/tags/by-tid"}
+        t0 = time.perf_counter()
+        for _ in range(n):
+            await app(dict(scope), None, _noop)
+        return (time.perf_counter() - t0) / n
+
+    def _best(fn, rounds=5):
+        return min(fn() for _ in range(rounds))
+
+    n = args.requests
+    wrapped = metrics.MetricsMiddleware(_app)
+    bare = _best(lambda: asyncio.run(_drive(_app, n)))
+    instrumented = _best(lambda: asyncio.run(_drive(wrapped, n)))
+
+    h = metrics.Histogram("bench_observe_seconds", "bench", ("route",))
+    def _observe():
+        t0 = time.perf_counter()
+        for i in range(n):
+            h.observe(0.0042, "by_tid")
+        return (time.perf_counter() - t0) / n
+
+    import tags_repo
+    sql = tags_repo.BY_TID
+    def _sql_timer():
+        t0 = time.perf_counter()
+        for i in range(n):
+            with metrics.SQL_LATENCY.time(metrics.statement(sql)):
+                pass
+        return (time.perf_counter() - t0) / n
+
+    return {
+        "bench": "metrics", "requests": n,
+        "request_bare_us": round(bare * 1e6, 2),
+        "request_instrumented_us": round(instrumented * 1e6, 2),
+        "middleware_overhead_us": round((instrumented - bare) * 1e6, 2),
+        "histogram_observe_us": round(_best(_observe) * 1e6, 3),
+        "sql_timer_us": round(_best(_sql_timer) * 1e6, 3),
+    }
+
+def main():
+    ap = argparse.ArgumentParser(description="GWIM RFID API benchmarks")
+    ap.add_argument("--seed", type=int, default=42)
+    sub = ap.add_subparsers(dest="cmd", required=True)
+
+    p = sub.add_parser("lookup", help="按 TID 查询：UPPER() 全表扫描 vs tid_key 索引")
+    p.add_argument("--sizes", default="10000,100000,300000")
+    p.add_argument("--queries", type=int, default=300)
+    p.add_argument("--keep", action="store_true", help="保留 bench_rfid_tags 表")
+    p.set_defaults(fn=bench_lookup)
+
+    p = sub.add_parser("readload", help="by-tid 并发读：asyncio.to_thread 线程模式 vs aiomysql 异步模式")
+    p.add_argument("--modes", default="thread,async")
+    p.add_argument("--concurrency", type=int, default=200)
+    p.add_argument("--requests", type=int, default=5000)
+    p.add_argument("--sample", type=int, default=1000, help="从 rfid_tags_current 取多少个 TID 做随机查询")
+    p.set_defaults(fn=bench_readload)
+
+    p = sub.add_parser("prepared", help="by-tid 单条查询：文本协议 vs 预处理语句（按连接缓存）")
+    p.add_argument("--rows", type=int, default=100000)
+    p.add_argument("--queries", type=int, default=5000)
+    p.add_argument("--keep", action="store_true", help="保留 bench_rfid_tags_full 表")
+    p.set_defaults(fn=bench_prepared)
+
+    p = sub.add_parser("roundtrips", help="by-tid 每个请求的往返次数：归还时不重置会话 vs 重置（连接池默认）")
+    p.add_argument("--modes", default="no_reset,reset_session")
+    p.add_argument("--concurrency", type=int, default=20)
+    p.add_argument("--requests", type=int, default=2000)
+    p.add_argument("--sample", type=int, default=1000, help="从 rfid_tags_current 取多少个 TID 做随机查询")
+    p.set_defaults(fn=bench_roundtrips)
+
+    p = sub.add_parser("bomindex", help="/bom/items：内存 n-gram 索引 vs 线性扫描（--mysql 再比 LIKE 全表扫描并核对结果）")
+    p.add_argument("--items", type=int, default=100000)
+    p.add_argument("--queries", type=int, default=2000)
+    p.add_argument("--mysql", action="store_true", help="建 bench_bom 表，对比 SQL 并逐条核对结果一致")
+    p.add_argument("--mysql-queries", type=int, default=200)
+    p.add_argument("--keep", action="store_true", help="保留 bench_bom 表")
+    p.set_defaults(fn=bench_bomindex)
+
+    p = sub.add_parser("wire", help="updated-since 响应编码：JSON vs 按列字典编码 JSON vs MessagePack（大小/编解码耗时）")
+    p.add_argument("--rows", type=int, default=200000)
+    p.set_defaults(fn=bench_wire)
+
+    p = sub.add_parser("keyset", help="updated-since 翻页：OR 谓词 vs 范围谓词 + (updated_at, tid) 索引，EXPLAIN 核对")
+    p.add_argument("--rows", type=int, default=1000000)
+    p.add_argument("--pages", type=int, default=200)
+    p.add_argument("--page-size", type=int, default=1000)
+    p.add_argument("--skip-noindex", action="store_true", help="跳过无索引基线（大表上很慢）")
+    p.add_argument("--keep", action="store_true", help="保留 bench_rfid_tags_sync 表")
+    p.set_defaults(fn=bench_keyset)
+
+    p = sub.add_parser("metrics", help="/metrics 埋点开销：每请求中间件开销、observe()、SQL 计时")
+    p.add_argument("--requests", type=int, default=200000)
+    p.set_defaults(fn=bench_metrics)
+
+    args = ap.parse_args()
+    print(json.dumps(args.fn(args), ensure_ascii=False, indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+# bom_index.py
+"""BATT 物料号的内存子串索引，代替 /bom/items 的 UPPER(item) LIKE '%q%' 全表扫描。
+
+物料列表按数据库 ORDER BY item 的顺序加载，下标即排序名次；
+每个 1/2/3-gram 记一个升序的下标数组（倒排表）。查询时取 q 里最短的那条倒排表，
+按名次顺序逐个确认 q in item，够 limit 条就停——结果与 SQL 的 DISTINCT / ORDER BY / LIMIT 一致。
+"""
+from array import array
+
+_GRAM_MAX = 3
+
+class ItemIndex:
+    def __init__(self, items: list[str]):
+        """items：已去重、按数据库排序规则排好序的大写物料号"""
+        self.items = items
+        postings = {}
+        for rank, item in enumerate(items):
+            grams = set()
+            for n in range(1, _GRAM_MAX + 1):
+                for i in range(len(item) - n + 1):
+                    grams.add(item[i:i + n])
+            for g in grams:
+                arr = postings.get(g)
+                if arr is None:
+                    arr = postings[g] = array("i")
+                arr.append(rank)
+        self._postings = postings
+
+    def __len__(self):
+        return len(self.items)
+
+    @staticmethod
+    def supports(q: str) -> bool:
+        """LIKE 通配符 / 转义符、非 ASCII（排序规则可能做重音折叠）交给 SQL"""
+        return q.isascii() and not any(c in q for c in "%_\\")
+
+    def search(self, q: str, limit: int) -> list[str]:
+        """q 已大写；等价于 UPPER(item) LIKE '%q%' ORDER BY item LIMIT limit"""
+        if limit <= 0:
+            return []
+        n = min(len(q), _GRAM_MAX)
+        best = None
+        for i in range(len(q) - n + 1):
+            arr = self._postings.get(q[i:i + n])
+            if arr is None:
+                return []
+            if best is None or len(arr) < len(best):
+                best = arr
+        items, out = self.items, []
+        exact = len(q) <= _GRAM_MAX  # 倒排表本身就是结果，不用再确认
+        for rank in best:
+            item = items[rank]
+            if exact or q in item:
+                out.append(item)
+                if len(out) >= limit:
+                    break
+        return out
@@ -0,0 +1,166 @@
+# cache.py
+"""进程内缓存（线程安全；DB 线程和事件循环都会调用）。
+
+只在本进程内有效：uvicorn 多 worker 时每个 worker 各有一份，
+某个 worker 的写入只会清掉自己那份，其它 worker 最多在 TTL 内读到旧值。
+"""
+import asyncio, threading, time
+from collections import OrderedDict
+
+class LRUCache:
+    """容量上限 + TTL；超出容量淘汰最久未用的条目，过期条目在读到时或 sweep() 时删除"""
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()  # key -> (过期时间 monotonic, value)
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "evictions": 0, "expired": 0, "invalidations": 0, "coalesced": 0}
+        self._inflight = {}  # key -> 正在加载的 Task（只在事件循环里访问）
+
+    # 子类钩子：条目加入/移除时调用（已持有锁）
+    def _added(self, key, value):
+        pass
+
+    def _removed(self, key, value):
+        pass
+
+    def _drop(self, key, reason: str):
+        _, value = self._data.pop(key)
+        self._stats[reason] += 1
+        self._removed(key, value)
+
+    def _get_locked(self, key):
+        ent = self._data.get(key)
+        if ent is None:
+            return None
+        if ent[0] <= time.monotonic():
+            self._drop(key, "expired")
+            return None
+        self._data.move_to_end(key)
+        return ent[1]
+
+    def _put_locked(self, key, value):
+        if self.maxsize <= 0:
+            return
+        if key in self._data:
+            self._removed(key, self._data.pop(key)[1])
+        self._data[key] = (time.monotonic() + self.ttl, value)
+        self._added(key, value)
+        while len(self._data) > self.maxsize:
+            self._drop(next(iter(self._data)), "evictions")
+
+    def get(self, key, default=None):
+        with self._lock:
+            value = self._get_locked(key)
+            self._stats["hits" if value is not None else "misses"] += 1
+        return default if value is None else value
+
+    def put(self, key, value):
+        with self._lock:
+            self._put_locked(key, value)
+
+    def pop(self, key):
+        with self._lock:
+            if key in self._data:
+                self._drop(key, "invalidations")
+
+    def clear(self):
+        with self._lock:
+            for key in list(self._data):
+                self._drop(key, "invalidations")
+
+    def sweep(self) -> int:
+        """删除所有已过期条目（没人再读的过期条目不会自己消失），返回删除个数"""
+        now = time.monotonic()
+        with self._lock:
+            dead = [k for k, (exp, _) in self._data.items() if exp <= now]
+            for k in dead:
+                self._drop(k, "expired")
+        return len(dead)
+
+    async def get_or_load(self, key, load):
+        """未命中时执行 load()（协程函数）并缓存结果；同一 key 并发未命中只加载一次，其余等同一个结果。
+        加载放在独立 Task 里，发起者被取消（客户端断开 / 超时）不影响其它等待者。"""
+        value = self.get(key)
+        if value is not None:
+            return value
+        task = self._inflight.get(key)
+        if task is None:
+            task = self._inflight[key] = asyncio.ensure_future(load())
+            task.add_done_callback(lambda t: self._loaded(key, t))
+        else:
+            with self._lock:
+                self._stats["coalesced"] += 1
+        return await asyncio.shield(task)
+
+    def _loaded(self, key, task):
+        self._inflight.pop(key, None)
+        # 调 exception() 顺便标记异常已取回，等待者都被取消时也不会打 "never retrieved" 警告
+        if not task.cancelled() and task.exception() is None:
+            self.put(key, task.result())
+
+    def stats(self) -> dict:
+        with self._lock:
+            out = dict(self._stats)
+            out["size"] = len(self._data)
+            out["loading"] = len(self._inflight)
+        lookups = out["hits"] + out["misses"]
+        out["hit_rate"] = round(out["hits"] / lookups, 4) if lookups else 0.0
+        out["maxsize"] = self.maxsize
+        out["ttl_sec"] = self.ttl
+        return out
+
+class TagCache(LRUCache):
+    """rfid_tags_current 行缓存：主键 tid_key，另按 epc_key / label_key 建二级索引。
+
+    写接口提交后调用 invalidate()；读接口未命中时先取 generation()，查完库用 fill(row, gen) 回填——
+    期间若有任何失效发生就放弃回填，避免把提交前读到的旧行塞回缓存。
+    """
+    # 二级索引列 -> 行里对应的字段
+    _INDEX = {"epc_key": "epc", "label_key": "label_number"}
+
+    def __init__(self, maxsize: int, ttl: float):
+        super().__init__(maxsize, ttl)
+        self._index = {col: {} for col in self._INDEX}
+        self._gen = 0
+
+    @staticmethod
+    def _k(v):
+        return v.upper() if isinstance(v, str) and v else None
+
+    def _added(self, key, row):
+        for col, field in self._INDEX.items():
+            k = self._k(row.get(field))
+            if k:
+                self._index[col][k] = key
+
+    def _removed(self, key, row):
+        for col, field in self._INDEX.items():
+            k = self._k(row.get(field))
+            if k and self._index[col].get(k) == key:
+                del self._index[col][k]
+
+    def lookup(self, col: str, key: str) -> dict | None:
+        """col 为 tid_key / epc_key / label_key；命中返回行的副本"""
+        with self._lock:
+            tid_key = key if col == "tid_key" else self._index[col].get(key)
+            row = self._get_locked(tid_key) if tid_key is not None else None
+            self._stats["hits" if row is not None else "misses"] += 1
+        return dict(row) if row is not None else None
+
+    def generation(self) -> int:
+        with self._lock:
+            return self._gen
+
+    def fill(self, row: dict, gen: int):
+        with self._lock:
+            if gen == self._gen:
+                self._put_locked(self._k(row["tid"]), dict(row))
+
+    def invalidate(self, *tid_keys):
+        with self._lock:
+            self._gen += 1
+            for k in tid_keys:
+                if k in self._data:
+                    self._drop(k, "invalidations")
@@ -0,0 +1,606 @@
+# db.py
+"""MySQL 连接池：由池统一负责连接存活。
+
+- 连接空闲超过 DB_IDLE_PING_SEC 才 ping；否则直接用（省一次往返）。建游标也会 ping，所以游标按物理连接缓存
+- 物理连接存活超过 DB_MAX_AGE_SEC 时重连回收
+- 执行中遇到「连接已断」类错误，且还没发 COMMIT，换连接透明重试一次
+- 归还时不重置会话（见 get_pool）；还在事务里的连接回滚后再放回池里
+
+阻塞的 DB 调用统一在专用线程池里跑（run_in_pool），线程数 = 连接池大小，
+排队上限 DB_QUEUE_MAX、排队等待超过 DB_ACQUIRE_TIMEOUT 秒即抛 PoolBusy（main 映射成 503）。
+
+只读单条语句统一走 query()：默认线程 + 上面的连接池；
+DB_ASYNC=1 时改走 aiomysql 协程连接池（需 pip install aiomysql），不占线程。
+大结果集用 stream() 按批产出（非缓冲游标），内存不随行数增长。
+
+固定文本的语句用 fetch_one / fetch_all / execute 执行。默认文本协议（一条语句一次往返）；
+DB_PREPARED=1 时改用服务端预处理语句（cursor(prepared=True)），按物理连接缓存，同一条 SQL 只 PREPARE 一次。
+但 mysql.connector 复用预处理游标时每次 EXECUTE 前都先发一次 COM_STMT_RESET，一条语句变成两次往返，
+省下的服务端解析（主键查询几十微秒）抵不过多出来的一次往返，所以默认关闭（bench.py prepared 可复测）。
+"""
+import os, asyncio, contextvars, queue, threading, time, weakref
+import concurrent.futures
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from dotenv import load_dotenv
+from mysql.connector import pooling
+from mysql.connector import errors as sqlerr
+import metrics, slowlog
+
+load_dotenv()
+
+POOL_SIZE     = int(os.getenv("DB_POOL_SIZE", "10"))
+IDLE_PING_SEC = float(os.getenv("DB_IDLE_PING_SEC", "30"))
+MAX_AGE_SEC   = float(os.getenv("DB_MAX_AGE_SEC", "1800"))
+QUEUE_MAX       = int(os.getenv("DB_QUEUE_MAX", "200"))
+ACQUIRE_TIMEOUT = float(os.getenv("DB_ACQUIRE_TIMEOUT", "2"))
+PREPARED        = os.getenv("DB_PREPARED", "0") == "1"
+PREPARED_MAX    = int(os.getenv("DB_PREPARED_MAX", "64"))  # 每条连接最多缓存多少条预处理语句
+STREAM_QUEUE    = int(os.getenv("DB_STREAM_QUEUE", "4"))    # stream()：DB 线程最多领先消费者几批
+# stream() 同时最多几个：每个流从头到尾占一个 DB 线程和连接（慢客户端可达 STREAM_TIMEOUT），
+# 必须远小于 POOL_SIZE，否则几个慢的全量同步就能把写接口全挤成 503/超时
+STREAM_MAX      = int(os.getenv("DB_STREAM_MAX", str(max(1, POOL_SIZE // 4))))
+
+# ER_UNKNOWN_STMT_HANDLER：服务端已经没有这条预处理语句（被重置/回收）
+_STMT_GONE_ERRNO = 1243
+
+# CR_SERVER_GONE_ERROR / CR_SERVER_LOST / CR_SERVER_LOST_EXTENDED
+_STALE_ERRNO = {2006, 2013, 2055}
+
+# ER_LOCK_DEADLOCK：InnoDB 已回滚整个事务，连接本身没问题
+_DEADLOCK_ERRNO = 1213
+
+# 写事务的隔离级别：作为 init_command 只在物理连接建立 / 重连时执行一次。
+# 依赖池归还时不重置会话（get_pool 里 pool_reset_session=False）——重置会话会重跑 init_command，变成每个请求一次往返。
+# 读语句也跑在这个级别下，单条 SELECT 看不出区别。
+# READ COMMITTED 下 FOR UPDATE 查不到的键不加间隙锁，批量锁行与并发 INSERT 不会互相等成环
+TX_ISOLATION = os.getenv("DB_TX_ISOLATION", "READ COMMITTED")
+
+# ---------- 计数 ----------
+_STATS = {"checkouts": 0, "pings": 0, "pings_skipped": 0, "reconnects": 0, "recycled": 0, "retries": 0,
+          "returned_in_tx": 0, "prepares": 0, "reprepares": 0}
+_STATS_LOCK = threading.Lock()
+
+def _inc(name: str, n: int = 1):
+    with _STATS_LOCK:
+        _STATS[name] += n
+
+def stats() -> dict:
+    with _STATS_LOCK:
+        out = dict(_STATS)
+        g = dict(_GAUGE)
+    done = g.pop("started")
+    wait_total = g.pop("wait_total")
+    out.update(g)
+    out["wait_ms_avg"] = round(wait_total / done * 1000, 2) if done else 0.0
+    out["wait_ms_max"] = round(out["wait_ms_max"], 2)
+    out["pool_size"] = POOL_SIZE
+    if _POOL is not None:
+        out["pool_idle"] = _POOL._cnx_queue.qsize()
+    return out
+
+def load() -> dict:
+    """DB 线程池的瞬时占用 + 累计计数（/health/ready 用；started/rejected/timed_out 为累计值）"""
+    with _STATS_LOCK:
+        return {k: _GAUGE[k] for k in ("queued", "active", "started", "rejected", "timed_out")}
+
+# 物理连接 -> [首次使用时间, 最近归还时间]（time.monotonic）
+_META = weakref.WeakKeyDictionary()
+
+class HealthCheckedPool(pooling.MySQLConnectionPool):
+    """取连接时按空闲/年龄决定 ping 或重连，代替 mysql.connector 每次取连接都 ping 的默认行为"""
+
+    def get_connection(self) -> pooling.PooledMySQLConnection:
+        with pooling.CONNECTION_POOL_LOCK:
+            try:
+                cnx = self._cnx_queue.get(block=False)
+            except queue.Empty as err:
+                raise sqlerr.PoolError("Failed getting connection; pool exhausted") from err
+        # 网络操作放在全局锁外面
+        try:
+            self._check_out(cnx)
+        except Exception:
+            self._queue_connection(cnx)
+            raise
+        _inc("checkouts")
+        return pooling.PooledMySQLConnection(self, cnx)
+
+    def _check_out(self, cnx):
+        now = time.monotonic()
+        meta = _META.get(cnx)
+        if meta is None:
+            # 建池时刚连上的物理连接
+            _META[cnx] = [now, now]
+            _inc("pings_skipped")
+        elif self._config_version != cnx.pool_config_version or now - meta[0] > MAX_AGE_SEC:
+            cnx.config(**self._cnx_config)
+            cnx.reconnect()
+            _forget(cnx)
+            cnx.pool_config_version = self._config_version
+            meta[0] = meta[1] = now
+            _inc("recycled")
+        elif now - meta[1] > IDLE_PING_SEC:
+            _inc("pings")
+            if not cnx.is_connected():
+                cnx.reconnect()
+                _forget(cnx)
+                meta[0] = now
+                _inc("reconnects")
+        else:
+            _inc("pings_skipped")
+
+    def add_connection(self, cnx=None) -> None:
+        if cnx is not None:
+            meta = _META.get(cnx)
+            if meta is not None:
+                meta[1] = time.monotonic()
+            # 会话不重置，唯一要清的是没结束的事务（处理器出错路径里的 rollback 也失败了）：
+            # 不清的话行锁和未提交的写会跟着连接交给下一个请求。in_transaction 取自上一个响应的状态位，不用往返
+            if cnx.in_transaction:
+                _inc("returned_in_tx")
+                try:
+                    cnx.rollback()
+                except sqlerr.Error:
+                    _mark_broken(cnx)
+        super().add_connection(cnx)
+
+_POOL = None
+_POOL_LOCK = threading.Lock()
+
+def get_pool():
+    global _POOL
+    if _POOL is None:
+        with _POOL_LOCK:
+            if _POOL is None:
+                _POOL = HealthCheckedPool(
+                    pool_name="rfid_pool",
+                    pool_size=POOL_SIZE,
+                    host=os.getenv("DB_HOST"),
+                    port=int(os.getenv("DB_PORT", "3306")),
+                    database=os.getenv("DB_NAME"),
+                    user=os.getenv("DB_USER"),
+                    password=os.getenv("DB_PASS"),
+                    autocommit=True,
+                    connection_timeout=int(os.getenv("CONNECT_TIMEOUT", "3")),
+                    init_command=f"SET SESSION TRANSACTION ISOLATION LEVEL {TX_ISOLATION}" if TX_ISOLATION else None,
+                    # 归还时不重置会话：mysql.connector 的 reset_session 是 ping + COM_RESET_CONNECTION
+                    # + 重跑 SET NAMES / autocommit / init_command，每个请求多出好几次往返，还会丢掉缓存的预处理语句。
+                    # 本应用不用用户变量、临时表，也不改会话变量（隔离级别只在连接建立时设一次）
+                    pool_reset_session=False,
+                )
+    return _POOL
+
+def _mark_broken(cnx):
+    """下次取到这条物理连接时强制重连"""
+    meta = _META.get(cnx)
+    if meta is not None:
+        meta[0] = float("-inf")
+    _forget(cnx)
+
+def discard(conn):
+    """连接处于不能再用的状态（非缓冲游标还有没读完的行）：直接断开，下次取到时重连。
+    不能只是归还：之后这条连接上的任何语句都会报 Unread result found"""
+    cnx = conn._cnx
+    _mark_broken(cnx)
+    cnx.shutdown()  # 不发 QUIT，不会卡在没读完的结果上
+    try:
+        # 纯 Python 实现的标志不随重连清掉，不清的话重连本身也会失败
+        cnx.unread_result = False
+    except AttributeError:
+        pass  # C 扩展：标志取自 C 端结果集，断开时一并释放
+
+def _is_stale(e: BaseException | None) -> bool:
+    # 处理器里 except: conn.rollback() 在断开的连接上会再抛一次，原始错误在 __context__ 里
+    while e is not None:
+        if isinstance(e, (sqlerr.OperationalError, sqlerr.InterfaceError)) and e.errno in _STALE_ERRNO:
+            return True
+        e = e.__context__
+    return False
+
+def _is_deadlock(e: BaseException | None) -> bool:
+    while e is not None:
+        if isinstance(e, sqlerr.DatabaseError) and e.errno == _DEADLOCK_ERRNO:
+            return True
+        e = e.__context__
+    return False
+
+def no_retry(conn):
+    """此后即使断线也不要换连接重试（COMMIT 已发出 / 部分结果已交给调用方）"""
+    conn._rfid_no_retry = True
+
+def commit(conn):
+    """写事务用它代替 conn.commit()：COMMIT 一旦发出就不能再重试（结果未知）"""
+    no_retry(conn)
+    conn.commit()
+
+def run(fn):
+    """从池里取连接执行 fn(conn) 并归还；连接已断或死锁被回滚、且未提交时重试一次"""
+    pool = get_pool()
+    for attempt in (0, 1):
+        t0 = time.perf_counter()
+        conn = pool.get_connection()
+        waited = time.perf_counter() - t0
+        metrics.POOL_ACQUIRE.observe(waited)
+        slowlog.note("acquire_ms", waited)
+        cnx = conn._cnx
+        try:
+            return fn(conn)
+        except sqlerr.Error as e:
+            if _is_deadlock(e):
+                pass  # InnoDB 已回滚整个事务，同一个 fn 再跑一次
+            elif _is_stale(e):
+                _mark_broken(cnx)
+                # 未提交的事务在服务端随连接断开自动回滚，重试是安全的
+            else:
+                raise
+            if attempt or getattr(conn, "_rfid_no_retry", False):
+                raise
+            _inc("retries")
+        finally:
+            try:
+                conn.close()
+            except sqlerr.Error:
+                _mark_broken(cnx)
+
+# ---------- 普通游标（按物理连接缓存） ----------
+# mysql.connector 的 conn.cursor() 每次先 is_connected()，即一次 COM_PING：每条语句新建游标就每条多一次往返。
+# 存活已由池在取连接时负责，这里每条物理连接每种游标只建一次，之后反复 execute
+_CURSORS = weakref.WeakKeyDictionary()  # 物理连接 -> {dictionary: 游标}
+
+def _cursor(conn, dictionary: bool):
+    cnx = conn._cnx
+    cache = _CURSORS.get(cnx)
+    if cache is None:
+        cache = _CURSORS[cnx] = {}
+    cur = cache.get(dictionary)
+    if cur is None:
+        cur = cache[dictionary] = cnx.cursor(dictionary=dictionary)
+    return cur
+
+def _forget(cnx):
+    """物理连接重连 / 断开后，缓存在它上面的游标和预处理语句都作废"""
+    _PREPARED.pop(cnx, None)
+    _CURSORS.pop(cnx, None)
+
+# ---------- 预处理语句（按物理连接缓存） ----------
+# 物理连接 -> OrderedDict{sql: (预处理游标, 首次使用的 sql 对象)}
+_PREPARED = weakref.WeakKeyDictionary()
+
+def _stmt(conn, sql):
+    """返回 (游标, sql)；游标按 `is` 判断是否同一条语句，所以总是用首次 PREPARE 时的那个字符串对象执行"""
+    cnx = conn._cnx
+    cache = _PREPARED.get(cnx)
+    if cache is None:
+        cache = _PREPARED[cnx] = OrderedDict()
+    ent = cache.get(sql)
+    if ent is not None:
+        cache.move_to_end(sql)
+        return ent
+    ent = cache[sql] = (conn.cursor(prepared=True), sql)
+    if len(cache) > PREPARED_MAX:
+        cache.popitem(last=False)[1][0].close()
+    _inc("prepares")
+    return ent
+
+def _text(v):
+    # 纯 Python 实现的预处理游标对字符串列可能返回 bytearray
+    return v.decode() if isinstance(v, (bytes, bytearray)) else v
+
+def _timed(conn, sql, args, elapsed, rows=None):
+    """每条语句执行完：/metrics 直方图 + 慢操作日志（conn 给 None 表示不能在这条连接上补 EXPLAIN）"""
+    name = metrics.statement(sql)
+    metrics.SQL_LATENCY.observe(elapsed, name)
+    slowlog.sql(conn, sql, name, args, elapsed, rows)
+
+def _execute(conn, sql, args, dictionary, prepared=True):
+    """执行一条语句；返回 (行列表 或 None, rowcount, lastrowid)。行已全部读完，连接可以继续用"""
+    t0 = time.perf_counter()
+    res = None
+    try:
+        res = _execute_timed(conn, sql, args, dictionary, prepared)
+        return res
+    finally:
+        # 出错的语句（锁等待超时等）也要记；连接状态未知，不补 EXPLAIN
+        if res is None:
+            _timed(None, sql, args, time.perf_counter() - t0)
+        else:
+            _timed(conn, sql, args, time.perf_counter() - t0, len(res[0]) if res[0] is not None else res[1])
+
+def _execute_timed(conn, sql, args, dictionary, prepared):
+    if not (PREPARED and prepared):
+        cur = _cursor(conn, dictionary)
+        cur.execute(sql, args)
+        return (cur.fetchall() if cur.description else None), cur.rowcount, cur.lastrowid
+    for attempt in (0, 1):
+        cur, stmt = _stmt(conn, sql)
+        try:
+            cur.execute(stmt, args)
+        except sqlerr.DatabaseError as e:
+            # 语句句柄失效只影响这一条语句，事务不受影响，重新 PREPARE 一次即可
+            if attempt or e.errno != _STMT_GONE_ERRNO:
+                raise
+            _PREPARED.pop(conn._cnx, None)
+            _inc("reprepares")
+            continue
+        if not cur.description:
+            return None, cur.rowcount, cur.lastrowid
+        rows = [tuple(_text(v) for v in r) for r in cur.fetchall()]
+        if dictionary:
+            names = cur.column_names
+            rows = [dict(zip(names, r)) for r in rows]
+        return rows, cur.rowcount, None
+
+def fetch_one(conn, sql: str, args: tuple = (), *, dictionary: bool = True):
+    """预处理执行并返回第一行（或 None）；其余行会被读掉，单行查询请自带 LIMIT 1"""
+    rows = _execute(conn, sql, args, dictionary)[0]
+    return rows[0] if rows else None
+
+def fetch_all(conn, sql: str, args: tuple = (), *, dictionary: bool = True, prepared: bool = True) -> list:
+    """prepared=False：IN 列表等每次文本都不同的 SQL 走普通游标，不占预处理缓存"""
+    return _execute(conn, sql, args, dictionary, prepared)[0]
+
+def execute(conn, sql: str, args: tuple = (), *, prepared: bool = True) -> int:
+    """执行 UPDATE/INSERT，返回 rowcount"""
+    return _execute(conn, sql, args, False, prepared)[1]
+
+def execute_id(conn, sql: str, args: tuple = ()) -> int:
+    """执行 UPDATE/INSERT，返回 LAST_INSERT_ID（OK 包里带回，不用再查一次）"""
+    return _execute(conn, sql, args, False)[2]
+
+def executemany(conn, sql: str, seq: list) -> int:
+    """多行 INSERT 走普通游标：executemany 只有文本协议才会合并成 multi-row VALUES"""
+    cur = _cursor(conn, False)
+    t0 = time.perf_counter()
+    cur.executemany(sql, seq)
+    _timed(None, sql, seq, time.perf_counter() - t0, cur.rowcount)
+    return cur.rowcount
+
+# ---------- 只读查询：线程池 / 原生异步 两种模式 ----------
+ASYNC = os.getenv("DB_ASYNC", "0") == "1"
+ASYNC_POOL_SIZE = int(os.getenv("DB_ASYNC_POOL_SIZE", "50"))
+
+_APOOL = None
+_APOOL_LOCK = None  # 在事件循环里懒创建
+
+def _query(conn, sql, args, one, dictionary, prepared):
+    rows = fetch_all(conn, sql, args, dictionary=dictionary, prepared=prepared)
+    if one:
+        return rows[0] if rows else None
+    return rows
+
+async def _get_apool():
+    global _APOOL, _APOOL_LOCK
+    if _APOOL is None:
+        if _APOOL_LOCK is None:
+            _APOOL_LOCK = asyncio.Lock()
+        async with _APOOL_LOCK:
+            if _APOOL is None:
+                import aiomysql
+                _APOOL = await aiomysql.create_pool(
+                    host=os.getenv("DB_HOST"),
+                    port=int(os.getenv("DB_PORT", "3306")),
+                    db=os.getenv("DB_NAME"),
+                    user=os.getenv("DB_USER"),
+                    password=os.getenv("DB_PASS"),
+                    autocommit=True,
+                    connect_timeout=int(os.getenv("CONNECT_TIMEOUT", "3")),
+                    minsize=1,
+                    maxsize=ASYNC_POOL_SIZE,
+                    pool_recycle=int(MAX_AGE_SEC),
+                )
+    return _APOOL
+
+async def _aquery(sql, args, one, dictionary):
+    import aiomysql
+    pool = await _get_apool()
+    for attempt in (0, 1):
+        try:
+            t0 = time.perf_counter()
+            async with pool.acquire() as conn:
+                waited = time.perf_counter() - t0
+                metrics.POOL_ACQUIRE.observe(waited)
+                slowlog.note("acquire_ms", waited)
+                async with conn.cursor(aiomysql.DictCursor if dictionary else aiomysql.Cursor) as cur:
+                    t0 = time.perf_counter()
+                    await cur.execute(sql, args)
+                    rows = await cur.fetchone() if one else list(await cur.fetchall())
+                    _timed(None, sql, args, time.perf_counter() - t0)
+                    return rows
+        except (aiomysql.OperationalError, aiomysql.InterfaceError) as e:
+            # 只读语句，断线直接重试一次
+            if attempt or not e.args or e.args[0] not in _STALE_ERRNO:
+                raise
+            _inc("retries")
+
+async def query(sql: str, args: tuple = (), *, one: bool = False, dictionary: bool = True, timeout: float = 3,
+                prepared: bool = True):
+    """执行一条只读语句；one=True 返回一行（或 None），否则返回行列表。
+    注意 SQL 里不要写字面量 %（aiomysql 用 Python % 格式化），LIKE 模式请作为参数传入。
+    DB_PREPARED=1 时线程模式走预处理语句；IN 列表等每次文本都不同的 SQL 传 prepared=False，免得占满缓存。"""
+    if ASYNC:
+        coro = _aquery(sql, args, one, dictionary)
+    else:
+        prepared = prepared and PREPARED
+        coro = run_in_pool(lambda conn: _query(conn, sql, args, one, dictionary, prepared))
+    return await asyncio.wait_for(coro, timeout=timeout)
+
+# ---------- 流式读取 ----------
+async def _astream(sql, args, batch, dictionary, timeout):
+    import aiomysql
+    pool = await _get_apool()
+    deadline = time.monotonic() + timeout
+    t0 = time.perf_counter()
+    try:
+        conn = await asyncio.wait_for(pool.acquire(), ACQUIRE_TIMEOUT)
+    except asyncio.TimeoutError:
+        raise PoolBusy("database busy: timed out waiting for a connection") from None
+    metrics.POOL_ACQUIRE.observe(time.perf_counter() - t0)
+    done = False
+    try:
+        cur = await conn.cursor(aiomysql.SSDictCursor if dictionary else aiomysql.SSCursor)
+        t0 = time.perf_counter()
+        await asyncio.wait_for(cur.execute(sql, args), max(0.0, deadline - time.monotonic()))
+        _timed(None, sql, args, time.perf_counter() - t0)
+        while True:
+            rows = await asyncio.wait_for(cur.fetchmany(batch), max(0.0, deadline - time.monotonic()))
+            if not rows:
+                done = True
+                break
+            yield list(rows)
+            if time.monotonic() > deadline:
+                raise TimeoutError("stream aborted: consumer too slow")
+        await cur.close()
+    finally:
+        if not done:
+            # 同线程模式：提前结束就断开，不读剩下的行（SSCursor.close() 会把结果读完）；断开的连接归还时池直接丢弃
+            conn.close()
+        pool.release(conn)
+
+async def stream(sql: str, args: tuple = (), *, batch: int = 500, dictionary: bool = True, timeout: float = 60):
+    """async 生成器：用非缓冲游标执行只读语句，每次产出最多 batch 行。
+
+    线程模式下 DB 线程边读边把批次交给事件循环，最多领先 DB_STREAM_QUEUE 批；
+    消费者慢（客户端网速慢）时 DB 线程就停在那里等，不会把整个结果集读进内存。
+    消费者中途退出（客户端断开）或总耗时超过 timeout 秒，DB 线程放弃剩余的行并断开这条连接（下次取到时重连）。
+    同时最多 DB_STREAM_MAX 个流，超出直接抛 PoolBusy（503），不排队占线程。
+    DB_ASYNC=1 时同样受 DB_STREAM_MAX / timeout 限制，取连接超过 DB_ACQUIRE_TIMEOUT 抛 PoolBusy，提前结束同样断开连接。
+    """
+    if not _STREAMS.acquire(blocking=False):
+        raise PoolBusy("database busy: too many concurrent streams")
+    gen = _astream(sql, args, batch, dictionary, timeout) if ASYNC else _stream(sql, args, batch, dictionary, timeout)
+    try:
+        async for rows in gen:
+            yield rows
+    finally:
+        # 立刻收尾（断开读了一半的连接）再放名额，不等垃圾回收
+        await gen.aclose()
+        _STREAMS.release()
+
+_STREAMS = threading.BoundedSemaphore(STREAM_MAX)
+
+async def _stream(sql, args, batch, dictionary, timeout):
+    loop = asyncio.get_running_loop()
+    q = asyncio.Queue(maxsize=STREAM_QUEUE)
+    stop = threading.Event()
+    deadline = time.monotonic() + timeout
+
+    def _put(rows):
+        fut = asyncio.run_coroutine_threadsafe(q.put(rows), loop)
+        while True:
+            try:
+                return fut.result(timeout=0.2)
+            except concurrent.futures.TimeoutError:
+                if stop.is_set() or time.monotonic() > deadline:
+                    fut.cancel()
+                    raise TimeoutError("stream aborted: consumer gone or too slow")
+
+    def _work(conn):
+        cur = conn.cursor(dictionary=dictionary)
+        done = False
+        try:
+            # 流式语句只计到开始出行（之后的耗时取决于消费者）
+            t0 = time.perf_counter()
+            cur.execute(sql, args)
+            _timed(None, sql, args, time.perf_counter() - t0)
+            while not stop.is_set():
+                rows = cur.fetchmany(batch)
+                if not rows:
+                    done = True
+                    break
+                # 已经有行交出去了，断线重试会重复产出
+                no_retry(conn)
+                _put(rows)
+        finally:
+            if done:
+                cur.close()
+            else:
+                # 提前结束（客户端断开 / 太慢 / 超时 / 出错）：剩下的行可能还很多，读完要占着连接很久，直接断开
+                discard(conn)
+
+    task = asyncio.ensure_future(run_in_pool(_work))
+    # 消费者先走了的话没人取结果，这里取一下免得打 "exception was never retrieved"
+    task.add_done_callback(lambda t: t.cancelled() or t.exception())
+    getter = None
+    try:
+        while True:
+            if q.empty() and task.done():
+                task.result()
+                return
+            getter = asyncio.ensure_future(q.get())
+            await asyncio.wait({getter, task}, return_when=asyncio.FIRST_COMPLETED)
+            if getter.done():
+                yield getter.result()
+            else:
+                getter.cancel()
+    finally:
+        stop.set()
+        if getter is not None and not getter.done():
+            getter.cancel()
+
+async def close_async_pool():
+    global _APOOL, _APOOL_LOCK
+    if _APOOL is not None:
+        _APOOL.close()
+        await _APOOL.wait_closed()
+        _APOOL = None
+    _APOOL_LOCK = None
+
+# ---------- 专用 DB 线程池（大小与连接池一致） ----------
+class PoolBusy(Exception):
+    """DB 排队已满或等待超时；调用方应返回 503 让客户端稍后重试"""
+
+_EXECUTOR = ThreadPoolExecutor(max_workers=POOL_SIZE, thread_name_prefix="db")
+# queued: 排队中；active: 正在占用连接执行；wait_*: 排队耗时（秒）
+_GAUGE = {"queued": 0, "active": 0, "started": 0, "rejected": 0, "timed_out": 0,
+          "wait_total": 0.0, "wait_ms_max": 0.0}
+
+def _dequeued(cf):
+    # 排队中被取消（上层 wait_for 超时）时任务不会再执行，这里补减计数
+    if cf.cancelled():
+        with _STATS_LOCK:
+            _GAUGE["queued"] -= 1
+
+async def run_in_pool(fn):
+    """在专用线程池里执行 run(fn)；线程数 = 连接池大小，所以 get_connection 不会因耗尽而报错"""
+    with _STATS_LOCK:
+        if _GAUGE["queued"] >= QUEUE_MAX:
+            _GAUGE["rejected"] += 1
+            raise PoolBusy("database busy: queue full")
+        _GAUGE["queued"] += 1
+    enqueued = time.monotonic()
+
+    def _job():
+        waited = time.monotonic() - enqueued
+        metrics.THREAD_HANDOFF.observe(waited)
+        slowlog.note("handoff_ms", waited)
+        with _STATS_LOCK:
+            _GAUGE["queued"] -= 1
+            _GAUGE["started"] += 1
+            _GAUGE["wait_total"] += waited
+            _GAUGE["wait_ms_max"] = max(_GAUGE["wait_ms_max"], waited * 1000)
+            if waited > ACQUIRE_TIMEOUT:
+                # 兜底：到点时恰好被线程取走，等待方已经取消不了
+                _GAUGE["timed_out"] += 1
+                raise PoolBusy("database busy: timed out waiting for a connection")
+            _GAUGE["active"] += 1
+        try:
+            return run(fn)
+        finally:
+            with _STATS_LOCK:
+                _GAUGE["active"] -= 1
+
+    # 带上请求的 contextvar（慢操作日志的请求上下文）进 DB 线程
+    cf = _EXECUTOR.submit(contextvars.copy_context().run, _job)
+    cf.add_done_callback(_dequeued)
+    fut = asyncio.wrap_future(cf)
+    try:
+        # 排队超时在等待方判定：等线程的时间一长，上层的 READ/WRITE_TIMEOUT 会先触发，变成 500 而不是 503
+        done, _ = await asyncio.wait({fut}, timeout=ACQUIRE_TIMEOUT)
+    except BaseException:
+        fut.cancel()  # 上层超时/断开：还在排队的话就不再执行
+        raise
+    if not done and cf.cancel():
+        with _STATS_LOCK:
+            _GAUGE["timed_out"] += 1
+        raise PoolBusy("database busy: timed out waiting for a connection")
+    return await fut
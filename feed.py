@@ -0,0 +1,175 @@
+# feed.py
+"""标签变更推送（/tags/stream 用）。
+
+写接口提交后把新行（带 change_seq）交给 ChangeFeed.publish()；这里按 change_seq 排好序，
+放进最近 N 条的环形缓冲，再分发给各订阅者的有界队列。
+
+- 顺序：各 DB 线程提交后几乎同时 publish，到达顺序可能与序号不同。change_seq 在提交时连续分配
+  （回滚的事务序号也一起回滚），所以先到的大号会等前面的小号，最多等 gap_wait 秒；
+  超时仍缺号（别的 worker 的写入 / COMMIT 结果未知没 publish）就调 fill(after) 从库里补，补不到的跳过。
+  没有订阅者和长轮询时不查库（fill 一次最多读几千行），直接跳过；跳过的号可能库里有，续传跨过它时改查库。
+- 背压：订阅者队列满了就不再往里放，标记 lagged；推送端把已排队的发完后通知客户端带游标重连，
+  不为慢客户端无限堆积内存。
+- 续传：replay(since) 从环形缓冲取 since 之后的事件；缓冲不够老时返回 None，由调用方查库。
+- 长轮询：wait_for_change(after, timeout) 挂在一个 Future 上等下一批事件，不占 DB 连接和线程。
+"""
+import asyncio
+from collections import deque
+
+class Subscription:
+    def __init__(self, match, queue_max: int):
+        self.match = match          # match(event) -> bool；None 表示全要
+        self.queue = asyncio.Queue(queue_max)
+        self.lagged = False
+
+class ChangeFeed:
+    def __init__(self, history: int, queue_max: int, gap_wait: float):
+        self.queue_max = queue_max
+        self.gap_wait = gap_wait
+        self.fill = None            # async fill(after_seq) -> 事件列表（change_seq > after_seq，按序）
+        self._buf = deque(maxlen=history)
+        self._pending = {}          # change_seq -> 事件，等前面缺的号
+        self._next = None           # 下一个该发的序号
+        self._subs = set()
+        self._loop = None
+        self._gap_task = None
+        self._waiters = set()       # 长轮询挂起的 Future
+        self._hole = None           # 没查库就跳过的最大序号：续传起点比它早时缓冲不完整
+        self._stats = {"published": 0, "gaps": 0, "filled": 0, "skipped": 0, "lagged": 0}
+
+    def start(self, loop, last_seq: int | None):
+        """last_seq：启动时库里的当前序号（读不到传 None，以第一条到达的事件为准）"""
+        self._loop = loop
+        if last_seq is not None:
+            self._next = last_seq + 1
+
+    def last_seq(self) -> int | None:
+        return None if self._next is None else self._next - 1
+
+    # ---------- 发布 ----------
+    def publish(self, events: list[dict]):
+        """任意线程可调；事件必须带 change_seq"""
+        if self._loop is not None and events:
+            self._loop.call_soon_threadsafe(self._accept, events)
+
+    def _accept(self, events):
+        for e in events:
+            seq = e["change_seq"]
+            if self._next is None:
+                self._next = seq
+            if seq >= self._next and seq not in self._pending:
+                self._pending[seq] = e
+        self._drain()
+
+    def _drain(self):
+        emitted = False
+        while self._next in self._pending:
+            self._emit(self._pending.pop(self._next))
+            self._next += 1
+            emitted = True
+        if emitted and self._waiters:
+            for fut in self._waiters:
+                if not fut.done():
+                    fut.set_result(None)
+            self._waiters.clear()
+        if self._pending and self._gap_task is None:
+            self._stats["gaps"] += 1
+            self._gap_task = asyncio.ensure_future(self._close_gap())
+
+    async def _close_gap(self):
+        try:
+            await asyncio.sleep(self.gap_wait)
+            checked = False
+            if self._pending and (self._subs or self._waiters):
+                try:
+                    await self.catch_up()
+                    checked = True
+                except Exception:
+                    pass  # 查不了库就直接跳过缺口
+            if self._pending:
+                # 库里也没有（已被后续写入覆盖成更大的号，或没提交）：跳过缺口
+                head = min(self._pending)
+                self._stats["skipped"] += head - self._next
+                if not checked:
+                    self._hole = head - 1
+                self._next = head
+                self._drain()
+        finally:
+            self._gap_task = None
+            if self._pending and self._gap_task is None:
+                self._gap_task = asyncio.ensure_future(self._close_gap())
+
+    async def catch_up(self):
+        """从库里补 _next 之后的变更（缺号补洞；多 worker 时定时调用，拿到别的 worker 的写入）"""
+        if self.fill is None or self._next is None:
+            return
+        after = self._next - 1
+        for e in await self.fill(after):
+            seq = e["change_seq"]
+            if seq >= self._next and seq not in self._pending:
+                self._pending[seq] = e
+                self._stats["filled"] += 1
+        if self._pending and self._next not in self._pending and self._next - 1 == after:
+            # 库里读到的最小号之前的号都已被覆盖，不会再出现
+            head = min(self._pending)
+            self._stats["skipped"] += head - self._next
+            self._next = head
+        self._drain()
+
+    def _emit(self, e):
+        self._buf.append(e)
+        self._stats["published"] += 1
+        for sub in list(self._subs):
+            if sub.match is not None and not sub.match(e):
+                continue
+            try:
+                sub.queue.put_nowait(e)
+            except asyncio.QueueFull:
+                sub.lagged = True
+                self._subs.discard(sub)
+                self._stats["lagged"] += 1
+
+    # ---------- 订阅 ----------
+    def subscribe(self, match=None) -> Subscription:
+        sub = Subscription(match, self.queue_max)
+        self._subs.add(sub)
+        return sub
+
+    def unsubscribe(self, sub: Subscription):
+        self._subs.discard(sub)
+
+    async def wait_for_change(self, after: int | None, timeout: float) -> bool:
+        """等到发出 change_seq > after 的事件（after 为调用方查库前取的 last_seq()，查库期间的写入不会漏掉）；
+        超时返回 False"""
+        if after is not None and self._next is not None and self._next - 1 > after:
+            return True
+        fut = asyncio.get_running_loop().create_future()
+        self._waiters.add(fut)
+        try:
+            await asyncio.wait_for(fut, timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+        finally:
+            self._waiters.discard(fut)
+
+    def replay(self, since: int) -> list[dict] | None:
+        """环形缓冲里 change_seq > since 的事件；缓冲覆盖不到 since 时返回 None"""
+        if self._next is None:
+            return None
+        if since >= self._next - 1:
+            return []
+        if not self._buf or self._buf[0]["change_seq"] > since + 1:
+            return None
+        if self._hole is not None and since < self._hole:
+            return None
+        return [e for e in self._buf if e["change_seq"] > since]
+
+    def stats(self) -> dict:
+        out = dict(self._stats)
+        out["subscribers"] = len(self._subs)
+        out["buffered"] = len(self._buf)
+        out["pending"] = len(self._pending)
+        out["waiters"] = len(self._waiters)
+        out["last_seq"] = self.last_seq()
+        return out
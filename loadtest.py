@@ -0,0 +1,416 @@
+# loadtest.py
+"""整套接口的压测：在独立的测试库里灌数据，按比例混合真实操作并发压，结果以 JSON 打印，方便版本间对比。
+
+用法：
+  python loadtest.py seed [--db rfid_loadtest] [--tags 50000] [--logs 200000] [--bom 5000]
+  python loadtest.py run  [--db rfid_loadtest] [--duration 30] [--concurrency 50]
+                          [--mix scan=55,move=15,register=5,audit=10,sync=15] [--burst 5] [--url http://host:8080]
+  python loadtest.py all  （seed + run，参数同上）
+
+seed 在 --db 指定的库里建 rfid_tags_current / rfid_tags_log / bom（迁移前的原始结构），
+灌入随机数据后跑一遍 migrations.apply()，与线上走同一套迁移。--db 不能与 DB_NAME（业务库）相同。
+连接参数仍用 DB_HOST / DB_PORT / DB_USER / DB_PASS。
+
+run 默认进程内驱动 main.app（httpx ASGITransport，含 startup/shutdown，不经网络），DB_NAME 临时指向 --db；
+给 --url 时改压已经在跑的服务（该服务需自己连到同一个测试库）。每个虚拟手持机：
+  scan      一次连扫 --burst 个 TID（GET /tags/by-tid 并发），每个请求单独计时
+  move      PATCH /tags/{tid} 移到另一个库位
+  register  POST /tags/register 新标签
+  audit     POST /tags/{tid}/audit
+  sync      GET /tags/updated-since，各自维护 (ts, last_tid) 游标
+  changes   GET /tags/changes，各自维护 since_seq 游标
+  bulk      POST /tags/bulk-update，一次 --bulk-size 个 TID 换库位
+比较 --mix move=50 与 --mix move=50,bulk=2 下 move 的 p99，可以看出单条写入有没有排在批量事务后面
+（批量接口最后才领 change_seq，计数行锁只覆盖补号 + 日志两条语句）。
+随机数按 --seed 固定（每台虚拟手持机一个子种子），同样参数两次运行的操作序列相同。
+
+不提供 SQLite 之类的嵌入式替身：SQL 里有 SYSDATE() / FOR UPDATE / 生成列 / 窗口函数，
+替身测到的是另一个数据库的性能，没有对比意义。
+"""
+import argparse, asyncio, json, os, random, time
+from datetime import datetime, timedelta
+from dotenv import load_dotenv
+import mysql.connector
+import migrations
+from bench import _pct, _rand_tid
+
+load_dotenv()
+
+AREAS = ["W/H", "W/H", "W/H", "KITING", "LINE", None]
+RACK_AREAS = {"W/H", "KITING"}  # 与 main.REQUIRED_RACK_AREAS 一致
+USERS = ["user%02d" % k for k in range(40)]
+
+def _racks() -> list[str]:
+    return ["R%02d-%02d-%d" % (a, b, c) for a in range(20) for b in range(20) for c in range(4)]
+
+def _items(rnd: random.Random, n: int) -> list[str]:
+    return sorted({"%s-%05d" % (rnd.choice(["LI", "NIMH", "CR", "LFP"]), rnd.randrange(100000)) for _ in range(n)})
+
+# 迁移前的原始表结构（tid_key / change_seq 等由 migrations.apply 补上）
+_DDL = [
+    """
+    CREATE TABLE rfid_tags_current (
+        tid VARCHAR(64) NOT NULL PRIMARY KEY,
+        epc VARCHAR(64) NULL,
+        label_number VARCHAR(64) NULL,
+        muf_no VARCHAR(64) NULL,
+        fg_no VARCHAR(64) NULL,
+        item VARCHAR(64) NULL,
+        qty INT NULL,
+        ctn_qty INT NULL,
+        batch_no VARCHAR(64) NULL,
+        rack_location VARCHAR(64) NULL,
+        area VARCHAR(32) NULL,
+        remark VARCHAR(255) NULL,
+        updated_at DATETIME NULL,
+        updated_by VARCHAR(64) NULL,
+        audit_at DATETIME NULL
+    )
+    """,
+    """
+    CREATE TABLE rfid_tags_log (
+        id BIGINT NOT NULL AUTO_INCREMENT PRIMARY KEY,
+        tid VARCHAR(64) NULL,
+        epc VARCHAR(64) NULL,
+        label_number VARCHAR(64) NULL,
+        item VARCHAR(64) NULL,
+        batch_no VARCHAR(64) NULL,
+        action VARCHAR(32) NULL,
+        qty_old INT NULL,
+        qty_new INT NULL,
+        from_rack_location VARCHAR(64) NULL,
+        to_rack_location VARCHAR(64) NULL,
+        area_old VARCHAR(32) NULL,
+        area_new VARCHAR(32) NULL,
+        remark VARCHAR(255) NULL,
+        updated_at DATETIME NULL,
+        updated_by VARCHAR(64) NULL,
+        KEY ix_log_tid (tid)
+    )
+    """,
+    """
+    CREATE TABLE bom (
+        id INT NOT NULL AUTO_INCREMENT PRIMARY KEY,
+        item VARCHAR(64) NULL,
+        item_cat VARCHAR(16) NULL
+    )
+    """,
+]
+
+def _check_db(name: str):
+    if name == os.getenv("DB_NAME"):
+        raise SystemExit(f"--db {name} is the business database (DB_NAME); use a separate schema")
+
+def _connect(database: str | None):
+    return mysql.connector.connect(
+        host=os.getenv("DB_HOST"), port=int(os.getenv("DB_PORT", "3306")), database=database,
+        user=os.getenv("DB_USER"), password=os.getenv("DB_PASS"), autocommit=True,
+        connection_timeout=int(os.getenv("CONNECT_TIMEOUT", "3")),
+    )
+
+# ---------- seed ----------
+def seed(args) -> dict:
+    _check_db(args.db)
+    rnd = random.Random(args.seed)
+    t0 = time.perf_counter()
+    conn = _connect(None)
+    cur = conn.cursor()
+    cur.execute(f"DROP DATABASE IF EXISTS `{args.db}`")
+    cur.execute(f"CREATE DATABASE `{args.db}` CHARACTER SET utf8mb4")
+    cur.execute(f"USE `{args.db}`")
+    try:
+        for ddl in _DDL:
+            cur.execute(ddl)
+
+        items = _items(rnd, max(args.bom // 2, 1))
+        racks = _racks()
+        now = datetime.now().replace(microsecond=0)
+
+        tags, batch = [], []
+        for i in range(args.tags):
+            area = rnd.choice(AREAS)
+            tid = _rand_tid(rnd).upper()
+            tags.append(tid)
+            batch.append((tid, "L%09d" % i, rnd.choice(items), rnd.randrange(1, 500), rnd.choice([None, 10, 20, 50]),
+                          "B%05d" % rnd.randrange(3000), rnd.choice(racks) if area in RACK_AREAS else None, area,
+                          now - timedelta(seconds=rnd.randrange(30 * 86400)), rnd.choice(USERS)))
+            if len(batch) >= 5000 or i == args.tags - 1:
+                cur.executemany("""
+                    INSERT INTO rfid_tags_current
+                    (tid, label_number, item, qty, ctn_qty, batch_no, rack_location, area, updated_at, updated_by)
+                    VALUES (%s,%s,%s,%s,%s,%s,%s,%s,%s,%s)
+                """, batch)
+                batch = []
+
+        for i in range(args.logs):
+            tid = rnd.choice(tags)
+            batch.append((tid, rnd.choice(items), rnd.choice(["REGISTER", "WRITE_INFO", "MOVE", "AUDIT"]),
+                          rnd.randrange(500), rnd.randrange(500), rnd.choice(racks), rnd.choice(racks),
+                          now - timedelta(seconds=rnd.randrange(30 * 86400)), rnd.choice(USERS)))
+            if len(batch) >= 5000 or i == args.logs - 1:
+                cur.executemany("""
+                    INSERT INTO rfid_tags_log
+                    (tid, item, action, qty_old, qty_new, from_rack_location, to_rack_location, updated_at, updated_by)
+                    VALUES (%s,%s,%s,%s,%s,%s,%s,%s,%s)
+                """, batch)
+                batch = []
+
+        # BOM：同一物料在多张 BOM 里重复出现，另掺一些非 BATT 的
+        bom = [(rnd.choice(items), "BATT") for _ in range(args.bom)]
+        bom += [("PCB-%05d" % rnd.randrange(100000), "PCB") for _ in range(args.bom // 4)]
+        for k in range(0, len(bom), 5000):
+            cur.executemany("INSERT INTO bom (item, item_cat) VALUES (%s,%s)", bom[k:k + 5000])
+    finally:
+        cur.close()
+        conn.close()
+
+    conn = _connect(args.db)
+    try:
+        applied = migrations.apply(conn)
+        cur = conn.cursor()
+        for table in ("rfid_tags_current", "rfid_tags_log", "bom"):
+            cur.execute(f"ANALYZE TABLE {table}")
+            cur.fetchall()
+        cur.close()
+    finally:
+        conn.close()
+    return {"step": "seed", "db": args.db, "tags": args.tags, "logs": args.logs, "bom": len(bom),
+            "migrations": applied, "seconds": round(time.perf_counter() - t0, 1)}
+
+# ---------- run ----------
+def _parse_mix(s: str) -> dict:
+    mix = {}
+    for part in s.split(","):
+        name, _, w = part.partition("=")
+        if name.strip() not in _OPS:
+            raise SystemExit(f"unknown op in --mix: {name}")
+        mix[name.strip()] = float(w or 1)
+    return mix
+
+class _Recorder:
+    def __init__(self):
+        self.samples = {}   # op -> [秒]
+        self.errors = {}    # op -> {状态码 / 异常名: 次数}
+
+    def add(self, op: str, elapsed: float, status):
+        self.samples.setdefault(op, []).append(elapsed)
+        if status != 200:
+            errs = self.errors.setdefault(op, {})
+            errs[str(status)] = errs.get(str(status), 0) + 1
+
+    @staticmethod
+    def _summary(samples: list[float], errors: dict, wall: float) -> dict:
+        n, failed = len(samples), sum(errors.values())
+        return {
+            "requests": n, "rps": round(n / wall, 1), "errors": failed,
+            "error_rate": round(failed / n, 4) if n else 0.0, "by_status": errors,
+            "p50_ms": round(_pct(samples, 50) * 1000, 2) if n else None,
+            "p95_ms": round(_pct(samples, 95) * 1000, 2) if n else None,
+            "p99_ms": round(_pct(samples, 99) * 1000, 2) if n else None,
+            "max_ms": round(max(samples) * 1000, 2) if n else None,
+        }
+
+    def report(self, wall: float) -> dict:
+        ops = {op: self._summary(s, self.errors.get(op, {}), wall) for op, s in sorted(self.samples.items())}
+        all_samples = [x for s in self.samples.values() for x in s]
+        all_errors = {}
+        for errs in self.errors.values():
+            for k, v in errs.items():
+                all_errors[k] = all_errors.get(k, 0) + v
+        return {"total": self._summary(all_samples, all_errors, wall), "ops": ops}
+
+async def _timed(rec: _Recorder, op: str, coro):
+    t0 = time.perf_counter()
+    try:
+        r = await coro
+        status = r.status_code
+    except Exception as e:
+        status = type(e).__name__
+    rec.add(op, time.perf_counter() - t0, status)
+    return status
+
+class _Handheld:
+    """一台虚拟手持机：自己的随机数、注册计数和同步游标"""
+
+    def __init__(self, n: int, args, tids: list[str], racks: list[str], items: list[str], headers: dict, run_tag: str):
+        self.n, self.args, self.tids, self.racks, self.items = n, args, tids, racks, items
+        self.rnd = random.Random(args.seed * 1000 + n)
+        self.headers = headers
+        self.run_tag = run_tag
+        self.registered = 0
+        self.ts, self.last_tid = datetime.now().strftime("%Y-%m-%d %H:%M:%S"), ""
+        self.since_seq = None
+
+    async def scan(self, c, rec):
+        tids = [self.rnd.choice(self.tids) for _ in range(self.args.burst)]
+        # 手持机大小写不固定
+        tids = [t.lower() if self.rnd.random() < 0.5 else t for t in tids]
+        await asyncio.gather(*(_timed(rec, "scan", c.get("/tags/by-tid", params={"tid": t}, headers=self.headers))
+                               for t in tids))
+
+    async def move(self, c, rec):
+        area = self.rnd.choice(["W/H", "KITING"])
+        body = {"area": area, "rack_location": self.rnd.choice(self.racks), "action": "MOVE", "actor": f"lt{self.n}"}
+        await _timed(rec, "move", c.patch(f"/tags/{self.rnd.choice(self.tids)}", json=body, headers=self.headers))
+
+    async def register(self, c, rec):
+        self.registered += 1
+        tid = "LT%s%04d%06d" % (self.run_tag, self.n, self.registered)
+        body = {"tid": tid, "label_number": "N" + tid, "item": self.rnd.choice(self.items), "qty": self.rnd.randrange(1, 500),
+                "area": "W/H", "rack_location": self.rnd.choice(self.racks), "actor": f"lt{self.n}"}
+        await _timed(rec, "register", c.post("/tags/register", json=body, headers=self.headers))
+
+    async def audit(self, c, rec):
+        await _timed(rec, "audit", c.post(f"/tags/{self.rnd.choice(self.tids)}/audit",
+                                          json={"actor": f"lt{self.n}"}, headers=self.headers))
+
+    async def sync(self, c, rec):
+        params = {"ts": self.ts, "last_tid": self.last_tid, "limit": self.args.sync_limit}
+        t0 = time.perf_counter()
+        try:
+            r = await c.get("/tags/updated-since", params=params, headers=self.headers)
+            status = r.status_code
+            rows = r.json() if status == 200 else []
+        except Exception as e:
+            status, rows = type(e).__name__, []
+        rec.add("sync", time.perf_counter() - t0, status)
+        if rows:
+            self.ts, self.last_tid = rows[-1]["updated_at"], rows[-1]["tid"]
+
+    async def changes(self, c, rec):
+        if self.since_seq is None:
+            self.since_seq = self.args.start_seq
+        t0 = time.perf_counter()
+        try:
+            r = await c.get("/tags/changes", params={"since_seq": self.since_seq, "limit": self.args.sync_limit},
+                            headers=self.headers)
+            status = r.status_code
+            rows = r.json() if status == 200 else []
+        except Exception as e:
+            status, rows = type(e).__name__, []
+        rec.add("changes", time.perf_counter() - t0, status)
+        if rows:
+            self.since_seq = rows[-1]["change_seq"]
+
+    async def bulk(self, c, rec):
+        rack = self.rnd.choice(self.racks)
+        items = [{"tid": t, "area": "W/H", "rack_location": rack, "actor": f"lt{self.n}"}
+                 for t in self.rnd.sample(self.tids, min(self.args.bulk_size, len(self.tids)))]
+        await _timed(rec, "bulk", c.post("/tags/bulk-update", json={"items": items}, headers=self.headers))
+
+_OPS = ("scan", "move", "register", "audit", "sync", "changes", "bulk")
+
+def _sample_data(args):
+    """从测试库取一批 TID / 物料 / 当前最大 change_seq 给虚拟手持机用"""
+    conn = _connect(args.db)
+    cur = conn.cursor()
+    try:
+        cur.execute("SELECT tid FROM rfid_tags_current ORDER BY tid LIMIT %s", (args.sample,))
+        tids = [r[0] for r in cur.fetchall()]
+        cur.execute("SELECT DISTINCT item FROM bom WHERE item_cat='BATT' ORDER BY item LIMIT 2000")
+        items = [r[0] for r in cur.fetchall()]
+        cur.execute("SELECT COALESCE(MAX(seq), 0) FROM rfid_change_seq")
+        start_seq = cur.fetchone()[0]
+    finally:
+        cur.close()
+        conn.close()
+    if not tids:
+        raise SystemExit(f"{args.db}.rfid_tags_current is empty; run `python loadtest.py seed` first")
+    return tids, items or ["LI-00000"], start_seq
+
+async def _drive(app, args, tids, items) -> dict:
+    import httpx
+    mix = _parse_mix(args.mix)
+    names, weights = list(mix), list(mix.values())
+    racks = _racks()
+    run_tag = format(int(time.time()) % 0xFFFFFF, "06X")
+    headers = {"x-api-key": os.getenv("API_KEY", "changeme")}
+    rec = _Recorder()
+    deadline = time.perf_counter() + args.duration
+    left = [args.requests or float("inf")]
+
+    async def _worker(c, hh):
+        while time.perf_counter() < deadline and left[0] > 0:
+            left[0] -= 1
+            op = hh.rnd.choices(names, weights)[0]
+            await getattr(hh, op)(c, rec)
+            if args.think_ms:
+                await asyncio.sleep(hh.rnd.uniform(0, 2 * args.think_ms) / 1000)
+
+    if args.url:
+        client = httpx.AsyncClient(base_url=args.url, timeout=30,
+                                   limits=httpx.Limits(max_connections=args.concurrency * args.burst))
+    else:
+        client = httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://loadtest", timeout=30)
+    async with client as c:
+        hhs = [_Handheld(i, args, tids, racks, items, headers, run_tag) for i in range(args.concurrency)]
+        t0 = time.perf_counter()
+        await asyncio.gather(*(_worker(c, hh) for hh in hhs))
+        wall = time.perf_counter() - t0
+    return {"wall_sec": round(wall, 2), **rec.report(wall)}
+
+def run(args) -> dict:
+    _check_db(args.db)
+    tids, items, start_seq = _sample_data(args)
+    args.start_seq = start_seq
+    config = {k: getattr(args, k) for k in ("db", "duration", "requests", "concurrency", "mix", "burst",
+                                            "think_ms", "sync_limit", "bulk_size", "seed", "url")}
+    if args.url:
+        return {"step": "run", "config": config, **asyncio.run(_drive(None, args, tids, items))}
+
+    # 进程内：main / db 在这之后才导入，连接池建在测试库上
+    os.environ["DB_NAME"] = args.db
+    os.environ.setdefault("SLOW_LOG_FILE", "loadtest-slow.log")
+    import db, main
+
+    async def _run():
+        async with main.app.router.lifespan_context(main.app):
+            out = await _drive(main.app, args, tids, items)
+        out["server"] = {"pool": db.stats(), "cache": (await main.cache_stats())["tags"]}
+        return out
+    return {"step": "run", "config": config, **asyncio.run(_run())}
+
+def run_all(args) -> dict:
+    return {"seed": seed(args), "run": run(args)}
+
+def main():
+    ap = argparse.ArgumentParser(description="GWIM RFID API load test")
+    ap.add_argument("--seed", type=int, default=42)
+    ap.add_argument("--db", default=os.getenv("LOADTEST_DB", "rfid_loadtest"), help="测试库名（会被 DROP 重建）")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+
+    def _seed_args(p):
+        p.add_argument("--tags", type=int, default=50000)
+        p.add_argument("--logs", type=int, default=200000)
+        p.add_argument("--bom", type=int, default=5000)
+
+    def _run_args(p):
+        p.add_argument("--duration", type=float, default=30, help="秒")
+        p.add_argument("--requests", type=int, default=0, help=">0 时到这个请求数（按操作计）也停")
+        p.add_argument("--concurrency", type=int, default=50, help="虚拟手持机数")
+        p.add_argument("--mix", default="scan=55,move=15,register=5,audit=10,sync=15")
+        p.add_argument("--burst", type=int, default=5, help="一次连扫的 TID 数")
+        p.add_argument("--think-ms", type=float, default=0, help="操作间平均停顿（0 = 不停，压极限吞吐）")
+        p.add_argument("--sync-limit", type=int, default=500)
+        p.add_argument("--bulk-size", type=int, default=500, help="bulk 操作一批的 TID 数")
+        p.add_argument("--sample", type=int, default=20000, help="虚拟手持机从多少个 TID 里随机挑")
+        p.add_argument("--url", default=None, help="压已经在跑的服务，而不是进程内的 main.app")
+
+    p = sub.add_parser("seed", help="重建测试库并灌数据")
+    _seed_args(p)
+    p.set_defaults(fn=seed)
+
+    p = sub.add_parser("run", help="按比例混合操作并发压测")
+    _run_args(p)
+    p.set_defaults(fn=run)
+
+    p = sub.add_parser("all", help="seed + run")
+    _seed_args(p)
+    _run_args(p)
+    p.set_defaults(fn=run_all)
+
+    args = ap.parse_args()
+    print(json.dumps(args.fn(args), ensure_ascii=False, indent=2, default=str))
+
+if __name__ == "__main__":
+    main()
@@ -1,33 +1,24 @@
 # main.py
-import os, asyncio, time, threading
-from fastapi import FastAPI, HTTPException, Depends, Header, Query
+import os, asyncio, time, json, gzip, hashlib
+from collections import deque
+from email.utils import formatdate, parsedate_to_datetime
+from fastapi import FastAPI, HTTPException, Depends, Header, Query, Request
+from fastapi.responses import JSONResponse, Response, StreamingResponse
 from pydantic import BaseModel
 from dotenv import load_dotenv
 import mysql.connector
-from mysql.connector import pooling
 from mysql.connector import errors as sqlerr
 from datetime import datetime, date
+import db, metrics, migrations, slowlog, tags_repo, wire
+from cache import LRUCache, TagCache
+from bom_index import ItemIndex
+from feed import ChangeFeed
+from profiler import Sampler
 
 load_dotenv()
 
 # ---------- MySQL Pool ----------
-_POOL = None
-def get_pool():
-    global _POOL
-    if _POOL is None:
-        _POOL = pooling.MySQLConnectionPool(
-            pool_name="rfid_pool",
-            pool_size=10,
-            host=os.getenv("DB_HOST"),
-            port=int(os.getenv("DB_PORT", "3306")),
-            database=os.getenv("DB_NAME"),
-            user=os.getenv("DB_USER"),
-            password=os.getenv("DB_PASS"),
-            autocommit=True,
-            connection_timeout=int(os.getenv("CONNECT_TIMEOUT", "3")),
-            pool_reset_session=True
-        )
-    return _POOL
+# 连接存活检查 / 回收 / 断线重试都在 db.py；处理器只写 _work(conn)，交给 db.run 执行
 
 # ---------- Auth ----------
 API_KEY = os.getenv("API_KEY", "changeme")
@@ -35,6 +26,12 @@ async def require_key(x_api_key: str = Header(None)):
     if x_api_key != API_KEY:
         raise HTTPException(401, "Unauthorized")
 
+# 管理接口（采样分析等）另用一把 key；没配置 ADMIN_KEY 时一律拒绝
+ADMIN_KEY = os.getenv("ADMIN_KEY")
+async def require_admin(x_admin_key: str = Header(None)):
+    if not ADMIN_KEY or x_admin_key != ADMIN_KEY:
+        raise HTTPException(403, "Forbidden")
+
 # ---------- Schemas ----------
 class TagRow(BaseModel):
     tid: str
@@ -97,15 +94,163 @@ class DeregReq(BaseModel):
 REQUIRED_RACK_AREAS = {"W/H", "KITING"}
 
 app = FastAPI()
+app.add_middleware(metrics.MetricsMiddleware)
+app.add_middleware(slowlog.SlowLogMiddleware)
+
+@app.on_event("startup")
+async def _auto_migrate():
+    # 查询依赖 tid_key/epc_key/label_key 列；生产环境建议部署时手动跑 python migrations.py
+    if os.getenv("AUTO_MIGRATE", "0") != "1":
+        return
+    await db.run_in_pool(migrations.apply)
+
+@app.exception_handler(db.PoolBusy)
+@app.exception_handler(sqlerr.PoolError)
+async def _db_busy(request: Request, exc: Exception):
+    # 连接/排队耗尽属于临时过载：503 + Retry-After，而不是 500
+    return JSONResponse(status_code=503, content={"detail": str(exc) or "database busy"}, headers={"Retry-After": "1"})
+
+@app.on_event("shutdown")
+async def _close_pools():
+    await db.close_async_pool()
 
 @app.get("/health")
 async def health():
     return {"ok": True}
 
+# ---------- 就绪检查（给负载均衡用） ----------
+# /health 只说明进程活着；/health/ready 在库不通、池/排队饱和、最近超时多时返回 503，让流量先切走。
+# DB 往返由后台任务每 HEALTH_PROBE_SEC 探测一次并缓存，LB 探得再勤也不给库加压
+_HEALTH_PROBE_SEC = float(os.getenv("HEALTH_PROBE_SEC", "5"))
+_HEALTH_WINDOW_SEC = float(os.getenv("HEALTH_WINDOW_SEC", "60"))        # 超时率统计窗口
+_HEALTH_MAX_DB_MS = float(os.getenv("HEALTH_MAX_DB_MS", "500"))         # 探测往返超过它算不健康
+_HEALTH_MAX_QUEUE = float(os.getenv("HEALTH_MAX_QUEUE_FRAC", "0.5"))    # 排队数 / DB_QUEUE_MAX
+_HEALTH_MAX_TIMEOUT_RATE = float(os.getenv("HEALTH_MAX_TIMEOUT_RATE", "0.05"))
+_HEALTH_MIN_JOBS = int(os.getenv("HEALTH_MIN_JOBS", "20"))              # 窗口内请求太少时不看超时率
+
+_PROBE = {"ok": None, "latency_ms": None, "error": None, "checked_at": None, "checked_mono": None}
+_LOAD_SAMPLES = deque()  # (monotonic, 已开始, 排队拒绝 + 排队超时, 请求超时)
+
+async def _probe_db():
+    t0 = time.monotonic()
+    try:
+        await db.query("SELECT 1", one=True, dictionary=False, timeout=max(_HEALTH_MAX_DB_MS / 1000 * 4, 1))
+        _PROBE.update(ok=True, error=None)
+    except Exception as e:
+        _PROBE.update(ok=False, error=str(e) or type(e).__name__)
+    _PROBE.update(latency_ms=round((time.monotonic() - t0) * 1000, 2), checked_mono=time.monotonic(),
+                  checked_at=datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
+
+def _sample_load():
+    g = db.load()
+    now = time.monotonic()
+    _LOAD_SAMPLES.append((now, g["started"], g["rejected"] + g["timed_out"],
+                          metrics.HTTP_OUTCOMES.total(outcome="timeout")))
+    while len(_LOAD_SAMPLES) > 2 and _LOAD_SAMPLES[1][0] <= now - _HEALTH_WINDOW_SEC:
+        _LOAD_SAMPLES.popleft()
+
+async def _health_loop():
+    while True:
+        _sample_load()
+        await _probe_db()
+        await asyncio.sleep(_HEALTH_PROBE_SEC)
+
+def _timeout_rate() -> dict:
+    if len(_LOAD_SAMPLES) < 2:
+        return {"window_sec": 0, "jobs": 0, "timeouts": 0, "rate": 0.0}
+    (t0, s0, b0, h0), (t1, s1, b1, h1) = _LOAD_SAMPLES[0], _LOAD_SAMPLES[-1]
+    timeouts = (b1 - b0) + (h1 - h0)
+    jobs = (s1 - s0) + (b1 - b0)
+    return {"window_sec": round(t1 - t0, 1), "jobs": jobs, "timeouts": timeouts,
+            "rate": round(timeouts / jobs, 4) if jobs else 0.0}
+
+@app.get("/health/ready")
+async def health_ready():
+    _sample_load()
+    g = db.load()
+    pool = {"size": db.POOL_SIZE, "active": g["active"], "utilization": round(g["active"] / db.POOL_SIZE, 3)}
+    executor = {"queued": g["queued"], "queue_max": db.QUEUE_MAX}
+    timeouts = _timeout_rate()
+    probe = {k: v for k, v in _PROBE.items() if k != "checked_mono"}
+
+    reasons = []
+    stale = _PROBE["checked_mono"] is None or time.monotonic() - _PROBE["checked_mono"] > _HEALTH_PROBE_SEC * 3
+    if stale:
+        reasons.append("db probe stale")
+    elif not _PROBE["ok"]:
+        reasons.append("db unreachable")
+    elif _PROBE["latency_ms"] > _HEALTH_MAX_DB_MS:
+        reasons.append("db slow")
+    if g["queued"] >= db.QUEUE_MAX * _HEALTH_MAX_QUEUE:
+        reasons.append("executor queue saturated")
+    if timeouts["jobs"] >= _HEALTH_MIN_JOBS and timeouts["rate"] > _HEALTH_MAX_TIMEOUT_RATE:
+        reasons.append("timeout rate high")
+
+    body = {"ready": not reasons, "reasons": reasons, "db": probe, "pool": pool, "executor": executor,
+            "timeouts": timeouts}
+    return JSONResponse(body, status_code=503 if reasons else 200, headers={"Cache-Control": "no-store"})
+
+@app.get("/pool/stats", dependencies=[Depends(require_key)])
+async def pool_stats():
+    """连接池计数（ping / 跳过的 ping / 断线重连 / 超龄回收 / 透明重试 / 归还时仍在事务中）与 DB 线程池排队指标"""
+    return db.stats()
+
+@app.get("/metrics")
+async def metrics_endpoint():
+    """Prometheus 抓取用（与 /health 一样不要求 API key）：路由 / 取连接 / 线程交接 / 每条 SQL 的延迟直方图，
+    404 / 409 / 503 / 超时计数，以及池和推送的瞬时值"""
+    s = db.stats()
+    extra = (
+        metrics.gauge("rfid_db_pool_size", "Connection pool size (= DB executor threads)", db.POOL_SIZE)
+        + metrics.gauge("rfid_db_executor_queued", "DB jobs waiting for a thread", s["queued"])
+        + metrics.gauge("rfid_db_executor_active", "DB jobs holding a connection", s["active"])
+        + metrics.gauge("rfid_db_executor_rejected_total", "DB jobs rejected because the queue was full",
+                        s["rejected"], "counter")
+        + metrics.gauge("rfid_db_executor_timed_out_total", "DB jobs that waited longer than DB_ACQUIRE_TIMEOUT",
+                        s["timed_out"], "counter")
+        + metrics.gauge("rfid_stream_subscribers", "Open /tags/stream connections", FEED.stats()["subscribers"])
+        + metrics.gauge("rfid_tag_cache_size", "Rows in the tag cache", TAG_CACHE.stats()["size"])
+    )
+    return Response(metrics.render(extra), media_type="text/plain; version=0.0.4")
+
+@app.get("/cache/stats", dependencies=[Depends(require_key)])
+async def cache_stats():
+    """进程内缓存命中 / 未命中 / 淘汰计数（每个 worker 各自一份）"""
+    return {"tags": TAG_CACHE.stats(), "bom_items": _SUGG_CACHE.stats(), "bom_index": _bom_index_stats(),
+            "bom_all_items": _ALL_ITEMS.stats()}
+
+# 过期条目定期清掉（LRU 只在满了才淘汰，过期但没人再读的条目会一直占内存）
+_CACHE_SWEEP_SEC = float(os.getenv("CACHE_SWEEP_SEC", "60"))
+_BG_TASKS = []
+
+async def _sweep_caches():
+    while True:
+        await asyncio.sleep(_CACHE_SWEEP_SEC)
+        TAG_CACHE.sweep()
+        _SUGG_CACHE.sweep()
+
+@app.on_event("startup")
+async def _start_background():
+    _BG_TASKS.append(asyncio.create_task(_sweep_caches()))
+    if _BOM_INDEX_ON:
+        _BG_TASKS.append(asyncio.create_task(_bom_index_loop()))
+    await _start_feed()
+    _BG_TASKS.append(asyncio.create_task(_health_loop()))
+
+@app.on_event("shutdown")
+async def _stop_background():
+    for t in _BG_TASKS:
+        t.cancel()
+    _BG_TASKS.clear()
+
 # ---------- Helpers ----------
 def _upper_or_none(s):
     return s.upper() if isinstance(s, str) and s.strip() != "" else None
 
+def _key(s):
+    """查询键：与 tid_key/epc_key/label_key（= UPPER(列)）等值比较，走索引"""
+    return s.upper() if isinstance(s, str) else s
+
 def _normalize_row(row: dict | None):
     """把 updated_at/updated_by 统一格式，避免前端误判并发冲突"""
     if not row:
@@ -125,377 +270,914 @@ def _normalize_rows(rows: list[dict]):
         _normalize_row(r)
     return rows
 
-# ---------- Query (case-insensitive) ----------
+# SQL 都在 tags_repo.py；写接口锁行时顺带取 SYSDATE() 作为写入时间，新行在 Python 里算出来，不回读
+
+# ---------- 标签行缓存（by-tid / by-epc / by-tids 读穿透，写接口提交后失效） ----------
+# 多 worker 时别的 worker 的写入清不到这里，靠短 TTL 兜底；
+# PATCH 带 prev_updated_at 时在锁行后比对，读到旧行最多导致 409，不会覆盖别人的修改
+TAG_CACHE = TagCache(int(os.getenv("TAG_CACHE_SIZE", "20000")), float(os.getenv("TAG_CACHE_TTL", "5")))
+
+def _commit(conn, *tid_keys, changes: list[dict] = ()):
+    """db.commit + 清缓存；COMMIT 失败（结果未知）也清。changes（_change() 生成）提交成功后推给 /tags/stream"""
+    try:
+        db.commit(conn)
+    finally:
+        TAG_CACHE.invalidate(*tid_keys)
+    FEED.publish(changes)
+
+async def _cached_tag(col: str, key: str):
+    row = TAG_CACHE.lookup(col, key)
+    if row is not None:
+        return row
+    gen = TAG_CACHE.generation()
+    sql = tags_repo.BY_TID if col == "tid_key" else tags_repo.BY_EPC
+    row = _normalize_row(await db.query(sql, (key,), one=True, timeout=int(os.getenv("READ_TIMEOUT", "3"))))
+    if row:
+        TAG_CACHE.fill(row, gen)
+    return row
+
+# ---------- Query (case-insensitive, 走 *_key 索引列) ----------
 @app.get("/tags/by-epc", dependencies=[Depends(require_key)])
 async def by_epc(epc: str):
-    pool = get_pool()
-    def _work():
-        conn = pool.get_connection()
-        try:
-            conn.ping(reconnect=True, attempts=1, delay=0)
-            cur = conn.cursor(dictionary=True)
-            try:
-                cur.execute("""
-                    SELECT tid, epc, label_number, muf_no, fg_no, item, qty, ctn_qty, batch_no, rack_location, area,
-                            remark, updated_at, updated_by, audit_at
-                    FROM rfid_tags_current WHERE UPPER(epc)=UPPER(%s) LIMIT 1
-                """, (epc,))
-                row = cur.fetchone()
-                return _normalize_row(row)
-            finally:
-                cur.close()
-        finally:
-            conn.close()
-    row = await asyncio.wait_for(asyncio.to_thread(_work), timeout=int(os.getenv("READ_TIMEOUT", "3")))
+    row = await _cached_tag("epc_key", _key(epc))
     if not row:
         raise HTTPException(404, "not found")
     return row
 
 @app.get("/tags/by-tid", dependencies=[Depends(require_key)])
 async def by_tid(tid: str):
-    pool = get_pool()
-    def _work():
-        conn = pool.get_connection()
-        try:
-            conn.ping(reconnect=True, attempts=1, delay=0)
-            cur = conn.cursor(dictionary=True)
-            try:
-                cur.execute("""
-                    SELECT tid, epc, label_number, muf_no, fg_no, item, qty, ctn_qty, batch_no, rack_location, area,
-                            remark, updated_at, updated_by, audit_at
-                    FROM rfid_tags_current WHERE UPPER(tid)=UPPER(%s) LIMIT 1
-                """, (tid,))
-                row = cur.fetchone()
-                return _normalize_row(row)
-            finally:
-                cur.close()
-        finally:
-            conn.close()
-    row = await asyncio.wait_for(asyncio.to_thread(_work), timeout=int(os.getenv("READ_TIMEOUT", "3")))
+    row = await _cached_tag("tid_key", _key(tid))
     if not row:
         raise HTTPException(404, "not found")
     return row
 
+# ---------- 批量查询（一次扫描多个标签） ----------
+class BatchLookupReq(BaseModel):
+    tids: list[str] = []
+    epcs: list[str] = []
+    labels: list[str] = []
+
+_BATCH_MAX = int(os.getenv("BATCH_MAX", "500"))
+
+def _dedup_keys(values: list[str]) -> list[str]:
+    seen = {}
+    for v in values:
+        k = _key(v) if isinstance(v, str) else None
+        if k and k.strip():
+            seen.setdefault(k, None)
+    return list(seen)
+
+@app.post("/tags/by-tids", dependencies=[Depends(require_key)])
+async def by_tids(body: BatchLookupReq):
+    """一次 IN 查询解析一整轮扫描；行格式与 /tags/by-tid 相同；未命中的键（大写、去重）放进 missing"""
+    tid_keys   = _dedup_keys(body.tids)
+    epc_keys   = _dedup_keys(body.epcs)
+    label_keys = _dedup_keys(body.labels)
+    if len(tid_keys) + len(epc_keys) + len(label_keys) > _BATCH_MAX:
+        raise HTTPException(400, f"too many keys (max {_BATCH_MAX})")
+
+    if not (tid_keys or epc_keys or label_keys):
+        return {"found": [], "missing": {"tids": [], "epcs": [], "labels": []}}
+
+    # 先查缓存，只把没命中的键交给数据库
+    by_tid_k, by_epc_k, by_label_k = {}, {}, {}
+    todo = {}
+    for col, keys, index in (("tid_key", tid_keys, by_tid_k), ("epc_key", epc_keys, by_epc_k),
+                             ("label_key", label_keys, by_label_k)):
+        for k in keys:
+            r = TAG_CACHE.lookup(col, k)
+            if r is not None:
+                index[k] = r
+        todo[col] = [k for k in keys if k not in index]
+
+    if any(todo.values()):
+        gen = TAG_CACHE.generation()
+        # IN 列表长度每次不同，不进预处理缓存
+        sql = tags_repo.by_keys_sql({col: len(keys) for col, keys in todo.items()})
+        rows = _normalize_rows(await db.query(sql, tuple(todo["tid_key"] + todo["epc_key"] + todo["label_key"]),
+                                              prepared=False, timeout=int(os.getenv("READ_TIMEOUT", "3"))))
+        for r in rows:
+            TAG_CACHE.fill(r, gen)
+            by_tid_k.setdefault(_key(r["tid"]), r)
+            if r.get("epc"):
+                by_epc_k.setdefault(_key(r["epc"]), r)
+            if r.get("label_number"):
+                by_label_k.setdefault(_key(r["label_number"]), r)
+
+    # 按请求顺序输出，同一行被多个键命中只出现一次
+    found, seen = [], set()
+    for keys, index in ((tid_keys, by_tid_k), (epc_keys, by_epc_k), (label_keys, by_label_k)):
+        for k in keys:
+            r = index.get(k)
+            if r is not None and _key(r["tid"]) not in seen:
+                seen.add(_key(r["tid"]))
+                found.append(r)
+    return {
+        "found": found,
+        "missing": {
+            "tids":   [k for k in tid_keys if k not in by_tid_k],
+            "epcs":   [k for k in epc_keys if k not in by_epc_k],
+            "labels": [k for k in label_keys if k not in by_label_k],
+        },
+    }
+
 # ---------- Update by TID ----------
-@app.patch("/tags/{tid}", dependencies=[Depends(require_key)])
-async def update_by_tid(tid: str, body: UpdateReq):
+def _update_inputs(body: UpdateReq) -> dict:
+    """UpdateReq 归一化：""=清空，None=不改，其余大写（单条 PATCH 与批量共用）"""
     # epc_up 已废弃：不再使用 EPC
     rack_raw = body.rack_location if isinstance(body.rack_location, str) else None
-    rack_up  = (rack_raw.strip().upper() if isinstance(rack_raw, str) and rack_raw.strip() != "" else None)
-    batch_up = _upper_or_none(body.batch_no)
-    item_up  = _upper_or_none(body.item)
-    # 原始/归一化 area
-    area_raw = body.area if isinstance(body.area, str) else None
-    area_up  = _upper_or_none(body.area)
-    label_up = _upper_or_none(body.label_number)
-    muf_up   = _upper_or_none(body.muf_no)
-    remark_v = body.remark
-    fg_up    = _upper_or_none(body.fg_no)
-    ctn_v    = body.ctn_qty  # int/None，保持原样
-
-    pool = get_pool()
-    def _work():
-        conn = pool.get_connection()
+    return {
+        "rack_raw": rack_raw,
+        "rack_up":  (rack_raw.strip().upper() if isinstance(rack_raw, str) and rack_raw.strip() != "" else None),
+        "batch_up": _upper_or_none(body.batch_no),
+        "item_up":  _upper_or_none(body.item),
+        # 原始/归一化 area
+        "area_raw": body.area if isinstance(body.area, str) else None,
+        "area_up":  _upper_or_none(body.area),
+        "label_up": _upper_or_none(body.label_number),
+        "muf_up":   _upper_or_none(body.muf_no),
+        "fg_up":    _upper_or_none(body.fg_no),
+    }
+
+def _plan_update(old: dict, body: UpdateReq, v: dict) -> tuple:
+    """基于锁定的旧行做并发/库位校验并归类动作；返回 (final_area, final_rack, final_action)"""
+    # 并发冲突（乐观）
+    if body.prev_updated_at is not None:
+        old_ts = old["updated_at"]
+        if isinstance(old_ts, (datetime, date)):
+            old_ts = old_ts.strftime("%Y-%m-%d %H:%M:%S")
+        if str(old_ts) != str(body.prev_updated_at):
+            raise HTTPException(409, "conflict: the tag was updated by someone else")
+
+    # === 最终值 & 校验 ===
+    # area: "" → NULL；None → 不改；否则更新为大写
+    if v["area_raw"] == "":
+        final_area = None
+    else:
+        final_area = v["area_up"] if v["area_up"] is not None else old["area"]
+
+    # rack: "" → NULL；None → 不改；否则更新为大写
+    if v["rack_raw"] is None:
+        final_rack = old["rack_location"]
+    else:
+        final_rack = None if v["rack_raw"] == "" else v["rack_up"]
+
+    if final_area in REQUIRED_RACK_AREAS and (final_rack is None or (isinstance(final_rack, str) and final_rack.strip() == "")):
+        raise HTTPException(400, f"rack_location required for area {final_area}")
+
+    # === 动作归类（用最终值对比，修正“清空”时误判） ===
+    qty_changed  = (body.qty is not None and body.qty != old["qty"])
+    area_changed = ((final_area or "") != (old["area"] or ""))
+    rack_changed = (final_area in REQUIRED_RACK_AREAS) and ((final_rack or "") != (old["rack_location"] or ""))
+    final_action = body.action
+    if not qty_changed and (area_changed or rack_changed) and body.action != "ADJUST_QTY":
+        final_action = "MOVE"
+    return final_area, final_rack, final_action
+
+def _label_changes(old: dict, v: dict) -> bool:
+    """请求带了新的 label 且与旧值不同 → 需要做唯一性校验"""
+    return v["label_up"] is not None and v["label_up"] != (old.get("label_number") or "").upper()
+
+def _coalesce(new, old):
+    return old if new is None else new
+
+def _case_clear(raw, up, old):
+    """对应 SQL 的 CASE WHEN raw IS NULL THEN 列 WHEN raw='' THEN NULL ELSE up END"""
+    if raw is None:
+        return old
+    return None if raw == "" else up
+
+def _apply_update(old: dict, body: UpdateReq, v: dict, now) -> dict:
+    """按 tags_repo.UPDATE 的语义从锁定的旧行算出新行（与写后回读结果一致）"""
+    new = dict(old)
+    new["label_number"]  = _coalesce(v["label_up"], old["label_number"])
+    new["muf_no"]        = _coalesce(v["muf_up"], old["muf_no"])
+    new["fg_no"]         = _coalesce(v["fg_up"], old["fg_no"])
+    new["item"]          = _coalesce(v["item_up"], old["item"])
+    new["qty"]           = _coalesce(body.qty, old["qty"])
+    new["ctn_qty"]       = _coalesce(body.ctn_qty, old["ctn_qty"])
+    new["batch_no"]      = _coalesce(v["batch_up"], old["batch_no"])
+    new["rack_location"] = _case_clear(v["rack_raw"], v["rack_up"], old["rack_location"])
+    new["area"]          = _case_clear(v["area_raw"], v["area_up"], old["area"])
+    new["remark"]        = _coalesce(body.remark, old["remark"])
+    new["updated_at"]    = now
+    new["updated_by"]    = body.actor
+    return _normalize_row(new)
+
+@app.patch("/tags/{tid}", dependencies=[Depends(require_key)])
+async def update_by_tid(tid: str, body: UpdateReq):
+    v = _update_inputs(body)
+    tid_key = _key(tid)
+
+    def _work(conn):
+        conn.start_transaction()
         try:
-            conn.ping(reconnect=True, attempts=1, delay=0)
-            conn.start_transaction()
-            cur = conn.cursor(dictionary=True)
-            try:
-                # 锁行（包含 updated_at）
-                cur.execute("""
-                    SELECT tid, epc, label_number, muf_no, fg_no, item, qty, ctn_qty, batch_no, rack_location, area,
-                        remark, updated_at, updated_by, audit_at
-                    FROM rfid_tags_current WHERE UPPER(tid)=UPPER(%s) FOR UPDATE
-                """, (tid,))
-                old = cur.fetchone()
-                if not old:
-                    raise HTTPException(404, "not found")
-
-                # 并发冲突（乐观）
-                if body.prev_updated_at is not None:
-                    old_ts = old["updated_at"]
-                    if isinstance(old_ts, (datetime, date)):
-                        old_ts = old_ts.strftime("%Y-%m-%d %H:%M:%S")
-                    if str(old_ts) != str(body.prev_updated_at):
-                        raise HTTPException(409, "conflict: the tag was updated by someone else")
-
-                # === 最终值 & 校验 ===
-                # area: "" → NULL；None → 不改；否则更新为大写
-                if area_raw == "":
-                    final_area = None
-                else:
-                    final_area = area_up if area_up is not None else old["area"]
-
-                # rack: "" → NULL；None → 不改；否则更新为大写
-                if rack_raw is None:
-                    final_rack = old["rack_location"]
-                else:
-                    final_rack = None if rack_raw == "" else rack_up
-
-                if final_area in REQUIRED_RACK_AREAS and (final_rack is None or (isinstance(final_rack, str) and final_rack.strip() == "")):
-                    raise HTTPException(400, f"rack_location required for area {final_area}")
-                
-                # 如果请求带了新的 label 且与旧值不同 → 做唯一性校验
-                if label_up is not None and label_up != (old.get("label_number") or "").upper():
-                    cur.execute("""
-                        SELECT 1 FROM rfid_tags_current
-                        WHERE UPPER(label_number)=UPPER(%s) AND UPPER(tid)<>UPPER(%s)
-                        LIMIT 1
-                    """, (label_up, tid))
-                    if cur.fetchone():
-                        raise HTTPException(409, "Duplicate label")
-
-                # 不再写 EPC；也不再做 EPC 唯一性校验
-
-                # UPDATE（按原有 CASE 写入，但去掉 epc 列）
-                cur.execute("""
-                    UPDATE rfid_tags_current
-                    SET
-                        label_number=COALESCE(%s, label_number),
-                        muf_no=COALESCE(%s, muf_no),
-                        fg_no=COALESCE(%s, fg_no),
-                        item=COALESCE(%s, item),
-                        qty=COALESCE(%s, qty),
-                        ctn_qty=COALESCE(%s, ctn_qty),
-                        batch_no=COALESCE(%s, batch_no),
-                        rack_location = CASE
-                            WHEN %s IS NULL THEN rack_location
-                            WHEN %s = '' THEN NULL
-                            ELSE %s
-                        END,
-                        area = CASE
-                            WHEN %s IS NULL THEN area
-                            WHEN %s = ''   THEN NULL
-                            ELSE %s
-                        END,
-                        remark=COALESCE(%s, remark),
-                        updated_at=NOW(), updated_by=%s
-                    WHERE UPPER(tid)=UPPER(%s)
-                """, (
-                    label_up, muf_up, fg_up, item_up, body.qty, ctn_v, batch_up,
-                    rack_raw, rack_raw, rack_up,
-                    area_raw, area_raw, area_up,
-                    remark_v, body.actor, tid
-                ))
-
-                # 取新值
-                cur.execute("""
-                    SELECT tid, epc, label_number, muf_no, fg_no, item, qty, ctn_qty, batch_no, rack_location, area,
-                        remark, updated_at, updated_by, audit_at
-                    FROM rfid_tags_current WHERE UPPER(tid)=UPPER(%s)
-                """, (tid,))
-                new = _normalize_row(cur.fetchone())
-
-                # === 动作归类（用最终值对比，修正“清空”时误判） ===
-                qty_changed  = (body.qty is not None and body.qty != old["qty"])
-                area_changed = ((final_area or "") != (old["area"] or ""))
-                rack_changed = (final_area in REQUIRED_RACK_AREAS) and ((final_rack or "") != (old["rack_location"] or ""))
-                final_action = body.action
-                if not qty_changed and (area_changed or rack_changed) and body.action != "ADJUST_QTY":
-                    final_action = "MOVE"
-
-                # 日志（epc 允许为 NULL）
-                cur.execute("""
-                    INSERT INTO rfid_tags_log
-                    (tid, epc, label_number, item, batch_no, action,
-                     qty_old, qty_new, from_rack_location, to_rack_location,
-                     area_old, area_new, remark, updated_at, updated_by)
-                    VALUES
-                    (%s,%s,%s,%s,%s,%s,
-                     %s,%s,%s,%s,
-                     %s,%s,%s,NOW(),%s)
-                """, (
-                    old["tid"], new["epc"], new["label_number"], new["item"], new["batch_no"],
-                    final_action,
-                    old["qty"], new["qty"],
-                    old["rack_location"], new["rack_location"],
-                    old["area"], new["area"],
-                    remark_v, body.actor
-                ))
-
-                conn.commit()
-                return new
-            except:
-                conn.rollback(); raise
-            finally:
-                cur.close()
-        finally:
-            conn.close()
+            # 锁行（包含 updated_at）
+            old, now = tags_repo.lock(conn, tid_key)
+            if not old:
+                raise HTTPException(404, "not found")
+
+            final_area, final_rack, final_action = _plan_update(old, body, v)
+
+            if _label_changes(old, v) and tags_repo.label_taken(conn, v["label_up"], tid_key):
+                raise HTTPException(409, "Duplicate label")
 
-    row = await asyncio.wait_for(asyncio.to_thread(_work), timeout=int(os.getenv("WRITE_TIMEOUT", "4")))
+            # 不再写 EPC；也不再做 EPC 唯一性校验
+            seq = tags_repo.next_seq(conn)
+            db.execute(conn, tags_repo.UPDATE, tags_repo.update_args(body, v, tid_key, now, seq))
+            new = _apply_update(old, body, v, now)
+
+            tags_repo.write_log(conn, old, new, final_action, body.remark, now, body.actor, seq)
+
+            _commit(conn, tid_key, changes=[_change(new, seq, final_action, old)])
+            return new
+        except:
+            conn.rollback(); raise
+
+    row = await asyncio.wait_for(db.run_in_pool(_work), timeout=int(os.getenv("WRITE_TIMEOUT", "4")))
     if not row:
         raise HTTPException(404, "not found")
     return row
 
-# ---------- Register (STRICT INSERT) ----------
-@app.post("/tags/register", dependencies=[Depends(require_key)])
-async def register(body: RegisterReq):
-    tid_up    = body.tid.upper()
-    # epc_up 忽略，统一写入 NULL
-    label_up  = body.label_number.upper()
-    item_up   = body.item.upper()
-    batch_up  = _upper_or_none(body.batch_no)
-    rack_up   = _upper_or_none(body.rack_location)
-    muf_up    = _upper_or_none(body.muf_no)
-    remark_v  = body.remark
-    area_up   = _upper_or_none(body.area)
-    fg_up     = _upper_or_none(body.fg_no)
-    ctn_v     = body.ctn_qty
+# ---------- 批量更新（整托盘移库等，一个事务） ----------
+class BulkUpdateItem(UpdateReq):
+    tid: str
+
+class BulkUpdateReq(BaseModel):
+    items: list[BulkUpdateItem]
+    all_or_nothing: bool = False  # True：任一条失败则整批回滚
+
+@app.post("/tags/bulk-update", dependencies=[Depends(require_key)])
+async def bulk_update(body: BulkUpdateReq):
+    """与逐条 PATCH /tags/{tid} 相同的校验，但一次锁行、日志一次多行 INSERT。
+    每条返回 status：200 / 400 / 404 / 409；默认部分成功照样提交。
+    label 唯一性按整批写完后的状态判断：批内两个 TID 互换 label 不算冲突。"""
+    if not body.items:
+        raise HTTPException(400, "no items")
+    if len(body.items) > _BATCH_MAX:
+        raise HTTPException(400, f"too many items (max {_BATCH_MAX})")
+    items = [(it, _key(it.tid), _update_inputs(it)) for it in body.items]
+    keys = list(dict.fromkeys(k for _, k, _ in items))
+
+    def _work(conn):
+        results = [None] * len(items)
+        def _fail(i, status, detail):
+            results[i] = {"tid": items[i][0].tid, "status": status, "detail": detail}
+
+        conn.start_transaction()
+        try:
+            # 1) 一次锁住全部行（IN 列表长度不定，走普通游标）
+            rows = db.fetch_all(conn, tags_repo.lock_many_sql(len(keys)), tuple(keys), prepared=False)
+            locked = {_key(r["tid"]): r for r in rows}
+            # SYSDATE() 逐行求值，取最大值保证不早于任何一行的上次写入
+            now = max((r.pop("db_now") for r in locked.values()), default=None)
 
+            # 2) 逐条校验（不碰库）
+            plans, seen = {}, set()
+            for i, (it, k, v) in enumerate(items):
+                if k in seen:
+                    _fail(i, 400, "duplicate tid in batch"); continue
+                seen.add(k)
+                old = locked.get(k)
+                if not old:
+                    _fail(i, 404, "not found"); continue
+                try:
+                    plans[i] = _plan_update(old, it, v)
+                except HTTPException as e:
+                    _fail(i, e.status_code, e.detail)
+
+            # 3) label 唯一性：整批一次查询，按整批写完后的状态判断——现主人在本批里改掉了 label 就不算占用；
+            #    批内互相抢同一 label 时后一条冲突。被拒的那条不再让出旧 label，所以重算到没有新的冲突为止
+            want = {i: items[i][2]["label_up"] for i in plans if _label_changes(locked[items[i][1]], items[i][2])}
+            if want:
+                labels = list(dict.fromkeys(want.values()))
+                owners = {}
+                for r in db.fetch_all(conn, tags_repo.label_owners_sql(len(labels)), tuple(labels), prepared=False):
+                    owners.setdefault(r["label_key"], set()).add(r["tid_key"])
+                while True:
+                    leaving = {items[i][1] for i in want if i in plans}
+                    claimed, rejected = set(), []
+                    for i, label in want.items():
+                        if i not in plans:
+                            continue
+                        if owners.get(label, set()) - leaving - {items[i][1]} or label in claimed:
+                            rejected.append(i)
+                        else:
+                            claimed.add(label)
+                    if not rejected:
+                        break
+                    for i in rejected:
+                        del plans[i]
+                        _fail(i, 409, "Duplicate label")
+
+            if body.all_or_nothing and len(plans) < len(items):
+                conn.rollback()
+                for i in plans:
+                    results[i] = {"tid": items[i][0].tid, "status": 424, "detail": "not applied: batch rejected"}
+                return False, results
+
+            # 4) 写入；新行由旧行 + 请求算出，不回读。change_seq 先留空
+            news, seqs = {}, {}
+            for i in plans:
+                it, k, v = items[i]
+                db.execute(conn, tags_repo.UPDATE, tags_repo.update_args(it, v, k, now, None))
+                news[i] = _apply_update(locked[k], it, v, now)
+
+            if plans:
+                # 5) 最后才领号（计数行锁持有到 COMMIT），整批一条语句补号
+                first = tags_repo.next_seq(conn, len(plans))
+                seqs = {i: first + n for n, i in enumerate(plans)}
+                tags_repo.stamp_seqs(conn, {items[i][1]: seqs[i] for i in plans})
+                # 6) 日志一次多行 INSERT（executemany 会合并成 multi-row VALUES）
+                db.executemany(conn, tags_repo.LOG, [
+                    tags_repo.log_args(locked[items[i][1]], news[i], plans[i][2], items[i][0].remark, now,
+                                       items[i][0].actor, seqs[i])
+                    for i in plans
+                ])
+                for i in plans:
+                    results[i] = {"tid": items[i][0].tid, "status": 200, "row": news[i]}
+
+            _commit(conn, *keys, changes=[_change(news[i], seqs[i], plans[i][2], locked[items[i][1]]) for i in plans])
+            return True, results
+        except:
+            conn.rollback(); raise
+
+    committed, results = await asyncio.wait_for(db.run_in_pool(_work), timeout=int(os.getenv("BULK_WRITE_TIMEOUT", "15")))
+    if not committed:
+        raise HTTPException(409, {"message": "batch rejected", "results": results})
+    return {"committed": True, "results": results}
+
+# ---------- Register (STRICT INSERT) ----------
+def _register_inputs(body: RegisterReq) -> dict:
+    """RegisterReq 归一化 + area/库位校验（不通过抛 400）；单条与批量注册共用"""
+    v = {
+        "tid_up":   body.tid.upper(),
+        # epc_up 忽略，统一写入 NULL
+        "label_up": body.label_number.upper(),
+        "item_up":  body.item.upper(),
+        "batch_up": _upper_or_none(body.batch_no),
+        "rack_up":  _upper_or_none(body.rack_location),
+        "muf_up":   _upper_or_none(body.muf_no),
+        "area_up":  _upper_or_none(body.area),
+        "fg_up":    _upper_or_none(body.fg_no),
+    }
     # 仅当 area 不是 NULL 时，才要求库位
+    area_up, rack_up = v["area_up"], v["rack_up"]
     if area_up in REQUIRED_RACK_AREAS and (rack_up is None or (isinstance(rack_up, str) and rack_up.strip() == "")):
         raise HTTPException(400, f"rack_location required for area {area_up}")
+    return v
+
+def _registered_row(body: RegisterReq, v: dict, now) -> dict:
+    """tags_repo.REGISTER 写入后的整行（列顺序同 tags_repo.TAG_COLS）"""
+    return _normalize_row({
+        "tid": v["tid_up"], "epc": None, "label_number": v["label_up"],
+        "muf_no": v["muf_up"], "fg_no": v["fg_up"], "item": v["item_up"],
+        "qty": body.qty, "ctn_qty": body.ctn_qty, "batch_no": v["batch_up"],
+        "rack_location": v["rack_up"], "area": v["area_up"], "remark": body.remark,
+        "updated_at": now, "updated_by": body.actor, "audit_at": None,
+    })
+
+@app.post("/tags/register", dependencies=[Depends(require_key)])
+async def register(body: RegisterReq):
+    v = _register_inputs(body)
+    tid_up = v["tid_up"]
 
-    pool = get_pool()
-    def _work():
-        conn = pool.get_connection()
+    def _work(conn):
+        conn.start_transaction()
         try:
-            conn.ping(reconnect=True, attempts=1, delay=0)
-            conn.start_transaction()
-            cur = conn.cursor(dictionary=True)
-            try:
-                # 开始事务后、INSERT 前加：
-                cur.execute("""
-                    SELECT 1 FROM rfid_tags_current
-                    WHERE UPPER(tid)=UPPER(%s) OR UPPER(label_number)=UPPER(%s)
-                    LIMIT 1
-                """, (tid_up, label_up))
-                if cur.fetchone():
-                    raise HTTPException(409, "Duplicate tid or label")
-
-                # epc 列明确写 NULL
-                cur.execute("""
-                    INSERT INTO rfid_tags_current
-                    (tid, label_number, epc, muf_no, fg_no, item, qty, ctn_qty, batch_no, rack_location, area, remark, updated_at, updated_by)
-                    VALUES (%s,%s,NULL,%s,%s,%s,%s,%s,%s,%s,%s,%s,NOW(),%s)
-                """, (tid_up, label_up, muf_up, fg_up, item_up, body.qty, ctn_v, batch_up, rack_up, area_up, remark_v, body.actor))
-
-                cur.execute("""
-                    INSERT INTO rfid_tags_log
-                    (tid, epc, label_number, item, batch_no, action,
-                     qty_old, qty_new, from_rack_location, to_rack_location,
-                     area_old, area_new, remark, updated_at, updated_by)
-                    VALUES
-                    (%s,NULL,%s,%s,%s,'REGISTER',NULL,%s,NULL,%s,NULL,%s,%s,NOW(),%s)
-                """, (tid_up, label_up, item_up, batch_up, body.qty, rack_up, area_up, remark_v, body.actor))
-
-                conn.commit()
-
-                cur.execute("""
-                    SELECT tid, epc, label_number, muf_no, fg_no, item, qty, ctn_qty, batch_no, rack_location, area,
-                        remark, updated_at, updated_by, audit_at
-                    FROM rfid_tags_current WHERE UPPER(tid)=UPPER(%s) LIMIT 1
-                """, (tid_up,))
-                row = cur.fetchone()
-                return _normalize_row(row)
-            except sqlerr.IntegrityError:
-                conn.rollback()
-                # 只可能是 tid 重复
-                raise HTTPException(409, "Duplicate tid")
-            except:
-                conn.rollback()
-                raise
-            finally:
-                cur.close()
-        finally:
-            conn.close()
+            # 开始事务后、INSERT 前加：（查重顺带取写入时间）
+            chk = db.fetch_one(conn, tags_repo.REGISTER_DUP, (tid_up, v["label_up"]))
+            if chk["dup"]:
+                raise HTTPException(409, "Duplicate tid or label")
+            now = chk["db_now"]
 
-    row = await asyncio.wait_for(asyncio.to_thread(_work), timeout=int(os.getenv("WRITE_TIMEOUT", "4")))
+            seq = tags_repo.next_seq(conn)
+            db.execute(conn, tags_repo.REGISTER, tags_repo.register_args(body, v, now, seq))
+            db.execute(conn, tags_repo.REGISTER_LOG, tags_repo.register_log_args(body, v, now, seq))
+
+            row = _registered_row(body, v, now)
+            _commit(conn, tid_up, changes=[_change(row, seq, "REGISTER")])
+            return row
+        except sqlerr.IntegrityError:
+            conn.rollback()
+            # 只可能是 tid 重复
+            raise HTTPException(409, "Duplicate tid")
+        except:
+            conn.rollback()
+            raise
+
+    row = await asyncio.wait_for(db.run_in_pool(_work), timeout=int(os.getenv("WRITE_TIMEOUT", "4")))
     if not row:
         raise HTTPException(404, "not found")
     return row
 
+# ---------- 批量注册（打印一卷标签后整批登记） ----------
+class BulkRegisterReq(BaseModel):
+    items: list[RegisterReq]
+    all_or_nothing: bool = False  # True：任一条失败则整批不写
+
+_BULK_REGISTER_MAX = int(os.getenv("BULK_REGISTER_MAX", "2000"))
+
+@app.post("/tags/register-bulk", dependencies=[Depends(require_key)])
+async def register_bulk(body: BulkRegisterReq):
+    """先整批校验，再一次查重、executemany 写入当前表与 REGISTER 日志，一个事务。
+    每条返回 status：200 / 400 / 409（库里或批内重复）。"""
+    if len(body.items) > _BULK_REGISTER_MAX:
+        raise HTTPException(400, f"too many items (max {_BULK_REGISTER_MAX})")
+
+    results = [None] * len(body.items)
+    def _fail(i, status, detail):
+        results[i] = {"tid": body.items[i].tid, "status": status, "detail": detail}
+
+    # 1) 校验 + 批内查重（不碰库）
+    ok, seen_tid, seen_label = {}, set(), set()
+    for i, it in enumerate(body.items):
+        try:
+            v = _register_inputs(it)
+        except HTTPException as e:
+            _fail(i, e.status_code, e.detail); continue
+        if v["tid_up"] in seen_tid or v["label_up"] in seen_label:
+            _fail(i, 409, "Duplicate tid or label in batch"); continue
+        seen_tid.add(v["tid_up"]); seen_label.add(v["label_up"])
+        ok[i] = v
+
+    def _rejected():
+        for i in ok:
+            results[i] = {"tid": body.items[i].tid, "status": 424, "detail": "not applied: batch rejected"}
+        raise HTTPException(409, {"message": "batch rejected", "results": results})
+
+    if body.all_or_nothing and len(ok) < len(body.items):
+        _rejected()
+    if not ok:
+        return {"committed": True, "results": results}
+
+    def _work(conn):
+        conn.start_transaction()
+        try:
+            # 2) 整批一次查重（LEFT JOIN 保证至少一行，顺带取写入时间）
+            tids, labels = list(seen_tid), list(seen_label)
+            taken_tid, taken_label, now = set(), set(), None
+            for r in db.fetch_all(conn, tags_repo.register_dup_many_sql(len(tids), len(labels)),
+                                  tuple(tids) + tuple(labels), prepared=False):
+                now = r["db_now"]
+                if r["tid_key"] is not None:
+                    taken_tid.add(r["tid_key"]); taken_label.add(r["label_key"])
+            for i in list(ok):
+                if ok[i]["tid_up"] in taken_tid or ok[i]["label_up"] in taken_label:
+                    del ok[i]
+                    _fail(i, 409, "Duplicate tid or label")
+
+            if body.all_or_nothing and len(ok) < len(body.items):
+                conn.rollback()
+                return False
+            if not ok:
+                conn.rollback()
+                return True
+
+            # 3) 多行 INSERT（executemany 会合并成 multi-row VALUES），change_seq 先留空
+            db.executemany(conn, tags_repo.REGISTER,
+                           [tags_repo.register_args(body.items[i], v, now, None) for i, v in ok.items()])
+            # 4) 最后才领号（计数行锁持有到 COMMIT），一条语句补号，再写日志
+            first = tags_repo.next_seq(conn, len(ok))
+            seqs = {i: first + n for n, i in enumerate(ok)}
+            tags_repo.stamp_seqs(conn, {v["tid_up"]: seqs[i] for i, v in ok.items()})
+            db.executemany(conn, tags_repo.REGISTER_LOG,
+                           [tags_repo.register_log_args(body.items[i], v, now, seqs[i]) for i, v in ok.items()])
+
+            rows = {i: _registered_row(body.items[i], v, now) for i, v in ok.items()}
+            _commit(conn, *(v["tid_up"] for v in ok.values()),
+                    changes=[_change(rows[i], seqs[i], "REGISTER") for i in ok])
+            for i in ok:
+                results[i] = {"tid": body.items[i].tid, "status": 200, "row": rows[i]}
+            return True
+        except sqlerr.IntegrityError:
+            # 查重之后被别的请求抢先插入：整批回滚
+            conn.rollback()
+            raise HTTPException(409, "Duplicate tid")
+        except:
+            conn.rollback(); raise
+
+    committed = await asyncio.wait_for(db.run_in_pool(_work), timeout=int(os.getenv("BULK_WRITE_TIMEOUT", "15")))
+    if not committed:
+        _rejected()
+    return {"committed": True, "results": results}
+
 # ---------- /bom/items 自动完成（含缓存） ----------
-_SUGG_CACHE = {}
-_SUGG_LOCK = threading.Lock()
-_SUGG_TTL_SEC = int(os.getenv("BOM_SUGGEST_TTL", "300"))
+# ---------- BATT 物料号内存索引：/bom/items 直接在内存里查，不走 LIKE 全表扫描 ----------
+# 启动后后台加载，之后每 BOM_INDEX_REFRESH_SEC 秒重建；BOM 有改动可 POST /bom/index/refresh 立即重建
+_BOM_INDEX_ON = os.getenv("BOM_INDEX", "1") == "1"
+_BOM_INDEX_REFRESH_SEC = float(os.getenv("BOM_INDEX_REFRESH_SEC", "300"))
+_BOM_INDEX = {"index": None, "built_at": None, "checked_at": None, "build_ms": None, "error": None}
+
+async def _rebuild_bom_index():
+    rows = await db.query(tags_repo.BOM_ITEMS_SORTED, dictionary=False,
+                          timeout=int(os.getenv("BOM_INDEX_TIMEOUT", "30")))
+    items = [row[0] for row in rows]
+    stamp = time.strftime("%Y-%m-%d %H:%M:%S")
+    old = _BOM_INDEX["index"]
+    if old is None or old.items != items:
+        t0 = time.perf_counter()
+        # 建索引是纯 CPU 活，放默认线程池，不占 DB 线程；物料列表没变就不重建
+        index = await asyncio.to_thread(ItemIndex, items)
+        _BOM_INDEX.update(index=index, built_at=stamp, build_ms=round((time.perf_counter() - t0) * 1000, 1))
+        _ALL_ITEMS.clear()
+    _BOM_INDEX.update(checked_at=stamp, error=None)
+
+async def _bom_index_loop():
+    while True:
+        try:
+            await _rebuild_bom_index()
+        except Exception as e:
+            # 加载失败保留旧索引（还没有就退回 SQL），下一轮再试
+            _BOM_INDEX["error"] = repr(e)
+        await asyncio.sleep(_BOM_INDEX_REFRESH_SEC)
+
+def _bom_index_stats() -> dict:
+    index = _BOM_INDEX["index"]
+    return {"enabled": _BOM_INDEX_ON, "items": len(index) if index is not None else None,
+            **{k: v for k, v in _BOM_INDEX.items() if k != "index"}}
+
+@app.post("/bom/index/refresh", dependencies=[Depends(require_key)])
+async def bom_index_refresh():
+    await _rebuild_bom_index()
+    _SUGG_CACHE.clear()
+    _ALL_ITEMS.clear()
+    return _bom_index_stats()
+
+# 索引未就绪 / 查询里带 LIKE 通配符时退回 SQL；键 = (大写前缀, limit)，限容量 + LRU 淘汰
+_SUGG_CACHE = LRUCache(int(os.getenv("BOM_SUGGEST_SIZE", "5000")), float(os.getenv("BOM_SUGGEST_TTL", "300")))
 
 @app.get("/bom/items", dependencies=[Depends(require_key)])
 async def bom_items(q: str = Query("", min_length=1), limit: int = 20):
     key = (q.upper(), int(limit))
-    now = time.time()
-    with _SUGG_LOCK:
-        ent = _SUGG_CACHE.get(key)
-        if ent and ent[0] > now:
-            return ent[1]
-
-    pool = get_pool()
-    def _work():
-        conn = pool.get_connection()
-        try:
-            conn.ping(reconnect=True, attempts=1, delay=0)
-            cur = conn.cursor()
-            try:
-                cur.execute("""
-                    SELECT DISTINCT UPPER(item) AS item
-                    FROM bom
-                    WHERE item_cat='BATT' AND UPPER(item) LIKE CONCAT('%', UPPER(%s), '%')
-                    ORDER BY item
-                    LIMIT %s
-                """, (q, limit))
-                return [row[0] for row in cur.fetchall()]
-            finally:
-                cur.close()
-        finally:
-            conn.close()
+    index = _BOM_INDEX["index"]
+    if index is not None and ItemIndex.supports(key[0]):
+        return index.search(*key)
 
-    rows = await asyncio.wait_for(asyncio.to_thread(_work), timeout=int(os.getenv("READ_TIMEOUT", "3")))
-    with _SUGG_LOCK:
-        _SUGG_CACHE[key] = (now + _SUGG_TTL_SEC, rows)
-    return rows
+    async def _load():
+        return [row[0] for row in await db.query(tags_repo.BOM_SUGGEST, ("%" + key[0] + "%", key[1]),
+                                                 dictionary=False, timeout=int(os.getenv("READ_TIMEOUT", "3")))]
 
-@app.get("/bom/all-items-lite", dependencies=[Depends(require_key)])
-async def bom_all_items_lite():
-    pool = get_pool()
-    def _work():
-        conn = pool.get_connection()
+    # 多台设备同时输入同一前缀：只查一次库
+    return await _SUGG_CACHE.get_or_load(key, _load)
+
+# ---------- /bom/all-items-lite：整包缓存 + ETag / 304 / gzip ----------
+# 交班时几十台手持同时开机拉全量物料表：内容没变回 304；变了也只查一次库、只序列化/压缩一次
+_ALL_ITEMS = LRUCache(1, float(os.getenv("BOM_ALL_TTL", "300")))
+_ALL_ITEMS_GZIP = os.getenv("BOM_ALL_GZIP", "1") == "1"
+_ALL_ITEMS_LAST = [None]  # 上一份整包：内容没变时沿用它的 Last-Modified
+
+# 增量同步：version = 物料集合的哈希（与顺序无关，多个 worker 对同一份数据算出同一个值）。
+# 每次集合变化记一条 {version, added, removed}（相对上一条），客户端带 since=version 只拿差异；
+# since 不在最近 BOM_DELTA_HISTORY 个版本里（太旧 / 别的 worker 发的 / 重启过）就给全量
+_ITEM_VERSIONS = deque(maxlen=int(os.getenv("BOM_DELTA_HISTORY", "50")))
+
+def _items_version(items) -> str:
+    return hashlib.sha256("\n".join(sorted(items)).encode("utf-8")).hexdigest()[:20]
+
+def _all_items_payload(items: list[str]) -> dict:
+    # 与 JSONResponse 相同的序列化参数，字节和以前一致
+    body = json.dumps(items, ensure_ascii=False, allow_nan=False, separators=(",", ":")).encode("utf-8")
+    # 弱 ETag：gzip 与不压缩两种表示共用一个
+    etag = 'W/"%s"' % hashlib.sha256(body).hexdigest()[:32]
+    prev = _ALL_ITEMS_LAST[0]
+    if prev is not None and prev["etag"] == etag:
+        return prev
+    p = {"items": items, "body": body, "gz": gzip.compress(body, 6) if _ALL_ITEMS_GZIP else None,
+         "etag": etag, "mtime": int(time.time()), "last_modified": formatdate(usegmt=True),
+         "version": _items_version(items), "delta": None}
+    if prev is not None and prev["version"] != p["version"]:
+        old, new = set(prev["items"]), set(items)
+        p["delta"] = (sorted(new - old), sorted(old - new))
+    return p
+
+def _items_delta(since: str) -> dict | None:
+    """since 之后的净变化；since 不在历史里返回 None"""
+    steps = list(_ITEM_VERSIONS)
+    hits = [i for i, s in enumerate(steps) if s["version"] == since]
+    if not hits:
+        return None
+    added, removed = set(), set()
+    for s in steps[hits[-1] + 1:]:
+        for x in s["added"]:
+            if x in removed:
+                removed.discard(x)
+            else:
+                added.add(x)
+        for x in s["removed"]:
+            if x in added:
+                added.discard(x)
+            else:
+                removed.add(x)
+    return {"added": sorted(added), "removed": sorted(removed)}
+
+async def _load_all_items() -> dict:
+    index = _BOM_INDEX["index"]
+    if index is not None:
+        items = index.items  # 同一条 BOM_ITEMS_SORTED 的结果，不用再查库
+    else:
+        # 必须带 ORDER BY：ETag 按整包字节算，顺序不固定的话内容没变也会 ETag 不同
+        rows = await db.query(tags_repo.BOM_ITEMS_SORTED, dictionary=False, timeout=int(os.getenv("READ_TIMEOUT", "3")))
+        items = [row[0] for row in rows]
+    # 全量列表可能上万条，哈希 + 压缩不放在事件循环里
+    p = await asyncio.to_thread(_all_items_payload, items)
+    prev, _ALL_ITEMS_LAST[0] = _ALL_ITEMS_LAST[0], p
+    if prev is None or prev["version"] != p["version"]:
+        if p["delta"] is None:
+            # 没有可比的上一版：之前的历史接不上，清掉
+            _ITEM_VERSIONS.clear()
+            _ITEM_VERSIONS.append({"version": p["version"], "added": [], "removed": []})
+        else:
+            _ITEM_VERSIONS.append({"version": p["version"], "added": p["delta"][0], "removed": p["delta"][1]})
+    return p
+
+def _not_modified(request: Request, p: dict) -> bool:
+    inm = request.headers.get("if-none-match")
+    if inm is not None:
+        # 弱比较：忽略 W/ 前缀
+        tags = {t.strip().removeprefix("W/") for t in inm.split(",")}
+        return "*" in tags or p["etag"].removeprefix("W/") in tags
+    ims = request.headers.get("if-modified-since")
+    if ims:
         try:
-            conn.ping(reconnect=True, attempts=1, delay=0)
-            cur = conn.cursor()
-            try:
-                cur.execute("""
-                    SELECT DISTINCT UPPER(item) AS item
-                    FROM bom
-                    WHERE item_cat='BATT' AND item IS NOT NULL AND item <> ''
-                """)
-                return [row[0] for row in cur.fetchall()]
-            finally:
-                cur.close()
-        finally:
-            conn.close()
-    return await asyncio.wait_for(asyncio.to_thread(_work), timeout=int(os.getenv("READ_TIMEOUT", "3")))
+            return int(parsedate_to_datetime(ims).timestamp()) >= p["mtime"]
+        except (TypeError, ValueError):
+            return False
+    return False
+
+@app.get("/bom/all-items-lite", dependencies=[Depends(require_key)])
+async def bom_all_items_lite(request: Request, since: str | None = Query(None, description="客户端持有的物料集合版本（X-Items-Version）")):
+    """不带 since：全量数组（ETag / 304 / gzip）；版本号在 X-Items-Version 响应头里。
+    带 since：{"version", "full": false, "added", "removed"}，版本太旧时 {"version", "full": true, "items"}"""
+    p = await _ALL_ITEMS.get_or_load("all", _load_all_items)
+    if since is not None:
+        delta = _items_delta(since)
+        if delta is None:
+            return {"version": p["version"], "full": True, "items": p["items"]}
+        return {"version": p["version"], "full": False, **delta}
+
+    headers = {"ETag": p["etag"], "Last-Modified": p["last_modified"], "X-Items-Version": p["version"],
+               "Cache-Control": "no-cache", "Vary": "Accept-Encoding"}
+    if _not_modified(request, p):
+        return Response(status_code=304, headers=headers)
+    if p["gz"] is not None and "gzip" in request.headers.get("accept-encoding", "").lower():
+        headers["Content-Encoding"] = "gzip"
+        return Response(p["gz"], media_type="application/json", headers=headers)
+    return Response(p["body"], media_type="application/json", headers=headers)
 
 # ---------- 下行增量接口 ----------
 @app.get("/tags/updated-since", dependencies=[Depends(require_key)])
 async def tags_updated_since(
+    request: Request,
     ts: str = Query("1970-01-01 00:00:00"),
     last_tid: str = Query("", description="与 ts 同秒时的游标 TID"),
-    limit: int = 1000
+    limit: int = 1000,
+    format: str | None = Query(None, description="json（默认）/ ndjson / columnar / msgpack；不传时看 Accept 头"),
+    wait: float = Query(0, ge=0, description="长轮询：游标之后没有新行时最多挂起的秒数（上限 LONGPOLL_MAX）"),
 ):
-    pool = get_pool()
-    def _work():
-        conn = pool.get_connection()
-        try:
-            conn.ping(reconnect=True, attempts=1, delay=0)
-            cur = conn.cursor(dictionary=True)
+    args = (ts, ts, last_tid, int(limit))
+    fmt = _pick_format(request, format)
+    wait = min(wait, _LONGPOLL_MAX)
+    if fmt == "ndjson":
+        if wait:
+            await _long_poll(lambda: db.query(tags_repo.UPDATED_SINCE, (ts, ts, last_tid, 1),
+                                              timeout=int(os.getenv("READ_TIMEOUT", "4"))), wait)
+        return await _ndjson_response(tags_repo.UPDATED_SINCE, args)
+    rows = _normalize_rows(await _long_poll(
+        lambda: db.query(tags_repo.UPDATED_SINCE, args, timeout=int(os.getenv("READ_TIMEOUT", "4"))), wait))
+    if fmt == "json":
+        return rows
+    return _columnar_response(rows, fmt)
+
+# ---------- 长轮询 ----------
+# 没有新行时挂在 FEED 上等写接口的通知（await 一个 Future，不占 DB 连接和线程），
+# 有写入就重查一次，直到查到行或超时；几百次空轮询/分钟收敛成几个请求。
+# 只听得到本 worker 的写入；多 worker 时配合 FEED_POLL_SEC，最坏情况多等一个轮询间隔
+_LONGPOLL_MAX = float(os.getenv("LONGPOLL_MAX", "30"))
+
+async def _long_poll(fetch, wait: float) -> list:
+    """fetch：查库协程函数；返回非空结果或等到超时后的最后一次结果"""
+    deadline = time.monotonic() + wait
+    while True:
+        seen = FEED.last_seq()  # 查库前取：查库期间提交的写入也会让下面立刻返回
+        rows = await fetch()
+        remaining = deadline - time.monotonic()
+        if rows or remaining <= 0:
+            return rows
+        if not await FEED.wait_for_change(seen, remaining):
+            return rows
+
+@app.get("/tags/changes", dependencies=[Depends(require_key)])
+async def tags_changes(
+    request: Request,
+    since_seq: int = Query(0, ge=0, description="客户端已处理到的 change_seq；首次同步传 0"),
+    limit: int = 1000,
+    format: str | None = Query(None, description="同 /tags/updated-since"),
+):
+    """按 change_seq 翻页：每行多一个 change_seq 字段，下一页传本页最后一行的值。
+    序号按提交顺序分配（见 tags_repo.next_seq），不需要 tid 兜底，同一秒内的写入也不会漏拿或重拿"""
+    args = (since_seq, int(limit))
+    fmt = _pick_format(request, format)
+    if fmt == "ndjson":
+        return await _ndjson_response(tags_repo.CHANGES_SINCE, args)
+    rows = _normalize_rows(await db.query(tags_repo.CHANGES_SINCE, args, timeout=int(os.getenv("READ_TIMEOUT", "4"))))
+    if fmt == "json":
+        return rows
+    return _columnar_response(rows, fmt, tags_repo.TAG_CHANGE_COLUMNS)
+
+# ---------- 变更推送（Server-Sent Events） ----------
+# 写接口提交后把新行推给订阅的手持机，代替反复轮询 /tags/updated-since。
+# 事件 = TAG_COLS + change_seq + action + area_old / rack_location_old（从库里补出来的事件没有旧值，为 null）。
+# 只含本 worker 的写入；多 worker 部署时设 FEED_POLL_SEC，每个 worker 定时按序号从库里补别的 worker 的写入
+_FEED_HISTORY = int(os.getenv("FEED_HISTORY", "5000"))        # 环形缓冲条数（断线续传直接从内存补）
+_FEED_QUEUE = int(os.getenv("FEED_QUEUE", "1000"))            # 每个订阅者最多积压条数，超了断开让它续传
+_FEED_GAP_WAIT = float(os.getenv("FEED_GAP_WAIT", "0.5"))     # 缺号最多等多久再查库补
+_FEED_POLL_SEC = float(os.getenv("FEED_POLL_SEC", "0"))       # >0：有订阅者或长轮询挂起时定时查库补（多 worker）
+_FEED_PING_SEC = float(os.getenv("FEED_PING_SEC", "15"))      # 空闲心跳，防代理断开、及时发现断线
+_FEED_REPLAY_MAX = int(os.getenv("FEED_REPLAY_MAX", "5000"))  # 续传从库里补的上限，超过让客户端走 /tags/changes
+
+FEED = ChangeFeed(_FEED_HISTORY, _FEED_QUEUE, _FEED_GAP_WAIT)
+
+def _change(new: dict, seq: int, action: str | None, old: dict | None = None) -> dict:
+    ev = _normalize_row({c: new[c] for c in tags_repo.TAG_COLUMNS})
+    ev["change_seq"] = seq
+    ev["action"] = action
+    ev["area_old"] = old["area"] if old else None
+    ev["rack_location_old"] = old["rack_location"] if old else None
+    return ev
+
+async def _changes_after(after: int, limit: int) -> list[dict]:
+    rows = await db.query(tags_repo.CHANGES_SINCE, (after, limit), timeout=int(os.getenv("READ_TIMEOUT", "4")))
+    return [_change(r, r["change_seq"], None) for r in rows]
+
+async def _feed_fill(after: int) -> list[dict]:
+    return await _changes_after(after, _FEED_REPLAY_MAX)
+
+async def _start_feed():
+    try:
+        row = await db.query(tags_repo.SEQ_READ, one=True, dictionary=False)
+        last = row[0] if row else None
+    except Exception:
+        last = None  # 库暂时不可用：以第一条事件为准
+    FEED.fill = _feed_fill
+    FEED.start(asyncio.get_running_loop(), last)
+    if _FEED_POLL_SEC > 0:
+        _BG_TASKS.append(asyncio.create_task(_feed_poll_loop()))
+
+async def _feed_poll_loop():
+    while True:
+        await asyncio.sleep(_FEED_POLL_SEC)
+        # SSE 订阅者和长轮询挂起的请求都要听到别的 worker 的写入
+        s = FEED.stats()
+        if s["subscribers"] or s["waiters"]:
             try:
-                cur.execute("""
-                    SELECT tid, epc, label_number, muf_no, fg_no, item, qty, ctn_qty, batch_no, rack_location, area,
-                        remark, updated_at, updated_by, audit_at
-                    FROM rfid_tags_current
-                    WHERE (updated_at > %s)
-                       OR (updated_at = %s AND tid > %s)
-                    ORDER BY updated_at ASC, tid ASC
-                    LIMIT %s
-                """, (ts, ts, last_tid, int(limit)))
-                rows = cur.fetchall()
-                return _normalize_rows(rows)
-            finally:
-                cur.close()
+                await FEED.catch_up()
+            except Exception:
+                pass  # 下一轮再补
+
+def _feed_filter(area: str | None, rack_prefix: str | None):
+    """area 可逗号分隔多个；移出/移入都算（新旧值任一匹配）"""
+    areas = {a.strip().upper() for a in area.split(",") if a.strip()} if area else None
+    prefix = rack_prefix.strip().upper() if rack_prefix and rack_prefix.strip() else None
+    if areas is None and prefix is None:
+        return None
+    def _match(ev):
+        if areas is not None and ev["area"] not in areas and ev["area_old"] not in areas:
+            return False
+        if prefix is not None and not any(r and r.startswith(prefix) for r in (ev["rack_location"], ev["rack_location_old"])):
+            return False
+        return True
+    return _match
+
+def _sse(event: str, data: dict, seq: int | None = None) -> bytes:
+    head = f"id: {seq}\n" if seq is not None else ""
+    return f"{head}event: {event}\n".encode() + b"data: " + wire.dumps(data) + b"\n\n"
+
+@app.get("/tags/stream", dependencies=[Depends(require_key)])
+async def tags_stream(
+    request: Request,
+    since_seq: int | None = Query(None, ge=0, description="从这个 change_seq 之后续传；不传则只收新变更"),
+    area: str | None = Query(None, description="只要这些区域（逗号分隔）"),
+    rack_prefix: str | None = Query(None, description="只要库位以此开头的"),
+):
+    """SSE：每条变更一个 `event: change`，id 为 change_seq。
+    断线重连带 Last-Event-ID 头（EventSource 自动带）或 since_seq 续传；
+    积压超过 FEED_QUEUE 时发 `event: lagged` 后断开，客户端用最后的 id 重连即可；
+    要补的太多时发 `event: reset`，客户端先用 /tags/changes 追平再连"""
+    last_id = request.headers.get("last-event-id")
+    if last_id and last_id.isdigit():
+        since_seq = int(last_id)
+    match = _feed_filter(area, rack_prefix)
+
+    # 先订阅再补历史：补历史期间的新事件在队列里，按序号去重
+    sub = FEED.subscribe(match)
+    try:
+        backlog = []
+        if since_seq is not None:
+            backlog = FEED.replay(since_seq)
+            if backlog is None:
+                backlog = await _changes_after(since_seq, _FEED_REPLAY_MAX + 1)
+                if len(backlog) > _FEED_REPLAY_MAX:
+                    FEED.unsubscribe(sub)
+                    body = _sse("reset", {"since_seq": since_seq, "detail": "too far behind; sync via /tags/changes"})
+                    return Response(body, media_type="text/event-stream")
+            if match is not None:
+                backlog = [e for e in backlog if match(e)]
+    except:
+        FEED.unsubscribe(sub)
+        raise
+
+    async def _body():
+        last = since_seq if since_seq is not None else -1
+        try:
+            yield _sse("hello", {"last_seq": FEED.last_seq()})
+            for ev in backlog:
+                yield _sse("change", ev, ev["change_seq"])
+                last = ev["change_seq"]
+            while True:
+                if sub.lagged and sub.queue.empty():
+                    yield _sse("lagged", {"last_seq": last})
+                    return
+                try:
+                    ev = await asyncio.wait_for(sub.queue.get(), _FEED_PING_SEC)
+                except asyncio.TimeoutError:
+                    yield b": ping\n\n"
+                    continue
+                if ev["change_seq"] <= last:
+                    continue
+                yield _sse("change", ev, ev["change_seq"])
+                last = ev["change_seq"]
         finally:
-            conn.close()
-    rows = await asyncio.wait_for(asyncio.to_thread(_work), timeout=int(os.getenv("READ_TIMEOUT", "4")))
-    return rows
+            FEED.unsubscribe(sub)
+
+    return StreamingResponse(_body(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@app.get("/tags/stream/stats", dependencies=[Depends(require_key)])
+async def tags_stream_stats():
+    return FEED.stats()
+
+# ---------- 响应格式协商 ----------
+# Accept 里的媒体类型 -> format 名；format 查询参数优先
+_FORMATS = {
+    "application/x-ndjson": "ndjson",
+    "application/vnd.rfid.columnar+json": "columnar",
+    "application/x-msgpack": "msgpack",
+    "application/msgpack": "msgpack",
+}
+_FORMAT_MEDIA = {"columnar": "application/vnd.rfid.columnar+json", "msgpack": "application/x-msgpack"}
+
+def _pick_format(request: Request, fmt: str | None) -> str:
+    if fmt is not None:
+        if fmt not in ("json", "ndjson", "columnar", "msgpack"):
+            raise HTTPException(400, f"unknown format {fmt}")
+        return fmt
+    accept = request.headers.get("accept", "")
+    for media, name in _FORMATS.items():
+        if media in accept:
+            return name
+    return "json"
+
+def _columnar_response(rows: list[dict], fmt: str, columns: list[str] = tags_repo.TAG_COLUMNS) -> Response:
+    """按列 + 字典编码（见 wire.py）；msgpack 需要服务器装了 msgpack，没装回 406"""
+    obj = wire.encode_columnar(rows, columns)
+    if fmt == "msgpack":
+        try:
+            body = wire.packb(obj)
+        except ImportError:
+            raise HTTPException(406, "msgpack not available on server; use format=columnar")
+    else:
+        body = wire.dumps(obj)
+    return Response(body, media_type=_FORMAT_MEDIA[fmt])
+
+# ---------- NDJSON 流式输出（首次全量同步等大页面） ----------
+_STREAM_BATCH = int(os.getenv("STREAM_BATCH", "500"))
+_STREAM_TIMEOUT = float(os.getenv("STREAM_TIMEOUT", "120"))
+
+def _ndjson(rows: list[dict]) -> bytes:
+    return b"".join(wire.dumps(_normalize_row(r)) + b"\n" for r in rows)
+
+async def _ndjson_response(sql: str, args: tuple) -> StreamingResponse:
+    """行顺序与 JSON 模式相同；客户端照旧用最后一行作下一页游标（(updated_at, tid) 或 change_seq）。
+    流开始前的错误（排队满 503 等）照常返回状态码；开始之后出错只能在末尾追加一行 {"error": ...}，客户端应丢弃本页"""
+    batches = db.stream(sql, args, batch=_STREAM_BATCH, timeout=_STREAM_TIMEOUT)
+    try:
+        first = await batches.__anext__()
+    except StopAsyncIteration:
+        first = None
+
+    async def _body():
+        try:
+            if first:
+                yield _ndjson(first)
+                async for rows in batches:
+                    yield _ndjson(rows)
+        except Exception as e:
+            yield (json.dumps({"error": str(e) or type(e).__name__}, ensure_ascii=False) + "\n").encode("utf-8")
+        finally:
+            await batches.aclose()
+
+    return StreamingResponse(_body(), media_type="application/x-ndjson")
 
 # ---------- AUDIT REMARK ----------
 class AuditMarkReq(BaseModel):
@@ -505,140 +1187,62 @@ class AuditMarkReq(BaseModel):
 
 @app.post("/tags/{tid}/audit", dependencies=[Depends(require_key)])
 async def mark_audit_by_tid(tid: str, body: AuditMarkReq):
-    pool = get_pool()
-    def _work():
-        conn = pool.get_connection()
+    tid_key = _key(tid)
+    def _work(conn):
+        conn.start_transaction()
         try:
-            conn.ping(reconnect=True, attempts=1, delay=0)
-            conn.start_transaction()
-            cur = conn.cursor(dictionary=True)
-            try:
-                # 1) 锁定当前行
-                cur.execute("""
-                    SELECT tid, epc, label_number, muf_no, fg_no, item, qty, ctn_qty, batch_no, rack_location, area, updated_at, audit_at
-                    FROM rfid_tags_current WHERE UPPER(tid)=UPPER(%s) FOR UPDATE
-                """, (tid,))
-                old = cur.fetchone()
-                if not old:
-                    raise HTTPException(404, "not found")
-
-                # 2) 更新 audit_at（并记 updated_by/updated_at 便于追溯）
-                cur.execute("""
-                    UPDATE rfid_tags_current
-                    SET audit_at = NOW(),
-                        updated_at = NOW(),
-                        updated_by = %s
-                    WHERE UPPER(tid)=UPPER(%s)
-                """, (body.actor, tid))
-
-                # 3) 读新值
-                cur.execute("""
-                    SELECT tid, epc, label_number, muf_no, fg_no, item, qty, ctn_qty, batch_no, rack_location, area, updated_at, audit_at, remark, updated_by
-                    FROM rfid_tags_current WHERE UPPER(tid)=UPPER(%s)
-                """, (tid,))
-                new = cur.fetchone()
-
-                # 4) 记日志（AUDIT）
-                cur.execute("""
-                    INSERT INTO rfid_tags_log
-                    (tid, epc, label_number, item, batch_no, action,
-                     qty_old, qty_new, from_rack_location, to_rack_location,
-                     area_old, area_new, remark, updated_at, updated_by)
-                    VALUES
-                    (%s,%s,%s,%s,%s,'AUDIT',
-                     %s,%s,%s,%s,
-                     %s,%s,%s,NOW(),%s)
-                """, (
-                    old["tid"], new["epc"], new["label_number"], old["item"], old["batch_no"],
-                    old["qty"], old["qty"], old["rack_location"], old["rack_location"],
-                    old["area"], old["area"], body.remark, body.actor
-                ))
-
-                conn.commit()
-                return _normalize_row(new)
-            except:
-                conn.rollback(); raise
-            finally:
-                cur.close()
-        finally:
-            conn.close()
-    row = await asyncio.wait_for(asyncio.to_thread(_work), timeout=int(os.getenv("WRITE_TIMEOUT", "4")))
+            # 1) 锁定当前行（列顺序即返回 JSON 的字段顺序）
+            old, now = tags_repo.lock(conn, tid_key, tags_repo.LOCK_FOR_AUDIT)
+            if not old:
+                raise HTTPException(404, "not found")
+
+            # 2) 更新 audit_at（并记 updated_by/updated_at 便于追溯）
+            seq = tags_repo.next_seq(conn)
+            db.execute(conn, tags_repo.AUDIT, (now, now, body.actor, seq, tid_key))
+
+            # 3) 新值（不回读）
+            new = dict(old, updated_at=now, audit_at=now, updated_by=body.actor)
+
+            # 4) 记日志（AUDIT，业务字段新旧相同）
+            tags_repo.write_log(conn, old, new, "AUDIT", body.remark, now, body.actor, seq)
+
+            _commit(conn, tid_key, changes=[_change(new, seq, "AUDIT", old)])
+            return _normalize_row(new)
+        except:
+            conn.rollback(); raise
+    row = await asyncio.wait_for(db.run_in_pool(_work), timeout=int(os.getenv("WRITE_TIMEOUT", "4")))
     return row
 
 # ---------- DEREGISTER ----------
 @app.post("/tags/{tid}/deregister", dependencies=[Depends(require_key)])
 async def deregister_by_tid(tid: str, body: DeregReq):
-    pool = get_pool()
-    def _work():
-        conn = pool.get_connection()
+    tid_key = _key(tid)
+    def _work(conn):
+        conn.start_transaction()
         try:
-            conn.ping(reconnect=True, attempts=1, delay=0)
-            conn.start_transaction()
-            cur = conn.cursor(dictionary=True)
-            try:
-                # 1) 锁当前行
-                cur.execute("""
-                    SELECT tid, epc, label_number, muf_no, fg_no, item, qty, ctn_qty, batch_no, rack_location, area, updated_at, audit_at
-                    FROM rfid_tags_current WHERE UPPER(tid)=UPPER(%s) FOR UPDATE
-                """, (tid,))
-                old = cur.fetchone()
-                if not old:
-                    raise HTTPException(404, "not found")
-
-                # 2) 清空业务字段（TID/label 保留；EPC 不改且为 NULL）
-                cur.execute("""
-                    UPDATE rfid_tags_current
-                    SET
-                        muf_no=NULL,
-                        fg_no=NULL,
-                        item='-',
-                        batch_no=NULL,
-                        qty=0,
-                        ctn_qty=NULL,
-                        rack_location=NULL,
-                        area=NULL,
-                        remark=%s,
-                        audit_at=NULL,
-                        updated_at=NOW(),
-                        updated_by=%s
-                    WHERE UPPER(tid)=UPPER(%s)
-                """, (body.remark, body.actor, tid))
-
-                # 3) 取新值
-                cur.execute("""
-                    SELECT tid, epc, label_number, muf_no, fg_no, item, qty, ctn_qty, batch_no, rack_location, area, remark, updated_at, updated_by, audit_at
-                    FROM rfid_tags_current WHERE UPPER(tid)=UPPER(%s)
-                """, (tid,))
-                new = cur.fetchone()
-
-                # 4) 记日志（WRITE_INFO，qty 归 0；area_new/rack_new 均为 NULL）
-                cur.execute("""
-                    INSERT INTO rfid_tags_log
-                    (tid, epc, label_number, item, batch_no, action,
-                     qty_old, qty_new, from_rack_location, to_rack_location,
-                     area_old, area_new, remark, updated_at, updated_by)
-                    VALUES
-                    (%s,%s,%s,%s,%s,'WRITE_INFO',
-                     %s,%s,%s,%s,
-                     %s,%s,%s,NOW(),%s)
-                """, (
-                    old["tid"], new["epc"], new["label_number"], new["item"], new["batch_no"],
-                    old["qty"], new["qty"],
-                    old["rack_location"], new["rack_location"],
-                    old["area"], new["area"],
-                    body.remark, body.actor
-                ))
-
-                conn.commit()
-                return _normalize_row(new) # return new
-            except:
-                conn.rollback(); raise
-            finally:
-                cur.close()
-        finally:
-            conn.close()
+            # 1) 锁当前行
+            old, now = tags_repo.lock(conn, tid_key)
+            if not old:
+                raise HTTPException(404, "not found")
 
-    row = await asyncio.wait_for(asyncio.to_thread(_work), timeout=int(os.getenv("WRITE_TIMEOUT", "5")))
+            # 2) 清空业务字段（TID/label 保留；EPC 不改且为 NULL）
+            seq = tags_repo.next_seq(conn)
+            db.execute(conn, tags_repo.DEREGISTER, (body.remark, now, body.actor, seq, tid_key))
+
+            # 3) 新值（不回读）
+            new = dict(old, muf_no=None, fg_no=None, item="-", batch_no=None, qty=0, ctn_qty=None,
+                       rack_location=None, area=None, remark=body.remark, audit_at=None,
+                       updated_at=now, updated_by=body.actor)
+
+            # 4) 记日志（WRITE_INFO，qty 归 0；area_new/rack_new 均为 NULL）
+            tags_repo.write_log(conn, old, new, "WRITE_INFO", body.remark, now, body.actor, seq)
+
+            _commit(conn, tid_key, changes=[_change(new, seq, "WRITE_INFO", old)])
+            return _normalize_row(new) # return new
+        except:
+            conn.rollback(); raise
+
+    row = await asyncio.wait_for(db.run_in_pool(_work), timeout=int(os.getenv("WRITE_TIMEOUT", "5")))
     return row
 
 # ---------- REUSE（只改 label，清空业务字段；EPC 仍然不写） ----------
@@ -654,75 +1258,78 @@ async def reuse_by_tid(tid: str, body: ReuseReq):
     new_label_up = _upper_or_none(body.new_label)
     if not new_label_up:
         raise HTTPException(400, "new_label required")
+    tid_key = _key(tid)
 
-    pool = get_pool()
-    def _work():
-        conn = pool.get_connection()
+    def _work(conn):
+        conn.start_transaction()
         try:
-            conn.ping(reconnect=True, attempts=1, delay=0)
-            conn.start_transaction()
-            cur = conn.cursor(dictionary=True)
-            try:
-                # 1) 锁当前行
-                cur.execute("""
-                    SELECT tid, epc, label_number, muf_no, fg_no, item, qty, ctn_qty, batch_no, rack_location, area, remark, updated_at, updated_by, audit_at
-                    FROM rfid_tags_current WHERE UPPER(tid)=UPPER(%s) FOR UPDATE
-                """, (tid,))
-                old = cur.fetchone()
-                if not old:
-                    raise HTTPException(404, "not found")
-
-                # 2) 不再写 EPC；只更新新 label，并清空业务字段
-                cur.execute("""
-                    UPDATE rfid_tags_current
-                    SET label_number=%s,
-                        muf_no=NULL,
-                        fg_no=NULL,
-                        batch_no=NULL,
-                        item='-',
-                        qty=0,
-                        ctn_qty=NULL,
-                        rack_location=NULL,
-                        area=NULL,
-                        remark=%s,
-                        audit_at=NULL,
-                        updated_at=NOW(),
-                        updated_by=%s
-                    WHERE UPPER(tid)=UPPER(%s)
-                """, (new_label_up, body.remark, body.actor, tid))
-
-                # 3) 取新值
-                cur.execute("""
-                    SELECT tid, epc, label_number, muf_no, fg_no, item, qty, ctn_qty, batch_no, rack_location, area, remark, updated_at, updated_by, audit_at
-                    FROM rfid_tags_current WHERE UPPER(tid)=UPPER(%s)
-                """, (tid,))
-                new = cur.fetchone()
-
-                # 4) 记日志（REUSE，from→to area 均为 NULL）
-                cur.execute("""
-                    INSERT INTO rfid_tags_log
-                    (tid, epc, label_number, item, batch_no, action,
-                     qty_old, qty_new, from_rack_location, to_rack_location,
-                     area_old, area_new, remark, updated_at, updated_by)
-                    VALUES
-                    (%s,%s,%s,%s,%s,'REUSE',
-                     %s,%s,%s,NULL,
-                     %s,%s,%s,NOW(),%s)
-                """, (
-                    old["tid"], new["epc"], new["label_number"], new["item"], new["batch_no"],
-                    old["qty"], new["qty"], old["rack_location"],
-                    old["area"], new["area"],
-                    body.remark, body.actor
-                ))
-
-                conn.commit()
-                return _normalize_row(new) #return new
-            except:
-                conn.rollback(); raise
-            finally:
-                cur.close()
-        finally:
-            conn.close()
+            # 1) 锁当前行
+            old, now = tags_repo.lock(conn, tid_key)
+            if not old:
+                raise HTTPException(404, "not found")
+
+            # 2) 不再写 EPC；只更新新 label，并清空业务字段
+            seq = tags_repo.next_seq(conn)
+            db.execute(conn, tags_repo.REUSE, (new_label_up, body.remark, now, body.actor, seq, tid_key))
+
+            # 3) 新值（不回读）
+            new = dict(old, label_number=new_label_up, muf_no=None, fg_no=None, batch_no=None, item="-",
+                       qty=0, ctn_qty=None, rack_location=None, area=None, remark=body.remark,
+                       audit_at=None, updated_at=now, updated_by=body.actor)
 
-    row = await asyncio.wait_for(asyncio.to_thread(_work), timeout=int(os.getenv("WRITE_TIMEOUT", "5")))
+            # 4) 记日志（REUSE，from→to area 均为 NULL）
+            tags_repo.write_log(conn, old, new, "REUSE", body.remark, now, body.actor, seq)
+
+            _commit(conn, tid_key, changes=[_change(new, seq, "REUSE", old)])
+            return _normalize_row(new) #return new
+        except:
+            conn.rollback(); raise
+
+    row = await asyncio.wait_for(db.run_in_pool(_work), timeout=int(os.getenv("WRITE_TIMEOUT", "5")))
     return row
+
+# ---------- 采样分析（管理员） ----------
+# 在线上进程里临时开采样器，找 CPU 热点（pydantic 校验、_normalize_row、JSON 编码……），不用重启。
+# 返回 collapsed 格式，flamegraph.pl / speedscope 直接打开。同一时间只能跑一个
+_PROFILE_MAX_SEC = float(os.getenv("PROFILE_MAX_SEC", "300"))
+SAMPLER = Sampler()
+
+def _profile_args(seconds: float, hz: int) -> tuple:
+    if not 0 < seconds <= _PROFILE_MAX_SEC:
+        raise HTTPException(400, f"seconds must be in (0, {_PROFILE_MAX_SEC:g}]")
+    if not 1 <= hz <= 1000:
+        raise HTTPException(400, "hz must be in [1, 1000]")
+    return seconds, 1.0 / hz
+
+def _collapsed_response() -> Response:
+    st = SAMPLER.status()
+    return Response(SAMPLER.collapsed(), media_type="text/plain; charset=utf-8",
+                    headers={"X-Profile-Samples": str(st["samples"]), "X-Profile-Stacks": str(st["stacks"])})
+
+@app.post("/admin/profile/start", dependencies=[Depends(require_admin)])
+async def profile_start(seconds: float = 30, hz: int = 100, idle: bool = False):
+    """开始采样，seconds 秒后自动停；结果用 /admin/profile/stop 取"""
+    seconds, interval = _profile_args(seconds, hz)
+    if not SAMPLER.start(seconds, interval, idle):
+        raise HTTPException(409, "profiler already running")
+    return SAMPLER.status()
+
+@app.post("/admin/profile/stop", dependencies=[Depends(require_admin)])
+async def profile_stop():
+    """停止采样（已自动停也可以调）并返回 collapsed stacks"""
+    await asyncio.to_thread(SAMPLER.stop)
+    return _collapsed_response()
+
+@app.get("/admin/profile/status", dependencies=[Depends(require_admin)])
+async def profile_status():
+    return SAMPLER.status()
+
+@app.get("/admin/profile", dependencies=[Depends(require_admin)])
+async def profile(seconds: float = 10, hz: int = 100, idle: bool = False):
+    """一步到位：采样 seconds 秒后直接返回 collapsed stacks（请求挂着，不占 DB 连接和线程）"""
+    seconds, interval = _profile_args(seconds, hz)
+    if not SAMPLER.start(seconds, interval, idle):
+        raise HTTPException(409, "profiler already running")
+    await asyncio.sleep(seconds)
+    await asyncio.to_thread(SAMPLER.stop)
+    return _collapsed_response()
@@ -0,0 +1,177 @@
+# metrics.py
+"""进程内指标，/metrics 以 Prometheus 文本格式输出（不依赖 prometheus_client）。
+
+observe()/inc() 只做一次 bisect + 一次加锁累加（约 1µs），DB 线程和事件循环都可以调用；
+分位数由 Prometheus 端用 histogram_quantile() 从桶里算。多 worker 时每个 worker 各自一份。
+"""
+import bisect, re, threading, time
+
+# 秒；覆盖 0.1ms（缓存命中）到 10s（批量写超时）
+BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+_REGISTRY = []
+
+def _fmt_labels(names, values, extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+def _escape(v) -> str:
+    return str(v).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _num(v) -> str:
+    return repr(float(v)) if isinstance(v, float) else str(v)
+
+class Counter:
+    def __init__(self, name: str, help: str, labels: tuple = ()):
+        self.name, self.help, self.labels = name, help, labels
+        self._values = {}
+        self._lock = threading.Lock()
+        _REGISTRY.append(self)
+
+    def inc(self, *labelvalues, n: int = 1):
+        with self._lock:
+            self._values[labelvalues] = self._values.get(labelvalues, 0) + n
+
+    def total(self, **match) -> int:
+        """标签值匹配 match 的各序列之和，如 total(outcome="timeout")"""
+        idx = [(self.labels.index(k), v) for k, v in match.items()]
+        with self._lock:
+            return sum(v for k, v in self._values.items() if all(k[i] == want for i, want in idx))
+
+    def render(self) -> list[str]:
+        with self._lock:
+            items = sorted(self._values.items())
+        out = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        out += [f"{self.name}{_fmt_labels(self.labels, k)} {v}" for k, v in items]
+        return out
+
+class Histogram:
+    def __init__(self, name: str, help: str, labels: tuple = (), buckets: tuple = BUCKETS):
+        self.name, self.help, self.labels = name, help, labels
+        self.buckets = tuple(buckets)
+        self._series = {}  # 标签值 -> [各桶计数（最后一个是 +Inf）, 总和]
+        self._lock = threading.Lock()
+        _REGISTRY.append(self)
+
+    def observe(self, value: float, *labelvalues):
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            s = self._series.get(labelvalues)
+            if s is None:
+                s = self._series[labelvalues] = [[0] * (len(self.buckets) + 1), 0.0]
+            s[0][i] += 1
+            s[1] += value
+
+    def time(self, *labelvalues):
+        return _Timer(self, labelvalues)
+
+    def render(self) -> list[str]:
+        with self._lock:
+            items = sorted((k, (list(c), total)) for k, (c, total) in self._series.items())
+        out = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for k, (counts, total) in items:
+            acc = 0
+            for le, c in zip(self.buckets + ("+Inf",), counts):
+                acc += c
+                le = 'le="%s"' % le
+                out.append(f"{self.name}_bucket{_fmt_labels(self.labels, k, le)} {acc}")
+            out.append(f"{self.name}_sum{_fmt_labels(self.labels, k)} {_num(total)}")
+            out.append(f"{self.name}_count{_fmt_labels(self.labels, k)} {acc}")
+        return out
+
+class _Timer:
+    __slots__ = ("h", "labels", "t0")
+
+    def __init__(self, h, labels):
+        self.h, self.labels = h, labels
+
+    def __enter__(self):
+        self.t0 = time.perf_counter()
+
+    def __exit__(self, *exc):
+        self.h.observe(time.perf_counter() - self.t0, *self.labels)
+
+def gauge(name: str, help: str, value, kind: str = "gauge") -> list[str]:
+    """抓取时现算的单个值（池占用、排队长度，或别处已有的累计计数 kind="counter"），不进注册表"""
+    return [f"# HELP {name} {help}", f"# TYPE {name} {kind}", f"{name} {_num(value)}"]
+
+def render(extra: list[str] = ()) -> str:
+    lines = []
+    for m in _REGISTRY:
+        lines += m.render()
+    lines += extra
+    return "\n".join(lines) + "\n"
+
+# ---------- 语句名 ----------
+# SQL 文本 -> 短名（tags_repo 里的常量名）；标签值不能直接用整段 SQL
+_SQL_NAMES = {}
+_SQL_NAMES_MAX = 2048
+_TABLE = re.compile(r"\b(rfid_\w+|bom\w*)\b")
+
+def name_statements(consts: dict):
+    """consts：{常量名: SQL}；tags_repo 导入时登记"""
+    for name, sql in consts.items():
+        _SQL_NAMES[sql] = name
+
+def statement(sql: str) -> str:
+    name = _SQL_NAMES.get(sql)
+    if name is None:
+        # *_sql(n) 拼出来的 IN 列表语句：取动词 + 表名，同一类归到一个标签
+        m = _TABLE.search(sql)
+        name = f"{sql.split(None, 1)[0].upper() if sql.strip() else '?'} {m.group(1) if m else '?'}"
+        if len(_SQL_NAMES) < _SQL_NAMES_MAX:
+            _SQL_NAMES[sql] = name
+    return name
+
+# ---------- 指标 ----------
+HTTP_LATENCY = Histogram("rfid_http_request_duration_seconds",
+                         "Time from request start to response start, per route", ("route", "method"))
+HTTP_REQUESTS = Counter("rfid_http_requests_total", "Requests by route and status code", ("route", "method", "status"))
+HTTP_OUTCOMES = Counter("rfid_http_outcomes_total",
+                        "Notable outcomes: not_found (404), conflict (409), busy (503), timeout", ("route", "outcome"))
+POOL_ACQUIRE = Histogram("rfid_db_pool_acquire_seconds", "Time to check a connection out of the pool")
+THREAD_HANDOFF = Histogram("rfid_db_thread_handoff_seconds", "Time a DB job waits in the executor queue for a thread")
+SQL_LATENCY = Histogram("rfid_db_statement_duration_seconds", "Execute + fetch time per SQL statement", ("statement",))
+
+# ---------- ASGI 中间件 ----------
+_OUTCOME = {404: "not_found", 409: "conflict", 503: "busy"}
+
+class MetricsMiddleware:
+    """纯 ASGI 中间件（BaseHTTPMiddleware 每个请求要多开一个任务，开销几十微秒）。
+    延迟记到响应开始发送为止，流式响应（NDJSON / SSE）不会把整段推送时长算进去。
+    路由名取 FastAPI 端点函数名，404 等没匹配到路由的记为 unmatched"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        t0 = time.perf_counter()
+        status = None
+
+        async def _send(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                _record(scope, status, time.perf_counter() - t0)
+            await send(message)
+
+        try:
+            await self.app(scope, receive, _send)
+        except BaseException as e:
+            if status is None:
+                _record(scope, 500, time.perf_counter() - t0, "timeout" if isinstance(e, TimeoutError) else None)
+            raise
+
+def _record(scope, status: int, elapsed: float, outcome: str | None = None):
+    route = scope.get("route")
+    name = getattr(route, "name", None) or "unmatched"
+    method = scope["method"]
+    HTTP_LATENCY.observe(elapsed, name, method)
+    HTTP_REQUESTS.inc(name, method, status)
+    outcome = outcome or _OUTCOME.get(status)
+    if outcome:
+        HTTP_OUTCOMES.inc(name, outcome)
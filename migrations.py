@@ -0,0 +1,119 @@
+# migrations.py
+"""rfid 库结构迁移。
+
+用法：python migrations.py [--dry-run]
+已执行的迁移记在 schema_migrations 表里，重复运行只会补跑未执行的部分。
+设置 AUTO_MIGRATE=1 时 main.py 启动时也会自动执行一次。
+"""
+import os, sys
+from dotenv import load_dotenv
+import mysql.connector
+from mysql.connector import errors as sqlerr
+
+load_dotenv()
+
+# 每条迁移：(名称, [DDL ...])；只能追加，不要改已发布的条目
+MIGRATIONS = [
+    # tid/epc/label 统一大写的 STORED 生成列 + 索引；
+    # 查询改成 tid_key=%s 等值比较，不再 UPPER(列) 全表扫描
+    ("001_upper_key_columns", [
+        """
+        ALTER TABLE rfid_tags_current
+            ADD COLUMN tid_key   VARCHAR(128) AS (UPPER(tid)) STORED,
+            ADD COLUMN epc_key   VARCHAR(128) AS (UPPER(epc)) STORED,
+            ADD COLUMN label_key VARCHAR(128) AS (UPPER(label_number)) STORED
+        """,
+        "CREATE UNIQUE INDEX uk_tags_tid_key ON rfid_tags_current (tid_key)",
+        # label 唯一性由业务层校验；历史数据可能有重复，这里只建普通索引
+        "CREATE INDEX ix_tags_label_key ON rfid_tags_current (label_key)",
+        "CREATE INDEX ix_tags_epc_key ON rfid_tags_current (epc_key)",
+    ]),
+    # /tags/updated-since 的 (updated_at, tid) 游标：按索引顺序范围扫描，不再全表扫 + filesort
+    ("002_updated_at_tid_index", [
+        "CREATE INDEX ix_tags_updated_at_tid ON rfid_tags_current (updated_at, tid)",
+    ]),
+    # 全局变更序号：每次写入给行（和日志）打 change_seq，/tags/changes 按它翻页。
+    # 已有数据按 (updated_at, tid) 顺序补号，计数表从当前最大值接着发
+    ("003_change_seq", [
+        "ALTER TABLE rfid_tags_current ADD COLUMN change_seq BIGINT NULL",
+        "ALTER TABLE rfid_tags_log ADD COLUMN change_seq BIGINT NULL",
+        """
+        CREATE TABLE IF NOT EXISTS rfid_change_seq (
+            id TINYINT NOT NULL PRIMARY KEY,
+            seq BIGINT NOT NULL
+        )
+        """,
+        """
+        UPDATE rfid_tags_current t
+        JOIN (
+            SELECT tid_key, ROW_NUMBER() OVER (ORDER BY updated_at, tid) AS rn
+            FROM rfid_tags_current
+        ) x ON x.tid_key = t.tid_key
+        SET t.change_seq = x.rn
+        WHERE t.change_seq IS NULL
+        """,
+        "INSERT IGNORE INTO rfid_change_seq (id, seq) SELECT 1, COALESCE(MAX(change_seq), 0) FROM rfid_tags_current",
+        "CREATE UNIQUE INDEX uk_tags_change_seq ON rfid_tags_current (change_seq)",
+    ]),
+]
+
+# 重复列 / 重复索引名：说明上次执行到一半，跳过即可
+_ALREADY_APPLIED_ERRNO = {1060, 1061}
+
+def connect():
+    return mysql.connector.connect(
+        host=os.getenv("DB_HOST"),
+        port=int(os.getenv("DB_PORT", "3306")),
+        database=os.getenv("DB_NAME"),
+        user=os.getenv("DB_USER"),
+        password=os.getenv("DB_PASS"),
+        autocommit=True,
+        connection_timeout=int(os.getenv("CONNECT_TIMEOUT", "3")),
+    )
+
+def pending(conn) -> list[str]:
+    cur = conn.cursor()
+    try:
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS schema_migrations (
+                name VARCHAR(128) NOT NULL PRIMARY KEY,
+                applied_at DATETIME NOT NULL
+            )
+        """)
+        cur.execute("SELECT name FROM schema_migrations")
+        done = {row[0] for row in cur.fetchall()}
+    finally:
+        cur.close()
+    return [name for name, _ in MIGRATIONS if name not in done]
+
+def apply(conn, dry_run: bool = False) -> list[str]:
+    """执行未跑过的迁移，返回本次执行（或 dry_run 时将要执行）的名称"""
+    todo = pending(conn)
+    if dry_run:
+        return todo
+    steps = dict(MIGRATIONS)
+    cur = conn.cursor()
+    try:
+        for name in todo:
+            for ddl in steps[name]:
+                try:
+                    cur.execute(ddl)
+                except sqlerr.DatabaseError as e:
+                    if e.errno not in _ALREADY_APPLIED_ERRNO:
+                        raise
+            cur.execute("INSERT INTO schema_migrations (name, applied_at) VALUES (%s, NOW())", (name,))
+    finally:
+        cur.close()
+    return todo
+
+if __name__ == "__main__":
+    dry = "--dry-run" in sys.argv[1:]
+    conn = connect()
+    try:
+        names = apply(conn, dry_run=dry)
+    finally:
+        conn.close()
+    if not names:
+        print("schema up to date")
+    for n in names:
+        print(("pending: " if dry else "applied: ") + n)
@@ -0,0 +1,91 @@
+# profiler.py
+"""进程内采样分析器：后台线程每隔 interval 秒用 sys._current_frames() 抓一次所有线程的调用栈，
+累计成 flamegraph.pl / speedscope 能直接读的 collapsed 格式（每行 "线程;外层;...;内层 次数"）。
+
+纯 Python，不改解释器、不装钩子；100Hz 时开销约为一个线程每 10ms 拿一次 GIL 遍历几十个栈帧。
+默认丢掉正在空等的样本（栈顶在 threading / queue / selectors 里：空闲的 DB 线程、事件循环在 select），
+只留真正占 CPU 或在等 DB 返回的栈。
+"""
+import os, re, sys, threading, time
+
+# 栈顶落在这些文件 / 函数里的样本视为空闲（线程池空闲线程阻塞在 C 实现的 SimpleQueue.get，栈顶是 _worker）
+_IDLE_FILES = {"threading.py", "queue.py", "selectors.py"}
+_IDLE_FUNCS = {("thread.py", "_worker")}
+_THREAD_NO = re.compile(r"[_-]?\d+$")
+
+def _label(code) -> str:
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+def _idle(code) -> bool:
+    f = os.path.basename(code.co_filename)
+    return f in _IDLE_FILES or (f, code.co_name) in _IDLE_FUNCS
+
+class Sampler:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stop = threading.Event()
+        self._counts = {}
+        self.started_at = None
+        self.stopped_at = None
+        self.samples = 0
+        self.interval = None
+        self.include_idle = False
+
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, seconds: float, interval: float, include_idle: bool = False) -> bool:
+        """开始采样 seconds 秒（到点自动停）；已在运行返回 False"""
+        with self._lock:
+            if self.running():
+                return False
+            self._counts = {}
+            self.samples = 0
+            self.interval = interval
+            self.include_idle = include_idle
+            self.started_at, self.stopped_at = time.time(), None
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, args=(seconds,), name="profiler", daemon=True)
+            self._thread.start()
+            return True
+
+    def stop(self):
+        self._stop.set()
+        t = self._thread
+        if t is not None:
+            t.join()
+
+    def _run(self, seconds: float):
+        me = threading.get_ident()
+        deadline = time.monotonic() + seconds
+        try:
+            while not self._stop.wait(self.interval) and time.monotonic() < deadline:
+                names = {t.ident: _THREAD_NO.sub("", t.name) for t in threading.enumerate()}
+                for ident, frame in sys._current_frames().items():
+                    if ident == me:
+                        continue
+                    if not self.include_idle and _idle(frame.f_code):
+                        continue
+                    stack = []
+                    while frame is not None:
+                        stack.append(_label(frame.f_code))
+                        frame = frame.f_back
+                    stack.append(names.get(ident, "thread"))
+                    key = ";".join(reversed(stack))
+                    self._counts[key] = self._counts.get(key, 0) + 1
+                self.samples += 1
+        finally:
+            self.stopped_at = time.time()
+
+    def collapsed(self) -> str:
+        """flamegraph.pl 输入格式，按次数降序"""
+        items = sorted(self._counts.items(), key=lambda kv: -kv[1])
+        return "".join(f"{stack} {n}\n" for stack, n in items)
+
+    def status(self) -> dict:
+        return {
+            "running": self.running(), "samples": self.samples, "stacks": len(self._counts),
+            "interval_ms": self.interval * 1000 if self.interval else None, "include_idle": self.include_idle,
+            "started_at": self.started_at, "stopped_at": self.stopped_at,
+        }
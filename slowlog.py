@@ -0,0 +1,186 @@
+# slowlog.py
+"""慢操作日志：每个请求记下路由 / tid / 每条 SQL 的耗时和参数、取连接与排队等待、
+锁行语句（FOR UPDATE）耗时；请求超过 SLOW_LOG_MS，或其中某条 SQL 超过 SLOW_SQL_MS 时，
+整条记录以一行 JSON 写入本地文件（按大小轮转）。写文件在单独的一个线程里，不占事件循环。
+
+SLOW_SQL_EXPLAIN=1 时，超过 SLOW_SQL_MS 的语句在同一条连接上立刻补一次 EXPLAIN（只读，不加锁）。
+锁等待没有逐语句的服务端数字可取，这里用锁行语句本身的耗时近似（行不冲突时它只有一次索引查找）。
+
+请求上下文放在 contextvar 里，db.run_in_pool 把它带进 DB 线程；没有请求上下文（后台任务）的语句不记。
+SLOW_LOG_MS=0 关闭。
+"""
+import contextvars, json, os, threading, time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from urllib.parse import parse_qs
+
+SLOW_MS      = float(os.getenv("SLOW_LOG_MS", "1000"))
+SLOW_SQL_MS  = float(os.getenv("SLOW_SQL_MS", "200"))
+EXPLAIN      = os.getenv("SLOW_SQL_EXPLAIN", "0") == "1"
+LOG_FILE     = os.getenv("SLOW_LOG_FILE", "slow.log")
+MAX_BYTES    = int(os.getenv("SLOW_LOG_MAX_BYTES", str(10 * 1024 * 1024)))
+BACKUPS      = int(os.getenv("SLOW_LOG_BACKUPS", "5"))
+ENABLED      = SLOW_MS > 0
+
+_SQL_MAX = 200    # 每个请求最多记多少条语句（批量接口）
+_ARG_MAX = 200    # 参数 repr 截断长度
+
+_CURRENT = contextvars.ContextVar("slowlog_trace", default=None)
+
+class Trace:
+    __slots__ = ("method", "path", "started", "sql", "dropped", "lock_ms", "acquire_ms", "handoff_ms", "slow_sql")
+
+    def __init__(self, method: str, path: str):
+        self.method, self.path = method, path
+        self.started = time.time()
+        self.sql = []
+        self.dropped = 0
+        self.lock_ms = self.acquire_ms = self.handoff_ms = 0.0
+        self.slow_sql = False
+
+def note(field: str, seconds: float):
+    """累计一项等待时间（acquire_ms / handoff_ms）"""
+    t = _CURRENT.get()
+    if t is not None:
+        setattr(t, field, getattr(t, field) + seconds * 1000)
+
+def sql(conn, stmt: str, name: str, args, elapsed: float, rows=None):
+    """db.py 每条语句执行完调用；conn 为 None 时不做 EXPLAIN（流式游标 / executemany / aiomysql）"""
+    t = _CURRENT.get()
+    if t is None:
+        return
+    ms = elapsed * 1000
+    if "FOR UPDATE" in stmt:
+        t.lock_ms += ms
+    if len(t.sql) >= _SQL_MAX:
+        t.dropped += 1
+        return
+    ent = {"stmt": name, "ms": round(ms, 3), "args": _args(args)}
+    if rows is not None:
+        ent["rows"] = rows
+    if ms >= SLOW_SQL_MS:
+        t.slow_sql = True
+        ent["sql"] = " ".join(stmt.split())
+        if EXPLAIN and conn is not None:
+            ent["explain"] = _explain(conn, stmt, args)
+    t.sql.append(ent)
+
+def _args(args):
+    if args is None:
+        return None
+    if isinstance(args, list):
+        return f"<{len(args)} rows>"
+    s = repr(tuple(args))
+    return s if len(s) <= _ARG_MAX else s[:_ARG_MAX] + "..."
+
+def _explain(conn, stmt: str, args):
+    cur = conn.cursor(dictionary=True)
+    try:
+        cur.execute("EXPLAIN " + stmt, args)
+        return cur.fetchall()
+    except Exception as e:
+        return {"error": str(e)}
+    finally:
+        cur.close()
+
+# ---------- 文件（一行一条 JSON，按大小轮转：slow.log -> slow.log.1 -> ... -> slow.log.N） ----------
+_FILE_LOCK = threading.Lock()
+# 序列化 + 写盘 + 轮转都在这个线程里；磁盘卡住时最多积压 _PENDING_MAX 条，再多就丢
+_WRITER = ThreadPoolExecutor(max_workers=1, thread_name_prefix="slowlog")
+_PENDING_MAX = 1000
+_PENDING_LOCK = threading.Lock()  # 不能用 _FILE_LOCK：写线程写盘时一直拿着它
+_pending = 0
+
+def submit(entry: dict):
+    """事件循环里调用：交给写线程，不等结果"""
+    global _pending
+    with _PENDING_LOCK:
+        if _pending >= _PENDING_MAX:
+            return
+        _pending += 1
+    _WRITER.submit(_write_one, entry)
+
+def _write_one(entry: dict):
+    global _pending
+    try:
+        write(entry)
+    finally:
+        with _PENDING_LOCK:
+            _pending -= 1
+
+def _json_default(o):
+    return o.isoformat() if hasattr(o, "isoformat") else str(o)
+
+def write(entry: dict):
+    line = json.dumps(entry, ensure_ascii=False, default=_json_default) + "\n"
+    with _FILE_LOCK:
+        try:
+            if os.path.exists(LOG_FILE) and os.path.getsize(LOG_FILE) + len(line) > MAX_BYTES:
+                _rotate()
+            with open(LOG_FILE, "a", encoding="utf-8") as f:
+                f.write(line)
+        except OSError:
+            pass  # 写日志失败不能影响请求
+
+def _rotate():
+    for i in range(BACKUPS - 1, 0, -1):
+        src = f"{LOG_FILE}.{i}"
+        if os.path.exists(src):
+            os.replace(src, f"{LOG_FILE}.{i + 1}")
+    if BACKUPS > 0:
+        os.replace(LOG_FILE, f"{LOG_FILE}.1")
+    else:
+        os.remove(LOG_FILE)
+
+# ---------- ASGI 中间件 ----------
+def _tid(scope):
+    tid = (scope.get("path_params") or {}).get("tid")
+    if tid is None and scope.get("query_string"):
+        tid = parse_qs(scope["query_string"].decode("latin-1")).get("tid", [None])[0]
+    return tid
+
+class SlowLogMiddleware:
+    """耗时记到响应开始发送为止（与 /metrics 一致）；写文件在请求结束后"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if not ENABLED or scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        trace = Trace(scope["method"], scope["path"])
+        token = _CURRENT.set(trace)
+        t0 = time.perf_counter()
+        status, elapsed = None, None
+
+        async def _send(message):
+            nonlocal status, elapsed
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                elapsed = time.perf_counter() - t0
+            await send(message)
+
+        error = None
+        try:
+            await self.app(scope, receive, _send)
+        except BaseException as e:
+            error = type(e).__name__
+            raise
+        finally:
+            _CURRENT.reset(token)
+            if elapsed is None:
+                elapsed = time.perf_counter() - t0
+            if elapsed * 1000 >= SLOW_MS or trace.slow_sql:
+                route = scope.get("route")
+                submit({
+                    "ts": datetime.fromtimestamp(trace.started).strftime("%Y-%m-%d %H:%M:%S.%f")[:-3],
+                    "route": getattr(route, "name", None) or "unmatched",
+                    "method": trace.method, "path": trace.path, "tid": _tid(scope),
+                    "status": status if status is not None else 500, "error": error,
+                    "ms": round(elapsed * 1000, 1),
+                    "handoff_ms": round(trace.handoff_ms, 2), "acquire_ms": round(trace.acquire_ms, 2),
+                    "lock_ms": round(trace.lock_ms, 2),
+                    "sql_ms": round(sum(s["ms"] for s in trace.sql), 2),
+                    # 超时的请求 DB 线程可能还在往 trace 里记，交出去的是一份快照
+                    "sql": list(trace.sql), "sql_dropped": trace.dropped,
+                })
@@ -0,0 +1,281 @@
+# tags_repo.py
+"""rfid_tags_current / rfid_tags_log / bom 的 SQL 都集中在这里。
+
+固定文本的语句经 db.fetch_one / fetch_all / execute 执行（DB_PREPARED=1 时为按连接缓存的预处理语句）；
+IN 列表这类随参数个数变化的 SQL 由 *_sql(n) 拼出来，始终走普通游标，不进预处理缓存。
+业务校验、新行计算留在 main.py。
+"""
+import db, metrics
+
+# 返回给前端的列（顺序即 JSON 字段顺序）
+TAG_COLS = """tid, epc, label_number, muf_no, fg_no, item, qty, ctn_qty, batch_no, rack_location, area,
+            remark, updated_at, updated_by, audit_at"""
+TAG_COLUMNS = [c.strip() for c in TAG_COLS.split(",")]
+
+# 写入时间戳：锁行的 SELECT 顺带取 SYSDATE() AS db_now（拿到行锁后才求值，不会早于上一个写入者），
+# UPDATE/INSERT/日志都用这个值，新行直接在 Python 里算出来，省掉写后回读
+DB_NOW = "SYSDATE() AS db_now"
+
+def _in(n: int) -> str:
+    return ",".join(["%s"] * n)
+
+# ---------- 读 ----------
+BY_TID = f"SELECT {TAG_COLS} FROM rfid_tags_current WHERE tid_key=%s LIMIT 1"
+BY_EPC = f"SELECT {TAG_COLS} FROM rfid_tags_current WHERE epc_key=%s LIMIT 1"
+
+def by_keys_sql(counts: dict) -> str:
+    """counts: {"tid_key": n, "epc_key": n, "label_key": n}，n 为 0 的列不参与"""
+    conds = [f"{col} IN ({_in(n)})" for col, n in counts.items() if n]
+    return f"SELECT {TAG_COLS} FROM rfid_tags_current WHERE {' OR '.join(conds)}"
+
+# 游标 (ts, last_tid) 之后的行。等价于 (updated_at > ts) OR (updated_at = ts AND tid > last_tid)，
+# 但前面多一个 updated_at >= ts：优化器据此在 ix_tags_updated_at_tid 上做一次范围扫描，
+# 按索引顺序读、够 LIMIT 就停，不排序。纯 OR 写法和行构造器 (updated_at, tid) > (ts, last_tid)
+# MySQL 都不会转成这个范围扫描。参数：(ts, ts, last_tid, limit)
+UPDATED_SINCE = f"""
+    SELECT {TAG_COLS}
+    FROM rfid_tags_current
+    WHERE updated_at >= %s
+      AND (updated_at > %s OR tid > %s)
+    ORDER BY updated_at ASC, tid ASC
+    LIMIT %s
+"""
+
+# LIKE 模式作为参数传入（等价于原来的 CONCAT('%', UPPER(q), '%')）
+BOM_SUGGEST = """
+    SELECT DISTINCT UPPER(item) AS item
+    FROM bom
+    WHERE item_cat='BATT' AND UPPER(item) LIKE %s
+    ORDER BY item
+    LIMIT %s
+"""
+
+BOM_ALL_ITEMS = """
+    SELECT DISTINCT UPPER(item) AS item
+    FROM bom
+    WHERE item_cat='BATT' AND item IS NOT NULL AND item <> ''
+"""
+
+# 内存索引和 /bom/all-items-lite 用：顺序即 BOM_SUGGEST 的 ORDER BY item（按库的排序规则，不在 Python 里重排）
+BOM_ITEMS_SORTED = BOM_ALL_ITEMS + "    ORDER BY item\n"
+
+# ---------- 锁行 / 查重（事务内） ----------
+LOCK_BY_TID = f"SELECT {TAG_COLS}, {DB_NOW} FROM rfid_tags_current WHERE tid_key=%s FOR UPDATE"
+
+# audit 的返回字段顺序与其它接口不同（前端按这个顺序显示），单独一条
+LOCK_FOR_AUDIT = f"""
+    SELECT tid, epc, label_number, muf_no, fg_no, item, qty, ctn_qty, batch_no, rack_location, area,
+        updated_at, audit_at, remark, updated_by, {DB_NOW}
+    FROM rfid_tags_current WHERE tid_key=%s FOR UPDATE
+"""
+
+def lock_many_sql(n: int) -> str:
+    return f"SELECT {TAG_COLS}, {DB_NOW} FROM rfid_tags_current WHERE tid_key IN ({_in(n)}) FOR UPDATE"
+
+def lock(conn, tid_key: str, sql: str = LOCK_BY_TID):
+    """锁住一行；返回 (旧行, 写入时间)，行不存在时 (None, None)"""
+    old = db.fetch_one(conn, sql, (tid_key,))
+    if not old:
+        return None, None
+    return old, old.pop("db_now")
+
+LABEL_TAKEN = "SELECT 1 FROM rfid_tags_current WHERE label_key=%s AND tid_key<>%s LIMIT 1"
+
+def label_taken(conn, label_key: str, tid_key: str) -> bool:
+    return db.fetch_one(conn, LABEL_TAKEN, (label_key, tid_key)) is not None
+
+def label_owners_sql(n: int) -> str:
+    return f"SELECT tid_key, label_key FROM rfid_tags_current WHERE label_key IN ({_in(n)})"
+
+# 注册查重顺带取写入时间
+REGISTER_DUP = f"""
+    SELECT EXISTS(
+        SELECT 1 FROM rfid_tags_current
+        WHERE tid_key=%s OR label_key=%s
+    ) AS dup, {DB_NOW}
+"""
+
+def register_dup_many_sql(n_tids: int, n_labels: int) -> str:
+    # LEFT JOIN 保证至少一行（拿得到 db_now）
+    return f"""
+        SELECT t.tid_key, t.label_key, n.db_now
+        FROM (SELECT {DB_NOW}) n
+        LEFT JOIN rfid_tags_current t
+          ON t.tid_key IN ({_in(n_tids)})
+          OR t.label_key IN ({_in(n_labels)})
+    """
+
+# ---------- 写 ----------
+# UPDATE（按原有 CASE 写入，但去掉 epc 列）
+UPDATE = """
+    UPDATE rfid_tags_current
+    SET
+        label_number=COALESCE(%s, label_number),
+        muf_no=COALESCE(%s, muf_no),
+        fg_no=COALESCE(%s, fg_no),
+        item=COALESCE(%s, item),
+        qty=COALESCE(%s, qty),
+        ctn_qty=COALESCE(%s, ctn_qty),
+        batch_no=COALESCE(%s, batch_no),
+        rack_location = CASE
+            WHEN %s IS NULL THEN rack_location
+            WHEN %s = '' THEN NULL
+            ELSE %s
+        END,
+        area = CASE
+            WHEN %s IS NULL THEN area
+            WHEN %s = ''   THEN NULL
+            ELSE %s
+        END,
+        remark=COALESCE(%s, remark),
+        updated_at=%s, updated_by=%s, change_seq=%s
+    WHERE tid_key=%s
+"""
+
+def update_args(body, v: dict, tid_key: str, now, seq: int) -> tuple:
+    return (
+        v["label_up"], v["muf_up"], v["fg_up"], v["item_up"], body.qty, body.ctn_qty, v["batch_up"],
+        v["rack_raw"], v["rack_raw"], v["rack_up"],
+        v["area_raw"], v["area_raw"], v["area_up"],
+        body.remark, now, body.actor, seq, tid_key
+    )
+
+AUDIT = """
+    UPDATE rfid_tags_current
+    SET audit_at = %s,
+        updated_at = %s,
+        updated_by = %s,
+        change_seq = %s
+    WHERE tid_key=%s
+"""
+
+# 清空业务字段（TID/label 保留；EPC 不改且为 NULL）
+DEREGISTER = """
+    UPDATE rfid_tags_current
+    SET
+        muf_no=NULL,
+        fg_no=NULL,
+        item='-',
+        batch_no=NULL,
+        qty=0,
+        ctn_qty=NULL,
+        rack_location=NULL,
+        area=NULL,
+        remark=%s,
+        audit_at=NULL,
+        updated_at=%s,
+        updated_by=%s,
+        change_seq=%s
+    WHERE tid_key=%s
+"""
+
+# 同 DEREGISTER，另外换新 label
+REUSE = """
+    UPDATE rfid_tags_current
+    SET label_number=%s,
+        muf_no=NULL,
+        fg_no=NULL,
+        batch_no=NULL,
+        item='-',
+        qty=0,
+        ctn_qty=NULL,
+        rack_location=NULL,
+        area=NULL,
+        remark=%s,
+        audit_at=NULL,
+        updated_at=%s,
+        updated_by=%s,
+        change_seq=%s
+    WHERE tid_key=%s
+"""
+
+# 日志（epc 允许为 NULL）；PATCH / 批量更新 / AUDIT / DEREGISTER / REUSE 共用，action 作为参数
+LOG = """
+    INSERT INTO rfid_tags_log
+    (tid, epc, label_number, item, batch_no, action,
+     qty_old, qty_new, from_rack_location, to_rack_location,
+     area_old, area_new, remark, updated_at, updated_by, change_seq)
+    VALUES
+    (%s,%s,%s,%s,%s,%s,
+     %s,%s,%s,%s,
+     %s,%s,%s,%s,%s,%s)
+"""
+
+def log_args(old: dict, new: dict, action: str, remark, now, actor, seq: int) -> tuple:
+    return (
+        old["tid"], new["epc"], new["label_number"], new["item"], new["batch_no"],
+        action,
+        old["qty"], new["qty"],
+        old["rack_location"], new["rack_location"],
+        old["area"], new["area"],
+        remark, now, actor, seq
+    )
+
+def write_log(conn, old: dict, new: dict, action: str, remark, now, actor, seq: int):
+    db.execute(conn, LOG, log_args(old, new, action, remark, now, actor, seq))
+
+# epc 列明确写 NULL
+REGISTER = """
+    INSERT INTO rfid_tags_current
+    (tid, label_number, epc, muf_no, fg_no, item, qty, ctn_qty, batch_no, rack_location, area, remark, updated_at, updated_by,
+     change_seq)
+    VALUES (%s,%s,NULL,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s)
+"""
+
+REGISTER_LOG = """
+    INSERT INTO rfid_tags_log
+    (tid, epc, label_number, item, batch_no, action,
+     qty_old, qty_new, from_rack_location, to_rack_location,
+     area_old, area_new, remark, updated_at, updated_by, change_seq)
+    VALUES
+    (%s,NULL,%s,%s,%s,'REGISTER',NULL,%s,NULL,%s,NULL,%s,%s,%s,%s,%s)
+"""
+
+def register_args(body, v: dict, now, seq: int) -> tuple:
+    return (v["tid_up"], v["label_up"], v["muf_up"], v["fg_up"], v["item_up"], body.qty, body.ctn_qty,
+            v["batch_up"], v["rack_up"], v["area_up"], body.remark, now, body.actor, seq)
+
+def register_log_args(body, v: dict, now, seq: int) -> tuple:
+    return (v["tid_up"], v["label_up"], v["item_up"], v["batch_up"], body.qty, v["rack_up"], v["area_up"],
+            body.remark, now, body.actor, seq)
+
+# ---------- 变更序号 ----------
+# 所有写入都给行打上 change_seq（当前表 + 日志）。序号从单行计数表领取：
+# 计数行的行锁一直持有到 COMMIT，所以序号大小顺序就是提交顺序——
+# 客户端按 change_seq > since 翻页不会漏掉「序号小但提交晚」的行（AUTO_INCREMENT 做不到这一点）。
+# 代价是所有写事务在「领号 .. COMMIT」这一段串行，所以领号尽量放在最后：
+# - 批量接口先写完整批行（change_seq 留 NULL，唯一索引允许多个 NULL），最后领号，
+#   stamp_seqs 一条语句补号，再写日志，提交。锁里只有两条语句，与批量大小无关；
+# - 单条写入锁里本来就只有一条 UPDATE/INSERT + 一条日志，先写后补号反而多一次往返，维持先领号。
+# 更新类接口、批量注册先锁 / 写标签行再领序号；单条注册是先领序号再 INSERT。两种顺序能共存，靠的是写事务跑在
+# READ COMMITTED（db.TX_ISOLATION）：批量锁行时查不到的 TID 不加间隙锁，INSERT 不用等它；
+# 万一仍然死锁（1213），db.run 整个事务重试一次。
+# LAST_INSERT_ID(expr) 让新值随 OK 包带回（cursor.lastrowid），领号只要一次往返
+SEQ_BUMP = "UPDATE rfid_change_seq SET seq = LAST_INSERT_ID(seq + %s) WHERE id = 1"
+SEQ_READ = "SELECT seq FROM rfid_change_seq WHERE id = 1"  # 启动时取当前序号（/tags/stream）
+
+def next_seq(conn, n: int = 1) -> int:
+    """在当前事务里领取 n 个连续序号，返回第一个（依次为 first .. first+n-1）"""
+    return db.execute_id(conn, SEQ_BUMP, (n,)) - n + 1
+
+def stamp_seq_sql(n: int) -> str:
+    return (f"UPDATE rfid_tags_current SET change_seq = CASE tid_key {'WHEN %s THEN %s ' * n}END "
+            f"WHERE tid_key IN ({_in(n)})")
+
+def stamp_seqs(conn, seqs: dict):
+    """批量写入领号后一条语句补上 change_seq；seqs：{tid_key: 序号}"""
+    args = tuple(x for kv in seqs.items() for x in kv) + tuple(seqs)
+    db.execute(conn, stamp_seq_sql(len(seqs)), args, prepared=False)
+
+TAG_CHANGE_COLUMNS = TAG_COLUMNS + ["change_seq"]
+
+CHANGES_SINCE = f"""
+    SELECT {TAG_COLS}, change_seq
+    FROM rfid_tags_current
+    WHERE change_seq > %s
+    ORDER BY change_seq
+    LIMIT %s
+"""
+
+# /metrics 里按常量名区分语句（rfid_db_statement_duration_seconds 的 statement 标签）
+metrics.name_statements({k: v for k, v in globals().items() if k.isupper() and isinstance(v, str) and k not in ("TAG_COLS", "DB_NOW")})
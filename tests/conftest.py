@@ -0,0 +1,25 @@
+# tests/conftest.py
+import os, sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+os.environ.setdefault("API_KEY", "changeme")
+os.environ.setdefault("SLOW_LOG_MS", "0")
+
+import pytest
+from fastapi.testclient import TestClient
+import db, fakedb, main
+
+@pytest.fixture
+def pool(monkeypatch):
+    p = fakedb.Pool()
+    monkeypatch.setattr(db, "_POOL", p)
+    main.TAG_CACHE.clear()
+    return p
+
+@pytest.fixture
+def client(pool):
+    # 不进 lifespan：不跑迁移和后台任务
+    c = TestClient(main.app)
+    c.headers["x-api-key"] = os.environ["API_KEY"]
+    return c
@@ -0,0 +1,132 @@
+# tests/fakedb.py
+"""测试用的 DB 替身：内存 SQLite，表结构与迁移后的 rfid_tags_current / rfid_tags_log 相同（含 *_key 生成列、change_seq）。
+
+只实现 db.py 用到的那部分连接 / 游标接口；SQL 做最少的方言替换（%s -> ?、SYSDATE() -> 本地时间、去掉 FOR UPDATE）。
+用来核对写接口的返回行、日志行，不用来测性能或锁。
+"""
+import datetime, queue, re, sqlite3
+
+SCHEMA = """
+CREATE TABLE rfid_tags_current (
+    tid TEXT PRIMARY KEY, epc TEXT, label_number TEXT, muf_no TEXT, fg_no TEXT, item TEXT,
+    qty INTEGER, ctn_qty INTEGER, batch_no TEXT, rack_location TEXT, area TEXT, remark TEXT,
+    updated_at TEXT, updated_by TEXT, audit_at TEXT, change_seq INTEGER,
+    tid_key TEXT GENERATED ALWAYS AS (UPPER(tid)) STORED,
+    epc_key TEXT GENERATED ALWAYS AS (UPPER(epc)) STORED,
+    label_key TEXT GENERATED ALWAYS AS (UPPER(label_number)) STORED
+);
+CREATE UNIQUE INDEX uk_tags_change_seq ON rfid_tags_current (change_seq);
+CREATE TABLE rfid_tags_log (
+    id INTEGER PRIMARY KEY AUTOINCREMENT, tid TEXT, epc TEXT, label_number TEXT, item TEXT, batch_no TEXT, action TEXT,
+    qty_old INTEGER, qty_new INTEGER, from_rack_location TEXT, to_rack_location TEXT, area_old TEXT, area_new TEXT,
+    remark TEXT, updated_at TEXT, updated_by TEXT, change_seq INTEGER
+);
+CREATE TABLE bom (item TEXT, item_cat TEXT);
+CREATE TABLE rfid_change_seq (id INTEGER PRIMARY KEY, seq INTEGER NOT NULL);
+INSERT INTO rfid_change_seq VALUES (1, 0);
+"""
+
+# DATETIME 参数按 MySQL 的文本格式存
+sqlite3.register_adapter(datetime.datetime, lambda d: d.strftime("%Y-%m-%d %H:%M:%S"))
+
+# UPDATE ... SET col = LAST_INSERT_ID(expr)：MySQL 把新值放进 OK 包（cursor.lastrowid）
+_LAST_ID = re.compile(r"SET (\w+) = LAST_INSERT_ID\(([^()]*)\)")
+
+def _dialect(sql: str) -> str:
+    sql = sql.replace("%s", "?")
+    sql = sql.replace("SYSDATE()", "datetime('now','localtime')").replace("NOW()", "datetime('now','localtime')")
+    sql = sql.replace("FOR UPDATE", "")
+    return sql
+
+class Cursor:
+    def __init__(self, conn, dictionary: bool):
+        self._conn = conn
+        self._dictionary = dictionary
+        self._cur = conn.db.cursor()
+        self.rowcount = -1
+        self.lastrowid = None
+        self.description = None
+
+    def execute(self, sql, args=()):
+        self._conn.log.append(sql)
+        m = _LAST_ID.search(sql)
+        if m:
+            self._cur.execute(_dialect(_LAST_ID.sub(r"SET \1 = \2", sql)) + f" RETURNING {m.group(1)}", tuple(args))
+            self.lastrowid = self._cur.fetchone()[0]
+            self.rowcount, self.description = 1, None
+            return
+        self._cur.execute(_dialect(sql), tuple(args or ()))
+        self.rowcount, self.lastrowid, self.description = self._cur.rowcount, self._cur.lastrowid, self._cur.description
+
+    def executemany(self, sql, seq):
+        self._conn.log.append(sql)
+        self._cur.executemany(_dialect(sql), [tuple(a) for a in seq])
+        self.rowcount = self._cur.rowcount
+
+    def _row(self, r):
+        if r is None or not self._dictionary:
+            return r
+        return {d[0]: v for d, v in zip(self._cur.description, r)}
+
+    def fetchone(self):
+        return self._row(self._cur.fetchone())
+
+    def fetchall(self):
+        return [self._row(r) for r in self._cur.fetchall()]
+
+    def fetchmany(self, n=1):
+        return [self._row(r) for r in self._cur.fetchmany(n)]
+
+    @property
+    def column_names(self):
+        return tuple(d[0] for d in self._cur.description)
+
+    def close(self):
+        self._cur.close()
+
+class Connection:
+    def __init__(self, pool):
+        self.db, self.log = pool.db, pool.log
+        self._cnx = self  # db.py 按物理连接记账（PooledMySQLConnection._cnx）
+
+    def cursor(self, dictionary=False, prepared=False, buffered=False, raw=False):
+        self.log.append("PING")  # 同 mysql.connector：建游标前先 is_connected()，一次往返
+        return Cursor(self, dictionary)
+
+    def start_transaction(self, **kw):
+        self.db.execute("BEGIN")
+
+    def commit(self):
+        self.db.commit()
+
+    def rollback(self):
+        self.db.rollback()
+
+    def is_connected(self):
+        return True
+
+    def shutdown(self):
+        self.log.append("SHUTDOWN")
+
+    def close(self):
+        pass
+
+class Pool:
+    """所有连接共用一个 SQLite 连接（测试串行执行，不需要真的并发）"""
+
+    def __init__(self):
+        self.db = sqlite3.connect(":memory:", check_same_thread=False, isolation_level=None)
+        self.db.executescript(SCHEMA)
+        self.log = []
+        self._cnx_queue = queue.Queue()  # db.stats() 读 pool_idle
+
+    def get_connection(self):
+        return Connection(self)
+
+    def query(self, sql: str, args: tuple = ()) -> list[dict]:
+        cur = Connection(self).cursor(dictionary=True)
+        try:
+            cur.execute(sql, args)
+            return cur.fetchall()
+        finally:
+            cur.close()
@@ -0,0 +1,42 @@
+# tests/test_bom_index.py
+"""ItemIndex 的结果（包括顺序和 limit）必须与 BOM_SUGGEST 在同一份数据上查出来的一致。"""
+import random
+import pytest
+import main, tags_repo
+from bom_index import ItemIndex
+
+@pytest.fixture
+def bom(pool):
+    rnd = random.Random(7)
+    names = {"%s-%s%03d" % (rnd.choice(["LI", "NIMH", "CR", "LFP"]), rnd.choice("ABC"), rnd.randrange(300))
+             for _ in range(500)}
+    rows = [(n.lower() if rnd.random() < 0.3 else n, "BATT") for n in names]
+    rows += [("LI-X999", "CHEM"), ("", "BATT"), (None, "BATT"), ("li-a001", "BATT")]  # 非 BATT / 空 / 大小写重复
+    pool.db.executemany("INSERT INTO bom VALUES (?, ?)", rows)
+    items = [r["item"] for r in pool.query(tags_repo.BOM_ITEMS_SORTED)]
+    return pool, ItemIndex(items)
+
+def _sql(pool, q, limit):
+    return [r["item"] for r in pool.query(tags_repo.BOM_SUGGEST, ("%" + q + "%", limit))]
+
+@pytest.mark.parametrize("limit", [1, 5, 20, 1000])
+def test_search_matches_sql(bom, limit):
+    pool, index = bom
+    for q in ["L", "LI", "LI-", "-A0", "A00", "NIMH-B1", "3", "99", "CR-C2", "FP-A", "ZZ", "X999", "LI-A001"]:
+        assert index.search(q, limit) == _sql(pool, q, limit), q
+
+def test_limit_zero_and_unsupported():
+    index = ItemIndex(["LI-1", "LI-2"])
+    assert index.search("LI", 0) == []
+    assert not ItemIndex.supports("LI%")
+    assert not ItemIndex.supports("LI_1")
+    assert not ItemIndex.supports("É")
+    assert ItemIndex.supports("LI-1")
+
+def test_endpoint_uses_index(client, bom, monkeypatch):
+    pool, index = bom
+    monkeypatch.setitem(main._BOM_INDEX, "index", index)
+    n = len(pool.log)
+    got = client.get("/bom/items", params={"q": "li-a", "limit": 5}).json()
+    assert len(pool.log) == n  # 没查库
+    assert got == _sql(pool, "LI-A", 5)
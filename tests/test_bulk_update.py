@@ -0,0 +1,84 @@
+# tests/test_bulk_update.py
+"""POST /tags/bulk-update 的各种失败状态：整批 400、逐条 400/404/409、all_or_nothing 的 424，以及批内互换 label。"""
+import main
+
+def _seed(client, *tids):
+    r = client.post("/tags/register-bulk", json={"items": [
+        {"tid": t, "label_number": "L-" + t, "item": "b", "qty": 1} for t in tids]})
+    assert r.status_code == 200, r.text
+
+def _bulk(client, items, **kw):
+    return client.post("/tags/bulk-update", json=dict(kw, items=items))
+
+def _statuses(r):
+    return [(x["tid"], x["status"]) for x in r.json()["results"]]
+
+def _labels(pool):
+    return {r["tid"]: r["label_number"] for r in pool.query("SELECT tid, label_number FROM rfid_tags_current")}
+
+def test_empty_batch_400(client, pool):
+    assert _bulk(client, []).status_code == 400
+
+def test_oversized_batch_400(client, pool, monkeypatch):
+    monkeypatch.setattr(main, "_BATCH_MAX", 2)
+    r = _bulk(client, [{"tid": "b%d" % i, "qty": 1} for i in range(3)])
+    assert r.status_code == 400
+    assert "max 2" in r.json()["detail"]
+
+def test_unknown_tid_404_others_commit(client, pool):
+    _seed(client, "b1")
+    r = _bulk(client, [{"tid": "b1", "qty": 7}, {"tid": "nope", "qty": 1}])
+    assert r.status_code == 200
+    assert r.json()["committed"] is True
+    assert _statuses(r) == [("b1", 200), ("nope", 404)]
+    assert pool.query("SELECT qty FROM rfid_tags_current WHERE tid='B1'")[0]["qty"] == 7
+
+def test_duplicate_tid_in_batch(client, pool):
+    _seed(client, "b1")
+    r = _bulk(client, [{"tid": "b1", "qty": 2}, {"tid": "B1", "qty": 3}])
+    assert _statuses(r) == [("b1", 200), ("B1", 400)]
+    assert pool.query("SELECT qty FROM rfid_tags_current")[0]["qty"] == 2
+
+def test_rack_required_400(client, pool):
+    _seed(client, "b1")
+    r = _bulk(client, [{"tid": "b1", "area": "W/H"}])
+    assert _statuses(r) == [("b1", 400)]
+
+def test_label_taken_409(client, pool):
+    _seed(client, "b1", "b2")
+    r = _bulk(client, [{"tid": "b1", "label_number": "l-b2"}])
+    assert _statuses(r) == [("b1", 409)]
+    assert _labels(pool)["B1"] == "L-B1"
+
+def test_label_claimed_twice_in_batch_409(client, pool):
+    _seed(client, "b1", "b2")
+    r = _bulk(client, [{"tid": "b1", "label_number": "fresh"}, {"tid": "b2", "label_number": "FRESH"}])
+    assert _statuses(r) == [("b1", 200), ("b2", 409)]
+
+def test_label_swap_in_batch(client, pool):
+    """两个 TID 互换 label：按整批写完后的状态没有重复"""
+    _seed(client, "b1", "b2")
+    r = _bulk(client, [{"tid": "b1", "label_number": "l-b2"}, {"tid": "b2", "label_number": "l-b1"}])
+    assert r.status_code == 200, r.text
+    assert _statuses(r) == [("b1", 200), ("b2", 200)]
+    assert _labels(pool) == {"B1": "L-B2", "B2": "L-B1"}
+
+def test_label_freed_only_if_owner_change_applies(client, pool):
+    """要让出 label 的那条自己失败了，label 仍被占用"""
+    _seed(client, "b1", "b2")
+    r = _bulk(client, [{"tid": "b1", "label_number": "l-b2"},
+                       {"tid": "b2", "label_number": "x", "area": "W/H"}])  # b2 缺库位 400，不让出 L-B2
+    assert _statuses(r) == [("b1", 409), ("b2", 400)]
+    assert _labels(pool) == {"B1": "L-B1", "B2": "L-B2"}
+
+def test_all_or_nothing_424(client, pool):
+    _seed(client, "b1", "b2")
+    before = pool.query("SELECT tid, qty, change_seq FROM rfid_tags_current ORDER BY tid")
+    r = _bulk(client, [{"tid": "b1", "qty": 9}, {"tid": "nope", "qty": 1}, {"tid": "b2", "qty": 9}],
+              all_or_nothing=True)
+    assert r.status_code == 409
+    detail = r.json()["detail"]
+    assert detail["message"] == "batch rejected"
+    assert [(x["tid"], x["status"]) for x in detail["results"]] == [("b1", 424), ("nope", 404), ("b2", 424)]
+    assert pool.query("SELECT tid, qty, change_seq FROM rfid_tags_current ORDER BY tid") == before
+    assert len(pool.query("SELECT id FROM rfid_tags_log")) == 2  # 只有注册日志
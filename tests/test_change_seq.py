@@ -0,0 +1,78 @@
+# tests/test_change_seq.py
+"""change_seq 领号（LAST_INSERT_ID 一次往返）与死锁重试。"""
+import pytest
+from mysql.connector import errors as sqlerr
+import db, tags_repo
+
+def _deadlock():
+    return sqlerr.DatabaseError(msg="Deadlock found when trying to get lock", errno=1213)
+
+def test_next_seq_is_one_statement(pool):
+    conn = pool.get_connection()
+    n = len(pool.log)
+    assert tags_repo.next_seq(conn) == 1
+    assert tags_repo.next_seq(conn, 5) == 2
+    assert tags_repo.next_seq(conn) == 7
+    assert pool.log[n:] == ["PING"] + [tags_repo.SEQ_BUMP] * 3
+
+def test_writes_get_consecutive_seqs(client, pool):
+    client.post("/tags/register-bulk", json={"items": [
+        {"tid": "q%d" % i, "label_number": "ql%d" % i, "item": "b", "qty": 1} for i in range(3)]})
+    client.patch("/tags/q1", json={"qty": 2})
+    client.post("/tags/q2/audit", json={})
+    rows = client.get("/tags/changes", params={"since_seq": 0}).json()
+    assert [(r["tid"], r["change_seq"]) for r in rows] == [("Q0", 1), ("Q1", 4), ("Q2", 5)]
+    log = pool.query("SELECT tid, action, change_seq FROM rfid_tags_log ORDER BY id")
+    assert [r["change_seq"] for r in log] == [1, 2, 3, 4, 5]
+
+def _after_bump(pool, n):
+    """领号之后、COMMIT 之前执行的语句（计数行锁在这段时间里持有）"""
+    stmts = [s for s in pool.log[n:] if s != "PING"]
+    assert stmts.count(tags_repo.SEQ_BUMP) == 1
+    return stmts[stmts.index(tags_repo.SEQ_BUMP) + 1:]
+
+@pytest.mark.parametrize("size", [3, 200])
+def test_bulk_takes_seq_last(client, pool, size):
+    """批量写入先写完整批行再领号：锁里只剩补号 + 日志两条语句，与批量大小无关"""
+    items = [{"tid": "s%d" % i, "label_number": "sl%d" % i, "item": "b", "qty": 1} for i in range(size)]
+    n = len(pool.log)
+    assert client.post("/tags/register-bulk", json={"items": items}).status_code == 200
+    assert _after_bump(pool, n) == [tags_repo.stamp_seq_sql(size), tags_repo.REGISTER_LOG]
+
+    n = len(pool.log)
+    r = client.post("/tags/bulk-update", json={"items": [{"tid": "s%d" % i, "qty": 2} for i in range(size)]})
+    assert r.status_code == 200
+    assert _after_bump(pool, n) == [tags_repo.stamp_seq_sql(size), tags_repo.LOG]
+
+    # 补号后与先领号时一样：当前表、日志、响应里的 change_seq 都连续
+    rows = pool.query("SELECT tid, change_seq FROM rfid_tags_current ORDER BY change_seq")
+    assert [r["change_seq"] for r in rows] == list(range(size + 1, 2 * size + 1))
+    assert [r["tid"] for r in rows] == ["S%d" % i for i in range(size)]
+    log = pool.query("SELECT change_seq FROM rfid_tags_log ORDER BY id")
+    assert [r["change_seq"] for r in log] == list(range(1, 2 * size + 1))
+
+def test_deadlock_retries_whole_transaction(pool):
+    calls = []
+    def _work(conn):
+        calls.append(conn)
+        if len(calls) == 1:
+            raise _deadlock()
+        return "ok"
+    assert db.run(_work) == "ok"
+    assert len(calls) == 2
+
+def test_deadlock_retried_only_once(pool):
+    def _work(conn):
+        raise _deadlock()
+    with pytest.raises(sqlerr.DatabaseError):
+        db.run(_work)
+
+def test_no_retry_after_commit_sent(pool):
+    calls = []
+    def _work(conn):
+        calls.append(1)
+        db.no_retry(conn)
+        raise _deadlock()
+    with pytest.raises(sqlerr.DatabaseError):
+        db.run(_work)
+    assert len(calls) == 1
@@ -0,0 +1,52 @@
+# tests/test_db_pool.py
+"""run_in_pool 的排队上限：DB 线程全被占住时，排队超过 DB_ACQUIRE_TIMEOUT 返回 503，而不是等到上层超时变 500。"""
+import threading, time
+from fastapi.testclient import TestClient
+import db, main, tags_repo
+
+def _saturate():
+    """占住全部 DB 线程，返回放行用的 Event"""
+    release, started = threading.Event(), threading.Semaphore(0)
+    def _hold():
+        started.release()
+        release.wait(10)
+    for _ in range(db.POOL_SIZE):
+        db._EXECUTOR.submit(_hold)
+    for _ in range(db.POOL_SIZE):
+        started.acquire()
+    return release
+
+def test_queue_wait_maps_to_503_before_request_timeout(client, monkeypatch):
+    monkeypatch.setattr(db, "ACQUIRE_TIMEOUT", 0.2)
+    monkeypatch.setenv("READ_TIMEOUT", "3")
+    before = db.load()
+    release = _saturate()
+    try:
+        t0 = time.monotonic()
+        r = client.get("/tags/by-tid", params={"tid": "nope"})
+        elapsed = time.monotonic() - t0
+    finally:
+        release.set()
+    assert r.status_code == 503
+    assert elapsed < 2
+    after = db.load()
+    assert after["timed_out"] == before["timed_out"] + 1
+    # 取消掉的任务不再留在排队计数里
+    assert after["queued"] == before["queued"]
+
+def test_queued_job_runs_when_thread_frees_up(client, monkeypatch):
+    monkeypatch.setattr(db, "ACQUIRE_TIMEOUT", 2)
+    release = _saturate()
+    threading.Timer(0.2, release.set).start()
+    r = client.get("/tags/by-tid", params={"tid": "nope"})
+    assert r.status_code == 404
+
+def test_cursor_reused_per_connection(pool):
+    """建游标要 ping 一次：同一条物理连接上每种游标只建一次，之后每条语句一个往返"""
+    conn = pool.get_connection()
+    for _ in range(3):
+        db.fetch_one(conn, tags_repo.BY_TID, ("X",))
+    db.execute(conn, tags_repo.SEQ_BUMP, (1,))
+    db.execute(conn, tags_repo.SEQ_BUMP, (1,))
+    assert pool.log == ["PING", tags_repo.BY_TID, tags_repo.BY_TID, tags_repo.BY_TID,
+                        "PING", tags_repo.SEQ_BUMP, tags_repo.SEQ_BUMP]
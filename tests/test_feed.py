@@ -0,0 +1,151 @@
+# tests/test_feed.py
+"""ChangeFeed 与 /tags/stream：乱序到达补洞、慢订阅者 lagged、Last-Event-ID 续传。fill 走 SQLite 替身。"""
+import asyncio
+from starlette.requests import Request
+import feed, main, tags_repo
+
+def _ev(seq):
+    return {"change_seq": seq, "tid": "T%d" % seq, "area": None, "rack_location": None,
+            "area_old": None, "rack_location_old": None}
+
+def _seed(client, n):
+    r = client.post("/tags/register-bulk", json={"items": [
+        {"tid": "f%d" % i, "label_number": "fl%d" % i, "item": "b", "qty": 1} for i in range(n)]})
+    assert r.status_code == 200, r.text
+
+def _feed(last_seq, queue_max=100):
+    f = feed.ChangeFeed(history=100, queue_max=queue_max, gap_wait=0.05)
+    f.fill = main._feed_fill
+    f.start(asyncio.get_running_loop(), last_seq)
+    return f
+
+def _drain(sub, *cols):
+    out = []
+    while not sub.queue.empty():
+        e = sub.queue.get_nowait()
+        out.append(tuple(e[c] for c in cols) if cols else e["change_seq"])
+    return out
+
+def test_out_of_order_is_reordered(pool):
+    async def _run():
+        f = _feed(0)
+        sub = f.subscribe()
+        f.publish([_ev(3)])
+        f.publish([_ev(1), _ev(2)])
+        await asyncio.sleep(0.1)
+        return _drain(sub), f.stats()
+
+    seqs, s = asyncio.run(_run())
+    assert seqs == [1, 2, 3]
+    assert s["filled"] == 0 and s["skipped"] == 0
+    assert tags_repo.CHANGES_SINCE not in pool.log
+
+def test_gap_filled_from_db(client, pool):
+    _seed(client, 3)  # 库里 change_seq 1..3，只有 3 被 publish
+
+    async def _run():
+        f = _feed(0)
+        sub = f.subscribe()
+        f.publish([_ev(3)])
+        await asyncio.sleep(0.2)
+        return _drain(sub, "change_seq", "tid"), f.stats()
+
+    got, s = asyncio.run(_run())
+    assert got == [(1, "F0"), (2, "F1"), (3, "T3")]
+    assert s["gaps"] == 1 and s["filled"] == 2 and s["skipped"] == 0
+
+def test_gap_without_listeners_skips_db(client, pool):
+    """没有订阅者 / 长轮询时缺号不查库；跳过的号让续传改走库"""
+    _seed(client, 3)
+    n = len(pool.log)
+
+    async def _run():
+        f = _feed(0)
+        f.publish([_ev(3)])
+        await asyncio.sleep(0.2)
+        return f
+
+    f = asyncio.run(_run())
+    assert tags_repo.CHANGES_SINCE not in pool.log[n:]
+    assert f.stats()["skipped"] == 2
+    assert f.replay(0) is None
+    assert [e["change_seq"] for e in f.replay(2)] == [3]
+
+def test_slow_subscriber_lagged(pool):
+    async def _run():
+        f = _feed(0, queue_max=2)
+        slow, fast = f.subscribe(), f.subscribe(lambda e: e["change_seq"] == 5)
+        f.publish([_ev(i) for i in range(1, 6)])
+        await asyncio.sleep(0)
+        return f, slow, fast
+
+    f, slow, fast = asyncio.run(_run())
+    assert slow.lagged and _drain(slow) == [1, 2]
+    assert not fast.lagged and _drain(fast) == [5]
+    assert f.stats()["lagged"] == 1 and f.stats()["subscribers"] == 1
+
+# ---------- /tags/stream ----------
+def _request(last_event_id=None):
+    headers = [(b"last-event-id", str(last_event_id).encode())] if last_event_id is not None else []
+    return Request({"type": "http", "method": "GET", "path": "/tags/stream", "query_string": b"", "headers": headers})
+
+async def _open(last_event_id=None):
+    resp = await main.tags_stream(_request(last_event_id), since_seq=None, area=None, rack_prefix=None)
+    return resp.body_iterator
+
+async def _next(it, n=1):
+    out = []
+    for _ in range(n):
+        chunk = await asyncio.wait_for(it.__anext__(), 2)
+        out.append(chunk.split(b"\n", 2)[:2] if chunk.startswith(b"id:") else chunk.split(b"\n", 1)[:1])
+    return out
+
+def test_stream_resume_from_buffer(pool, monkeypatch):
+    async def _run():
+        f = _feed(0)
+        monkeypatch.setattr(main, "FEED", f)
+        f.publish([_ev(i) for i in range(1, 5)])
+        await asyncio.sleep(0)
+        it = await _open(last_event_id=2)
+        got = await _next(it, 3)
+        f.publish([_ev(5)])
+        got += await _next(it)
+        await it.aclose()
+        return got
+
+    n = len(pool.log)
+    got = asyncio.run(_run())
+    assert got == [[b"event: hello"],
+                   [b"id: 3", b"event: change"], [b"id: 4", b"event: change"], [b"id: 5", b"event: change"]]
+    assert tags_repo.CHANGES_SINCE not in pool.log[n:]
+
+def test_stream_resume_from_db(client, pool, monkeypatch):
+    """缓冲里没有续传起点之后的事件（重启过）：Last-Event-ID 之后的从库里补"""
+    _seed(client, 3)
+
+    async def _run():
+        monkeypatch.setattr(main, "FEED", _feed(3))
+        it = await _open(last_event_id=1)
+        got = await _next(it, 3)
+        await it.aclose()
+        return got
+
+    assert asyncio.run(_run()) == [[b"event: hello"], [b"id: 2", b"event: change"], [b"id: 3", b"event: change"]]
+    assert tags_repo.CHANGES_SINCE in pool.log
+
+def test_stream_lagged_then_closes(pool, monkeypatch):
+    async def _run():
+        f = feed.ChangeFeed(history=100, queue_max=2, gap_wait=0.05)
+        f.start(asyncio.get_running_loop(), 0)
+        monkeypatch.setattr(main, "FEED", f)
+        it = await _open()
+        got = await _next(it)
+        f.publish([_ev(i) for i in range(1, 6)])
+        await asyncio.sleep(0)
+        got += await _next(it, 3)
+        rest = [c async for c in it]
+        return got, rest
+
+    got, rest = asyncio.run(_run())
+    assert got == [[b"event: hello"], [b"id: 1", b"event: change"], [b"id: 2", b"event: change"], [b"event: lagged"]]
+    assert rest == []
@@ -0,0 +1,65 @@
+# tests/test_health.py
+"""/health/ready：按缓存的探测结果、排队饱和度、超时率判断就绪；/pool/stats 的计数。"""
+import asyncio
+from collections import deque
+import pytest
+import db, main
+
+@pytest.fixture
+def ready(pool, monkeypatch):
+    monkeypatch.setattr(main, "_PROBE", {"ok": None, "latency_ms": None, "error": None, "checked_at": None,
+                                         "checked_mono": None})
+    monkeypatch.setattr(main, "_LOAD_SAMPLES", deque())
+    return monkeypatch
+
+def _ready(client):
+    r = client.get("/health/ready", headers={"x-api-key": ""})  # 不要 API key
+    return r.status_code, r.json()
+
+def test_not_probed_yet(client, ready):
+    code, body = _ready(client)
+    assert code == 503 and body["reasons"] == ["db probe stale"]
+
+def test_ready_after_probe(client, ready):
+    asyncio.run(main._probe_db())
+    code, body = _ready(client)
+    assert code == 200, body
+    assert body["ready"] and body["db"]["ok"] and body["db"]["latency_ms"] >= 0
+    assert body["pool"] == {"size": db.POOL_SIZE, "active": 0, "utilization": 0.0}
+
+def test_db_unreachable(client, ready):
+    async def _down(*a, **kw):
+        raise ConnectionError("gone")
+    ready.setattr(db, "query", _down)
+    asyncio.run(main._probe_db())
+    code, body = _ready(client)
+    assert code == 503 and body["reasons"] == ["db unreachable"] and body["db"]["error"] == "gone"
+
+def test_db_slow(client, ready):
+    asyncio.run(main._probe_db())
+    ready.setattr(main, "_HEALTH_MAX_DB_MS", -1)
+    assert _ready(client)[1]["reasons"] == ["db slow"]
+
+def test_queue_saturated(client, ready):
+    asyncio.run(main._probe_db())
+    load = db.load()
+    ready.setattr(db, "load", lambda: dict(load, queued=db.QUEUE_MAX))
+    code, body = _ready(client)
+    assert code == 503 and body["reasons"] == ["executor queue saturated"]
+
+def test_timeout_rate(client, ready):
+    asyncio.run(main._probe_db())
+    timeouts = main.metrics.HTTP_OUTCOMES.total(outcome="timeout")
+    load = db.load()
+    # 窗口内开始了 100 个 DB 任务，10 个在排队时被拒 / 超时
+    main._LOAD_SAMPLES.append((0.0, load["started"] - 100, load["rejected"] + load["timed_out"] - 10, timeouts))
+    code, body = _ready(client)
+    assert code == 503 and body["reasons"] == ["timeout rate high"]
+    assert body["timeouts"]["timeouts"] == 10 and body["timeouts"]["jobs"] == 110
+
+def test_pool_stats(client, pool):
+    client.get("/tags/by-tid", params={"tid": "nope"})
+    s = client.get("/pool/stats").json()
+    for k in ("checkouts", "pings_skipped", "returned_in_tx", "rejected", "timed_out", "wait_ms_avg", "pool_idle"):
+        assert k in s
+    assert (s["pool_size"], s["queued"], s["active"]) == (db.POOL_SIZE, 0, 0)  # 请求结束后都已归还
@@ -0,0 +1,110 @@
+# tests/test_items_delta.py
+"""/bom/all-items-lite：ETag / 304，以及按 since 版本的增量同步（差异 / 版本接不上时给全量）。"""
+from collections import deque
+import pytest
+import main
+
+@pytest.fixture
+def items(pool, monkeypatch):
+    """BOM 表替身；add / remove 顺带清掉整包缓存，下一个请求就重新加载（不等 TTL）"""
+    monkeypatch.setitem(main._BOM_INDEX, "index", None)
+    monkeypatch.setattr(main, "_ALL_ITEMS_LAST", [None])
+    monkeypatch.setattr(main, "_ITEM_VERSIONS", deque(maxlen=50))
+    main._ALL_ITEMS.clear()
+    yield _Bom(pool)
+    main._ALL_ITEMS.clear()
+
+class _Bom:
+    def __init__(self, pool):
+        self.pool = pool
+
+    def add(self, *names):
+        for n in names:
+            self.pool.db.execute("INSERT INTO bom VALUES (?, 'BATT')", (n,))
+        main._ALL_ITEMS.clear()
+
+    def remove(self, *names):
+        for n in names:
+            self.pool.db.execute("DELETE FROM bom WHERE item = ?", (n,))
+        main._ALL_ITEMS.clear()
+
+def _get(client, **params):
+    return client.get("/bom/all-items-lite", params=params)
+
+def test_full_list_and_304(client, items):
+    items.add("li-1", "li-2")
+    r = _get(client)
+    assert r.status_code == 200
+    assert sorted(r.json()) == ["LI-1", "LI-2"]
+    etag, version = r.headers["etag"], r.headers["x-items-version"]
+
+    r = client.get("/bom/all-items-lite", headers={"If-None-Match": etag})
+    assert r.status_code == 304
+    assert r.headers["x-items-version"] == version
+    assert client.get("/bom/all-items-lite", headers={"If-None-Match": 'W/"other"'}).status_code == 200
+    # 带 since 时回增量，不看 If-None-Match
+    r = client.get("/bom/all-items-lite", params={"since": version}, headers={"If-None-Match": etag})
+    assert r.status_code == 200
+    assert r.json() == {"version": version, "full": False, "added": [], "removed": []}
+
+    items.add("li-3")
+    r = client.get("/bom/all-items-lite", headers={"If-None-Match": etag})
+    assert r.status_code == 200
+    assert r.headers["etag"] != etag
+
+def test_etag_independent_of_row_order(client, items):
+    """整包按 ORDER BY item 的顺序序列化：插入顺序不同、走不走内存索引，ETag 都一样"""
+    items.add("li-3", "li-1", "li-2")
+    r = _get(client)
+    assert r.json() == ["LI-1", "LI-2", "LI-3"]
+    items.remove("li-1", "li-2", "li-3")
+    items.add("li-2", "li-1", "li-3")
+    assert _get(client).headers["etag"] == r.headers["etag"]
+
+    main._BOM_INDEX["index"] = main.ItemIndex(["LI-1", "LI-2", "LI-3"])
+    main._ALL_ITEMS.clear()
+    assert _get(client).headers["etag"] == r.headers["etag"]
+
+def test_delta_since_version(client, items):
+    items.add("li-1", "li-2", "li-3")
+    v1 = _get(client).headers["x-items-version"]
+    items.add("li-4")
+    items.remove("li-1")
+    _get(client)
+    items.add("li-5")
+    items.remove("li-4")  # 在 v1 之后加了又删：净变化里没有
+    r = _get(client, since=v1)
+    assert r.status_code == 200
+    body = r.json()
+    assert body == {"version": body["version"], "full": False, "added": ["LI-5"], "removed": ["LI-1"]}
+    assert body["version"] != v1
+
+    # 已是最新：空差异
+    assert _get(client, since=body["version"]).json() == {"version": body["version"], "full": False,
+                                                          "added": [], "removed": []}
+
+def test_unknown_version_gets_full_list(client, items):
+    items.add("li-1", "li-2")
+    r = _get(client, since="0123456789abcdef0123")
+    body = r.json()
+    assert body["full"] is True
+    assert sorted(body["items"]) == ["LI-1", "LI-2"]
+
+def test_history_reset_gets_full_list(client, items, monkeypatch):
+    items.add("li-1")
+    v1 = _get(client).headers["x-items-version"]
+    # 重启（没有可比的上一版）后集合变了：历史从新版本重新开始，v1 接不上
+    monkeypatch.setattr(main, "_ALL_ITEMS_LAST", [None])
+    items.add("li-2")
+    body = _get(client, since=v1).json()
+    assert body["full"] is True
+    assert sorted(body["items"]) == ["LI-1", "LI-2"]
+
+def test_history_overflow_gets_full_list(client, items, monkeypatch):
+    monkeypatch.setattr(main, "_ITEM_VERSIONS", deque(maxlen=2))
+    items.add("li-1")
+    v1 = _get(client).headers["x-items-version"]
+    for n in ("li-2", "li-3"):
+        items.add(n)
+        _get(client)
+    assert _get(client, since=v1).json()["full"] is True
@@ -0,0 +1,41 @@
+# tests/test_keyset_plan.py
+"""/tags/updated-since 的执行计划：EXPLAIN FORMAT=JSON 必须是 (updated_at, tid) 索引上的范围扫描、不 filesort。
+要连 MySQL：没配 DB_HOST 时跳过（连接参数同 loadtest.py）；表建在 LOADTEST_DB 测试库里，不碰业务库。"""
+import os, random
+import pytest
+import bench, loadtest, tags_repo
+
+pytestmark = pytest.mark.skipif(not os.getenv("DB_HOST"), reason="needs MySQL (DB_HOST not set)")
+
+TABLE = "test_rfid_tags_sync"
+
+@pytest.fixture(scope="module")
+def cur():
+    name = os.getenv("LOADTEST_DB", "rfid_loadtest")
+    loadtest._check_db(name)
+    conn = loadtest._connect(None)
+    c = conn.cursor()
+    try:
+        c.execute(f"CREATE DATABASE IF NOT EXISTS `{name}`")
+        c.execute(f"USE `{name}`")
+        # 数据同 bench.py keyset：约 3 小时的写入，1/5 落在同一秒
+        bench._keyset_table(c, TABLE, 20000, random.Random(42))
+        c.execute(f"CREATE INDEX ix_updated_at_tid ON {TABLE} (updated_at, tid)")
+        c.execute(f"ANALYZE TABLE {TABLE}")
+        c.fetchall()
+        yield c
+    finally:
+        c.execute(f"DROP TABLE IF EXISTS {TABLE}")
+        c.close()
+        conn.close()
+
+@pytest.mark.parametrize("ts, last_tid", [
+    ("2026-01-01 01:00:00", ""),                          # 按时间起步（增量同步）
+    ("2026-01-01 01:30:00", "800000000000000000000000"),  # 翻页中途：同一秒内按 tid 接着取
+])
+def test_updated_since_plan(cur, ts, last_tid):
+    sql = tags_repo.UPDATED_SINCE.replace("rfid_tags_current", TABLE)
+    plan = bench.keyset_plan(cur, sql, (ts, ts, last_tid, 1000))
+    assert plan["access_type"] == "range", plan
+    assert plan["key"] == "ix_updated_at_tid", plan
+    assert not plan["filesort"], plan
@@ -0,0 +1,29 @@
+# tests/test_longpoll.py
+"""长轮询在没有 SSE 订阅者时也要收到别的 worker 的写入（靠 FEED_POLL_SEC 轮询补齐）。"""
+import asyncio, time
+import main
+from feed import ChangeFeed
+
+def test_waiter_hears_other_worker_write(pool, monkeypatch):
+    feed = ChangeFeed(100, 10, 0.05)
+    monkeypatch.setattr(main, "FEED", feed)
+    monkeypatch.setattr(main, "_FEED_POLL_SEC", 0.05)
+
+    async def _run():
+        feed.fill = main._feed_fill
+        feed.start(asyncio.get_running_loop(), 0)
+        poller = asyncio.create_task(main._feed_poll_loop())
+        try:
+            waiter = asyncio.create_task(feed.wait_for_change(0, 3))
+            await asyncio.sleep(0.1)
+            assert feed.stats()["subscribers"] == 0 and feed.stats()["waiters"] == 1
+            # 别的 worker 提交的写入：本进程没有 publish，只在库里
+            pool.db.execute("INSERT INTO rfid_tags_current (tid, qty, updated_at, change_seq) "
+                            "VALUES ('OTHER', 1, '2026-01-01 00:00:00', 1)")
+            t0 = time.monotonic()
+            assert await waiter
+            return time.monotonic() - t0
+        finally:
+            poller.cancel()
+
+    assert asyncio.run(_run()) < 1
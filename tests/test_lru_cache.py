@@ -0,0 +1,85 @@
+# tests/test_lru_cache.py
+"""LRUCache（/bom/items 自动完成缓存）：容量淘汰、TTL 过期与 sweep、并发未命中合并成一次加载。"""
+import asyncio, time
+import pytest
+import main, tags_repo
+from cache import LRUCache
+
+def test_evicts_least_recently_used():
+    c = LRUCache(2, 60)
+    c.put("a", 1)
+    c.put("b", 2)
+    assert c.get("a") == 1  # a 变成最近使用
+    c.put("c", 3)
+    assert c.get("b") is None
+    assert (c.get("a"), c.get("c")) == (1, 3)
+    assert c.stats()["evictions"] == 1
+
+def test_ttl_expiry_and_sweep():
+    c = LRUCache(10, 0.05)
+    c.put("a", 1)
+    c.put("b", 2)
+    time.sleep(0.06)
+    assert c.get("a") is None  # 读到时删除
+    assert c.sweep() == 1      # 没人读的 b 由 sweep 清掉
+    s = c.stats()
+    assert s["size"] == 0 and s["expired"] == 2
+
+def test_concurrent_misses_load_once():
+    c = LRUCache(10, 60)
+    calls = []
+
+    async def _load():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return ["X"]
+
+    async def _run():
+        return await asyncio.gather(*(c.get_or_load("k", _load) for _ in range(5)))
+
+    assert asyncio.run(_run()) == [["X"]] * 5
+    assert len(calls) == 1
+    assert c.stats()["coalesced"] == 4
+    assert c.get("k") == ["X"]
+
+def test_failed_load_not_cached():
+    c = LRUCache(10, 60)
+    calls = []
+
+    async def _load():
+        calls.append(1)
+        if len(calls) == 1:
+            raise RuntimeError("db down")
+        return ["X"]
+
+    with pytest.raises(RuntimeError):
+        asyncio.run(c.get_or_load("k", _load))
+    assert asyncio.run(c.get_or_load("k", _load)) == ["X"]
+    assert len(calls) == 2
+
+def test_cancelled_caller_does_not_cancel_load():
+    c = LRUCache(10, 60)
+
+    async def _load():
+        await asyncio.sleep(0.05)
+        return ["X"]
+
+    async def _run():
+        first = asyncio.ensure_future(c.get_or_load("k", _load))
+        await asyncio.sleep(0)
+        second = asyncio.ensure_future(c.get_or_load("k", _load))
+        await asyncio.sleep(0.01)
+        first.cancel()  # 第一个请求的客户端断开
+        return await second
+
+    assert asyncio.run(_run()) == ["X"]
+    assert c.get("k") == ["X"]
+
+def test_bom_items_sql_fallback_cached(client, pool, monkeypatch):
+    monkeypatch.setitem(main._BOM_INDEX, "index", None)
+    main._SUGG_CACHE.clear()
+    pool.db.executemany("INSERT INTO bom VALUES (?, 'BATT')", [("li-10",), ("li-20",), ("ni-10",)])
+    assert client.get("/bom/items", params={"q": "li"}).json() == ["LI-10", "LI-20"]
+    assert client.get("/bom/items", params={"q": "LI"}).json() == ["LI-10", "LI-20"]
+    assert pool.log.count(tags_repo.BOM_SUGGEST) == 1
+    main._SUGG_CACHE.clear()
@@ -0,0 +1,49 @@
+# tests/test_metrics.py
+"""/metrics：HTTP 指标按路由名（不是原始路径）打标签，SQL 指标按语句名；直方图桶是累计值。"""
+import metrics, tags_repo
+
+def _requests(**match):
+    return metrics.HTTP_REQUESTS.total(**match)
+
+def test_route_label_is_endpoint_name(client, pool):
+    client.post("/tags/register", json={"tid": "m1", "label_number": "ml1", "item": "b", "qty": 1})
+    before = _requests(route="update_by_tid", method="PATCH", status=200)
+    for tid in ("m1", "M1", "m1"):
+        assert client.patch(f"/tags/{tid}", json={"qty": 2}).status_code == 200
+    # 路径里的 tid 不进标签：三次请求同一个序列
+    assert _requests(route="update_by_tid", method="PATCH", status=200) == before + 3
+    assert _requests(route="/tags/m1") == 0
+
+def test_outcomes_and_unmatched(client, pool):
+    nf = metrics.HTTP_OUTCOMES.total(route="by_tid", outcome="not_found")
+    unmatched = _requests(route="unmatched", status=404)
+    assert client.get("/tags/by-tid", params={"tid": "nope"}).status_code == 404
+    assert client.get("/no/such/path").status_code == 404
+    assert metrics.HTTP_OUTCOMES.total(route="by_tid", outcome="not_found") == nf + 1
+    assert _requests(route="unmatched", status=404) == unmatched + 1
+
+def test_statement_names():
+    assert metrics.statement(tags_repo.BY_TID) == "BY_TID"
+    assert metrics.statement(tags_repo.lock_many_sql(3)) == "SELECT rfid_tags_current"
+    assert metrics.statement(tags_repo.stamp_seq_sql(2)) == "UPDATE rfid_tags_current"
+
+def test_histogram_buckets_cumulative():
+    h = metrics.Histogram("test_latency_seconds", "test", ("op",), buckets=(0.01, 0.1))
+    metrics._REGISTRY.remove(h)
+    for v in (0.005, 0.05, 0.05, 5):
+        h.observe(v, "a")
+    lines = h.render()
+    assert 'test_latency_seconds_bucket{op="a",le="0.01"} 1' in lines
+    assert 'test_latency_seconds_bucket{op="a",le="0.1"} 3' in lines
+    assert 'test_latency_seconds_bucket{op="a",le="+Inf"} 4' in lines
+    assert 'test_latency_seconds_count{op="a"} 4' in lines
+
+def test_metrics_endpoint(client, pool):
+    client.get("/tags/by-tid", params={"tid": "nope"})
+    r = client.get("/metrics", headers={"x-api-key": ""})  # 不要 API key
+    assert r.status_code == 200
+    assert r.headers["content-type"].startswith("text/plain")
+    text = r.text
+    assert 'rfid_http_requests_total{route="by_tid",method="GET",status="404"}' in text
+    assert 'rfid_db_statement_duration_seconds_count{statement="BY_TID"}' in text
+    assert "rfid_db_pool_size " in text
@@ -0,0 +1,57 @@
+# tests/test_profiler.py
+"""/admin/profile*：只认 X-Admin-Key（没配 ADMIN_KEY 时一律 403，API key 不顶用）；采样结果是 collapsed 格式。"""
+import threading, time
+import pytest
+import main
+from profiler import Sampler
+
+ADMIN = {"x-admin-key": "s3cret"}
+
+@pytest.fixture
+def admin(monkeypatch):
+    monkeypatch.setattr(main, "ADMIN_KEY", "s3cret")
+    monkeypatch.setattr(main, "SAMPLER", Sampler())
+    yield
+    main.SAMPLER.stop()
+
+@pytest.mark.parametrize("path", ["/admin/profile/status", "/admin/profile?seconds=0.1"])
+def test_no_admin_key_configured(client, monkeypatch, path):
+    monkeypatch.setattr(main, "ADMIN_KEY", None)
+    assert client.get(path).status_code == 403
+    assert client.get(path, headers={"x-admin-key": ""}).status_code == 403
+
+@pytest.mark.parametrize("headers", [{}, {"x-admin-key": "wrong"}, {"x-api-key": "s3cret"}])
+def test_wrong_or_missing_admin_key(client, admin, headers):
+    c = client.get("/admin/profile/status", headers=headers)
+    assert c.status_code == 403
+    assert client.post("/admin/profile/start", headers=headers).status_code == 403
+    assert not main.SAMPLER.running()
+
+def test_profile_returns_collapsed_stacks(client, admin):
+    stop = threading.Event()
+    def _busy():
+        while not stop.is_set():
+            sum(range(1000))
+    t = threading.Thread(target=_busy, name="busy-1")
+    t.start()
+    try:
+        r = client.get("/admin/profile", params={"seconds": 0.3, "hz": 200}, headers=ADMIN)
+    finally:
+        stop.set()
+        t.join()
+    assert r.status_code == 200
+    assert int(r.headers["x-profile-samples"]) > 0
+    lines = r.text.splitlines()
+    assert lines and all(line.rsplit(" ", 1)[1].isdigit() for line in lines)
+    assert any(line.startswith("busy;") and "_busy (test_profiler.py" in line for line in lines)
+
+def test_start_stop_and_limits(client, admin):
+    assert client.post("/admin/profile/start", params={"seconds": 0}, headers=ADMIN).status_code == 400
+    assert client.post("/admin/profile/start", params={"hz": 5000}, headers=ADMIN).status_code == 400
+    r = client.post("/admin/profile/start", params={"seconds": 5, "hz": 100}, headers=ADMIN)
+    assert r.status_code == 200 and r.json()["running"]
+    assert client.post("/admin/profile/start", headers=ADMIN).status_code == 409  # 同时只能一个
+    time.sleep(0.05)
+    r = client.post("/admin/profile/stop", headers=ADMIN)
+    assert r.status_code == 200
+    assert not client.get("/admin/profile/status", headers=ADMIN).json()["running"]
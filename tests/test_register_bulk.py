@@ -0,0 +1,56 @@
+# tests/test_register_bulk.py
+"""POST /tags/register-bulk：批内 / 库内重复、all_or_nothing 整批回滚、部分成功只写有效行且 change_seq 连续。"""
+
+def _item(tid, label=None, **kw):
+    return dict({"tid": tid, "label_number": label or "L-" + tid, "item": "b", "qty": 1}, **kw)
+
+def _post(client, items, **kw):
+    return client.post("/tags/register-bulk", json=dict(kw, items=items))
+
+def _statuses(results):
+    return [(x["tid"], x["status"]) for x in results]
+
+def _current(pool):
+    return [(r["tid"], r["change_seq"]) for r in pool.query("SELECT tid, change_seq FROM rfid_tags_current ORDER BY change_seq")]
+
+def test_duplicates_inside_batch(client, pool):
+    r = _post(client, [_item("r1"), _item("R1", "other"), _item("r2", "l-r1"), _item("r3")])
+    assert r.status_code == 200
+    assert _statuses(r.json()["results"]) == [("r1", 200), ("R1", 409), ("r2", 409), ("r3", 200)]
+    assert _current(pool) == [("R1", 1), ("R3", 2)]
+
+def test_duplicates_against_existing_rows(client, pool):
+    assert _post(client, [_item("r1")]).status_code == 200
+    r = _post(client, [_item("r1", "new"), _item("r2", "L-R1"), _item("r3")])
+    assert _statuses(r.json()["results"]) == [("r1", 409), ("r2", 409), ("r3", 200)]
+    assert _current(pool) == [("R1", 1), ("R3", 2)]
+
+def test_partial_batch_commits_valid_rows_with_consecutive_seqs(client, pool):
+    assert _post(client, [_item("r0")]).status_code == 200
+    r = _post(client, [_item("r1"), _item("r0", "x"), _item("r2", area="W/H"), _item("r3"), _item("r4")])
+    assert r.status_code == 200
+    assert r.json()["committed"] is True
+    assert _statuses(r.json()["results"]) == [("r1", 200), ("r0", 409), ("r2", 400), ("r3", 200), ("r4", 200)]
+    assert _current(pool) == [("R0", 1), ("R1", 2), ("R3", 3), ("R4", 4)]
+    log = pool.query("SELECT tid, action, change_seq FROM rfid_tags_log ORDER BY id")
+    assert [(x["tid"], x["change_seq"]) for x in log] == [("R0", 1), ("R1", 2), ("R3", 3), ("R4", 4)]
+    assert {x["action"] for x in log} == {"REGISTER"}
+
+def test_all_or_nothing_rejects_batch_duplicate(client, pool):
+    r = _post(client, [_item("r1"), _item("r1", "x"), _item("r2")], all_or_nothing=True)
+    assert r.status_code == 409
+    assert _statuses(r.json()["detail"]["results"]) == [("r1", 424), ("r1", 409), ("r2", 424)]
+    assert _current(pool) == []
+
+def test_all_or_nothing_rolls_back_on_existing_duplicate(client, pool):
+    assert _post(client, [_item("r0")]).status_code == 200
+    n = len(pool.log)
+    r = _post(client, [_item("r1"), _item("r2", "L-R0")], all_or_nothing=True)
+    assert r.status_code == 409
+    assert _statuses(r.json()["detail"]["results"]) == [("r1", 424), ("r2", 409)]
+    assert _current(pool) == [("R0", 1)]
+    assert len(pool.query("SELECT id FROM rfid_tags_log")) == 1
+    # 查重就发现问题，没领号也没写
+    assert not any(s.lstrip().startswith(("INSERT", "UPDATE")) for s in pool.log[n:])
+    assert _post(client, [_item("r1")]).json()["results"][0]["row"]["tid"] == "R1"
+    assert _current(pool)[-1] == ("R1", 2)
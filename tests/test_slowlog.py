@@ -0,0 +1,23 @@
+# tests/test_slowlog.py
+"""慢操作日志：记录在写线程里落盘，不在事件循环上做文件 I/O。"""
+import json, threading
+import slowlog
+
+def test_slow_request_written_off_loop(client, pool, monkeypatch, tmp_path):
+    log_file = tmp_path / "slow.log"
+    monkeypatch.setattr(slowlog, "ENABLED", True)
+    monkeypatch.setattr(slowlog, "SLOW_MS", 0.0001)
+    monkeypatch.setattr(slowlog, "LOG_FILE", str(log_file))
+    threads = []
+    write = slowlog.write
+    def _write(entry):
+        threads.append(threading.current_thread().name)
+        write(entry)
+    monkeypatch.setattr(slowlog, "write", _write)
+
+    assert client.get("/tags/by-tid", params={"tid": "nope"}).status_code == 404
+    slowlog._WRITER.submit(lambda: None).result()  # 等写线程把前面的记录写完
+
+    assert threads and all(t.startswith("slowlog") for t in threads)
+    entry = json.loads(log_file.read_text(encoding="utf-8").splitlines()[-1])
+    assert entry["route"] == "by_tid" and entry["status"] == 404 and entry["tid"] == "nope"
@@ -0,0 +1,153 @@
+# tests/test_stream.py
+"""db.stream：提前结束的流不能把读了一半的连接还回池里；同时打开的流有上限。线程模式与 DB_ASYNC 模式都测。"""
+import asyncio, threading
+import pytest
+import db
+
+def _seed(client, n):
+    r = client.post("/tags/register-bulk", json={"items": [
+        {"tid": "s%04d" % i, "label_number": "l%04d" % i, "item": "b", "qty": 1} for i in range(n)]})
+    assert r.status_code == 200, r.text
+
+def test_early_exit_discards_connection(client, pool):
+    _seed(client, 50)
+
+    async def _partial():
+        s = db.stream("SELECT tid FROM rfid_tags_current ORDER BY tid", batch=10)
+        first = await s.__anext__()
+        await s.aclose()
+        await asyncio.sleep(0.5)  # DB 线程发现消费者走了
+        return first
+
+    assert len(asyncio.run(_partial())) == 10
+    assert "SHUTDOWN" in pool.log
+
+def test_full_stream_keeps_connection(client, pool):
+    _seed(client, 30)
+
+    async def _all():
+        return [r async for rows in db.stream("SELECT tid FROM rfid_tags_current", batch=7) for r in rows]
+
+    assert len(asyncio.run(_all())) == 30
+    assert "SHUTDOWN" not in pool.log
+
+def test_stream_limit_returns_503(client, monkeypatch):
+    monkeypatch.setattr(db, "_STREAMS", threading.BoundedSemaphore(1))
+    db._STREAMS.acquire()  # 已有一个流在跑
+    r = client.get("/tags/updated-since", params={"format": "ndjson"})
+    assert r.status_code == 503
+    db._STREAMS.release()
+    r = client.get("/tags/updated-since", params={"format": "ndjson"})
+    assert r.status_code == 200
+
+# ---------- DB_ASYNC：aiomysql 池的替身，只记录连接被怎样处理 ----------
+class _ACursor:
+    def __init__(self, rows):
+        self.rows, self.drained, self.closed = list(rows), False, False
+
+    async def execute(self, sql, args):
+        pass
+
+    async def fetchmany(self, n):
+        out, self.rows = self.rows[:n], self.rows[n:]
+        return out
+
+    async def close(self):
+        self.drained, self.rows, self.closed = True, [], True  # SSCursor.close() 会把剩下的行读完
+
+class _AConn:
+    def __init__(self, rows):
+        self.cur, self.closed = _ACursor(rows), False
+
+    async def cursor(self, cls):
+        return self.cur
+
+    def close(self):
+        self.closed = True
+
+class _APool:
+    def __init__(self, rows, block=False):
+        self.conn, self.block, self.released = _AConn(rows), block, []
+
+    async def acquire(self):
+        if self.block:
+            await asyncio.Event().wait()  # 池已耗尽
+        return self.conn
+
+    def release(self, conn):
+        self.released.append(conn)
+
+@pytest.fixture
+def apool(monkeypatch):
+    pytest.importorskip("aiomysql")
+    monkeypatch.setattr(db, "ASYNC", True)
+    def _make(rows, block=False):
+        p = _APool([{"tid": "t%d" % i} for i in range(rows)], block)
+        monkeypatch.setattr(db, "_APOOL", p)
+        return p
+    return _make
+
+def test_async_early_exit_discards_connection(apool):
+    p = apool(50)
+
+    async def _partial():
+        s = db.stream("SELECT tid FROM rfid_tags_current", batch=10)
+        first = await s.__anext__()
+        await s.aclose()
+        return first
+
+    assert len(asyncio.run(_partial())) == 10
+    assert p.conn.closed and not p.conn.cur.drained
+    assert p.released == [p.conn]
+    assert db._STREAMS.acquire(blocking=False)  # 名额已还
+    db._STREAMS.release()
+
+def test_async_full_stream_keeps_connection(apool):
+    p = apool(25)
+
+    async def _all():
+        return [r async for rows in db.stream("SELECT tid FROM rfid_tags_current", batch=10) for r in rows]
+
+    assert len(asyncio.run(_all())) == 25
+    assert not p.conn.closed and p.conn.cur.closed
+    assert p.released == [p.conn]
+
+def test_async_stream_limit(apool, monkeypatch):
+    p = apool(5)
+    monkeypatch.setattr(db, "_STREAMS", threading.BoundedSemaphore(1))
+    db._STREAMS.acquire()
+
+    async def _one():
+        return [r async for rows in db.stream("SELECT tid FROM rfid_tags_current") for r in rows]
+
+    with pytest.raises(db.PoolBusy):
+        asyncio.run(_one())
+    assert p.released == []
+    db._STREAMS.release()
+    assert len(asyncio.run(_one())) == 5
+
+def test_async_acquire_timeout(apool, monkeypatch):
+    apool(5, block=True)
+    monkeypatch.setattr(db, "ACQUIRE_TIMEOUT", 0.05)
+
+    async def _one():
+        return [r async for rows in db.stream("SELECT tid FROM rfid_tags_current") for r in rows]
+
+    with pytest.raises(db.PoolBusy):
+        asyncio.run(_one())
+    assert db._STREAMS.acquire(blocking=False)
+    db._STREAMS.release()
+
+def test_async_slow_consumer_times_out(apool):
+    p = apool(50)
+
+    async def _slow():
+        got = 0
+        async for rows in db.stream("SELECT tid FROM rfid_tags_current", batch=10, timeout=0.05):
+            got += len(rows)
+            await asyncio.sleep(0.1)
+        return got
+
+    with pytest.raises(TimeoutError):
+        asyncio.run(_slow())
+    assert p.conn.closed and not p.conn.cur.drained
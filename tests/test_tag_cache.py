@@ -0,0 +1,54 @@
+# tests/test_tag_cache.py
+"""标签行缓存：读穿透、按 tid / epc / label 查、写接口提交后失效，以及 generation 防止把旧行回填进缓存。"""
+import tags_repo
+from cache import TagCache
+
+ROW = {"tid": "E2AB01", "epc": "epc-1", "label_number": "lbl-1", "qty": 1}
+
+def test_lookup_by_each_key():
+    c = TagCache(10, 60)
+    c.fill(ROW, c.generation())
+    assert c.lookup("tid_key", "E2AB01") == ROW
+    assert c.lookup("epc_key", "EPC-1") == ROW
+    assert c.lookup("label_key", "LBL-1") == ROW
+    assert c.lookup("label_key", "OTHER") is None
+    # 返回的是副本
+    c.lookup("tid_key", "E2AB01")["qty"] = 99
+    assert c.lookup("tid_key", "E2AB01")["qty"] == 1
+
+def test_invalidate_drops_row_and_secondary_keys():
+    c = TagCache(10, 60)
+    c.fill(ROW, c.generation())
+    c.invalidate("E2AB01")
+    assert c.lookup("tid_key", "E2AB01") is None
+    assert c.lookup("epc_key", "EPC-1") is None
+    assert c.stats()["invalidations"] == 1
+
+def test_fill_after_invalidation_is_dropped():
+    """查库期间发生了失效：查到的可能是提交前的旧行，不回填"""
+    c = TagCache(10, 60)
+    gen = c.generation()
+    c.invalidate("SOMETHING-ELSE")
+    c.fill(ROW, gen)
+    assert c.lookup("tid_key", "E2AB01") is None
+    c.fill(ROW, c.generation())
+    assert c.lookup("tid_key", "E2AB01") == ROW
+
+def test_evicted_row_leaves_no_secondary_key():
+    c = TagCache(1, 60)
+    c.fill(ROW, c.generation())
+    c.fill(dict(ROW, tid="E2AB02", epc="epc-2", label_number="lbl-2"), c.generation())
+    assert c.lookup("epc_key", "EPC-1") is None
+    assert c.lookup("epc_key", "EPC-2")["tid"] == "E2AB02"
+    assert c.stats()["evictions"] == 1
+
+def test_read_through_and_write_invalidation(client, pool):
+    client.post("/tags/register", json={"tid": "e2ab01", "label_number": "l1", "item": "b", "qty": 1})
+    assert client.get("/tags/by-tid", params={"tid": "e2ab01"}).json()["qty"] == 1
+    n = pool.log.count(tags_repo.BY_TID)
+    assert client.get("/tags/by-tid", params={"tid": "E2AB01"}).json()["qty"] == 1
+    assert pool.log.count(tags_repo.BY_TID) == n  # 命中缓存，没查库
+
+    assert client.patch("/tags/e2ab01", json={"qty": 5}).status_code == 200
+    assert client.get("/tags/by-tid", params={"tid": "e2ab01"}).json()["qty"] == 5
+    assert pool.log.count(tags_repo.BY_TID) == n + 1
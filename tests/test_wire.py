@@ -0,0 +1,60 @@
+# tests/test_wire.py
+"""columnar / msgpack 格式：编码再解码得到原来的行；/tags/updated-since 各格式内容一致。"""
+import pytest
+import wire
+
+ROWS = [
+    {"tid": "T1", "area": "W/H", "item": "LI-1", "qty": 3, "rack_location": "R1", "updated_by": "u1"},
+    {"tid": "T2", "area": None, "item": "LI-1", "qty": None, "rack_location": None, "updated_by": "u2"},
+    {"tid": "T3", "area": "W/H", "item": "LI-2", "qty": 0, "rack_location": "R1", "updated_by": "u1"},
+]
+
+def test_columnar_round_trip():
+    obj = wire.encode_columnar([dict(r) for r in ROWS])
+    assert obj["dicts"]["area"] == ["W/H"]
+    assert obj["data"][obj["columns"].index("area")] == [0, None, 0]  # null 不进字典
+    assert obj["data"][obj["columns"].index("qty")] == [3, None, 0]  # 非字典列原样
+    assert wire.decode_columnar(obj) == ROWS
+
+def test_columnar_empty():
+    obj = wire.encode_columnar([], ["tid", "area"])
+    assert obj == {"columns": ["tid", "area"], "dicts": {"area": []}, "data": [[], []]}
+    assert wire.decode_columnar(obj) == []
+
+def test_msgpack_round_trip():
+    pytest.importorskip("msgpack")
+    obj = wire.encode_columnar([dict(r) for r in ROWS])
+    assert wire.decode_columnar(wire.unpackb(wire.packb(obj))) == ROWS
+
+def _seed(client):
+    r = client.post("/tags/register-bulk", json={"items": [
+        {"tid": "w%d" % i, "label_number": "wl%d" % i, "item": "b%d" % (i % 2), "qty": i,
+         "area": "W/H" if i % 3 else None, "rack_location": "R%d" % (i % 2)} for i in range(6)]})
+    assert r.status_code == 200, r.text
+
+def test_updated_since_formats_agree(client, pool):
+    _seed(client)
+    rows = client.get("/tags/updated-since").json()
+    assert len(rows) == 6
+
+    r = client.get("/tags/updated-since", params={"format": "columnar"})
+    assert r.headers["content-type"].startswith("application/vnd.rfid.columnar+json")
+    assert wire.decode_columnar(r.json()) == rows
+
+    r = client.get("/tags/updated-since", headers={"Accept": "application/vnd.rfid.columnar+json"})
+    assert wire.decode_columnar(r.json()) == rows
+
+def test_updated_since_msgpack(client, pool):
+    _seed(client)
+    rows = client.get("/tags/updated-since").json()
+    r = client.get("/tags/updated-since", params={"format": "msgpack"})
+    try:
+        import msgpack  # noqa: F401
+    except ImportError:
+        assert r.status_code == 406  # 服务器没装 msgpack
+        return
+    assert r.headers["content-type"] == "application/x-msgpack"
+    assert wire.decode_columnar(wire.unpackb(r.content)) == rows
+
+def test_unknown_format_400(client, pool):
+    assert client.get("/tags/updated-since", params={"format": "xml"}).status_code == 400
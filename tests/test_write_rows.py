@@ -0,0 +1,117 @@
+# tests/test_write_rows.py
+"""写接口不再写后回读：响应里的行由锁定的旧行 + 请求算出（_apply_update / _registered_row / dict(old, ...)）。
+每次写完用原来的回读语句在同一个库上查一次，经同样的 _normalize_row + JSON 编码，必须与响应逐字节一致。"""
+import pytest
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+import main
+
+# 原来各写接口提交前（register 是提交后）回读用的语句；audit 的列顺序不同
+REREAD = """
+    SELECT tid, epc, label_number, muf_no, fg_no, item, qty, ctn_qty, batch_no, rack_location, area,
+        remark, updated_at, updated_by, audit_at
+    FROM rfid_tags_current WHERE UPPER(tid)=UPPER(%s)
+"""
+REREAD_AUDIT = """
+    SELECT tid, epc, label_number, muf_no, fg_no, item, qty, ctn_qty, batch_no, rack_location, area, updated_at, audit_at, remark, updated_by
+    FROM rfid_tags_current WHERE UPPER(tid)=UPPER(%s)
+"""
+
+def _body(row) -> bytes:
+    return JSONResponse(jsonable_encoder(row)).body
+
+def _reread(pool, tid, sql=REREAD) -> bytes:
+    rows = pool.query(sql, (tid,))
+    assert len(rows) == 1
+    return _body(main._normalize_row(rows[0]))
+
+def _register(client, tid, **kw):
+    body = {"tid": tid, "label_number": "L-" + tid, "item": "batt-1", "qty": 5}
+    body.update(kw)
+    r = client.post("/tags/register", json=body)
+    assert r.status_code == 200, r.text
+    return r
+
+def test_register_full_row(client, pool):
+    r = _register(client, "e2ab01", label_number="lbl-1", area="w/h", rack_location="r1-01", remark="first",
+                  ctn_qty=2, batch_no="b9", muf_no="m1", fg_no="f1")
+    assert r.content == _reread(pool, "e2ab01")
+
+def test_register_minimal_row(client, pool):
+    r = _register(client, "e2ab02", area="  ", batch_no="", muf_no=" ")
+    assert r.content == _reread(pool, "e2ab02")
+
+@pytest.mark.parametrize("patch", [
+    {"qty": 9, "rack_location": "r2-02", "muf_no": "m", "area": "kiting"},
+    {"area": "line", "rack_location": ""},           # "" 清空库位
+    {"area": "", "rack_location": ""},               # "" 清空 area
+    {"area": "  "},                                  # 只有空白：写 NULL
+    {"area": "line", "rack_location": "  "},
+    {"area": " line ", "batch_no": "  ", "item": ""},  # 空白/空串的 COALESCE 字段：不改
+    {"rack_location": " r3-03 ", "remark": "moved"},
+    {"label_number": "new-label", "fg_no": "f2", "ctn_qty": 7, "action": "ADJUST_QTY"},
+    {"qty": 0, "remark": ""},
+    {},
+])
+def test_patch_row(client, pool, patch):
+    _register(client, "e2ab10", area="w/h", rack_location="r1-01", remark="x", batch_no="b1", ctn_qty=3)
+    r = client.patch("/tags/E2AB10", json=dict(patch, actor="tester"))
+    assert r.status_code == 200, r.text
+    assert r.content == _reread(pool, "e2ab10")
+
+def test_patch_with_prev_updated_at(client, pool):
+    first = _register(client, "e2ab11").json()
+    r = client.patch("/tags/e2ab11", json={"prev_updated_at": first["updated_at"], "qty": 3})
+    assert r.status_code == 200, r.text
+    assert r.content == _reread(pool, "e2ab11")
+
+def test_audit_row(client, pool):
+    _register(client, "e2ab20", area="kiting", rack_location="k-1")
+    r = client.post("/tags/e2ab20/audit", json={"actor": "aud", "remark": "ok"})
+    assert r.status_code == 200, r.text
+    assert r.content == _reread(pool, "e2ab20", REREAD_AUDIT)
+
+def test_deregister_row(client, pool):
+    _register(client, "e2ab30", area="w/h", rack_location="r1", batch_no="b", ctn_qty=1)
+    client.post("/tags/e2ab30/audit", json={})
+    r = client.post("/tags/e2ab30/deregister", json={"actor": "d", "remark": "bye"})
+    assert r.status_code == 200, r.text
+    assert r.content == _reread(pool, "e2ab30")
+
+def test_reuse_row(client, pool):
+    _register(client, "e2ab40", area="w/h", rack_location="r1")
+    r = client.post("/tags/e2ab40/reuse", json={"new_label": "fresh-1", "remark": "again"})
+    assert r.status_code == 200, r.text
+    assert r.content == _reread(pool, "e2ab40")
+
+def test_bulk_update_rows(client, pool):
+    for t in ("e2ab50", "e2ab51", "e2ab52"):
+        _register(client, t, area="w/h", rack_location="r1", remark="x")
+    r = client.post("/tags/bulk-update", json={"items": [
+        {"tid": "e2ab50", "area": "", "rack_location": ""},
+        {"tid": "E2AB51", "area": "  ", "qty": 2},
+        {"tid": "e2ab52", "rack_location": " r9 ", "label_number": "lbl-52"},
+    ]})
+    assert r.status_code == 200, r.text
+    for res in r.json()["results"]:
+        assert res["status"] == 200
+        assert _body(res["row"]) == _reread(pool, res["tid"])
+
+def test_bulk_register_rows(client, pool):
+    r = client.post("/tags/register-bulk", json={"items": [
+        {"tid": "e2ab60", "label_number": "l60", "item": "b", "qty": 1, "area": "w/h", "rack_location": "r1"},
+        {"tid": "e2ab61", "label_number": "l61", "item": "b", "qty": 2, "area": " ", "remark": "r"},
+    ]})
+    assert r.status_code == 200, r.text
+    for res in r.json()["results"]:
+        assert res["status"] == 200
+        assert _body(res["row"]) == _reread(pool, res["tid"])
+
+def test_log_rows_follow_new_row(client, pool):
+    """日志的 *_new 字段取自算出的新行，与表里的当前行一致"""
+    _register(client, "e2ab70", area="w/h", rack_location="r1")
+    client.patch("/tags/e2ab70", json={"area": "", "rack_location": "", "qty": 4})
+    cur = pool.query("SELECT label_number, item, batch_no, qty, rack_location, area, updated_at FROM rfid_tags_current")[0]
+    log = pool.query("SELECT label_number, item, batch_no, qty_new, to_rack_location, area_new, updated_at "
+                     "FROM rfid_tags_log ORDER BY id DESC LIMIT 1")[0]
+    assert list(cur.values()) == list(log.values())
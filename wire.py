@@ -0,0 +1,70 @@
+# wire.py
+"""标签行的紧凑传输格式（首次全量同步用）。
+
+columnar：按列存放，不再每行重复 15 个键名；area / item / rack_location / updated_by
+这类高度重复的字符串做字典编码（列里存下标，字典单独发一次）：
+
+    {"columns": ["tid", ...],
+     "dicts":   {"area": ["W/H", "KITING"], ...},
+     "data":    [[tid0, tid1, ...], ..., [0, 1, 0, null, ...], ...]}
+
+data[i] 对应 columns[i]；字典编码列里的 null 仍是 null。
+同一结构可以用 JSON 发，也可以用 MessagePack 发（需 pip install msgpack）。
+"""
+import json
+from datetime import datetime, date
+from decimal import Decimal
+
+# 做字典编码的列
+DICT_COLS = ("area", "item", "rack_location", "updated_by")
+
+def json_default(o):
+    # 与 FastAPI jsonable_encoder 的输出一致
+    if isinstance(o, (datetime, date)):
+        return o.isoformat()
+    if isinstance(o, Decimal):
+        return float(o)
+    if isinstance(o, (bytes, bytearray)):
+        return o.decode()
+    raise TypeError(f"not JSON serializable: {type(o).__name__}")
+
+def dumps(obj) -> bytes:
+    """与 JSONResponse 相同的紧凑 JSON"""
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":"), default=json_default).encode("utf-8")
+
+def encode_columnar(rows: list[dict], columns: list[str] | None = None, dict_cols=DICT_COLS) -> dict:
+    if columns is None:
+        columns = list(rows[0]) if rows else []
+    data, dicts = [], {}
+    for col in columns:
+        values = [r[col] for r in rows]
+        if col in dict_cols:
+            ids, words = {}, []
+            for i, v in enumerate(values):
+                if v is not None:
+                    k = ids.get(v)
+                    if k is None:
+                        k = ids[v] = len(words)
+                        words.append(v)
+                    values[i] = k
+            dicts[col] = words
+        data.append(values)
+    return {"columns": columns, "dicts": dicts, "data": data}
+
+def decode_columnar(obj: dict) -> list[dict]:
+    """encode_columnar 的逆过程（客户端 / 测试用）"""
+    cols = []
+    for col, values in zip(obj["columns"], obj["data"]):
+        words = obj["dicts"].get(col)
+        if words is not None:
+            values = [None if v is None else words[v] for v in values]
+        cols.append(values)
+    return [dict(zip(obj["columns"], row)) for row in zip(*cols)]
+
+def packb(obj) -> bytes:
+    import msgpack
+    return msgpack.packb(obj, default=json_default, use_bin_type=True)
+
+def unpackb(data: bytes):
+    import msgpack
+    return msgpack.unpackb(data, raw=False)